@@ -0,0 +1,145 @@
+"""
+Synthetic sensor payloads for benchmarks
+
+Payloads follow the shapes the devices send (see riderLogMQReceiver/README.md):
+BLE, LTE V1, LTE V2 (with LOCATION) and Nonesub. Values are random but
+realistic (gravity on ACCEL_Z, small gyro noise, a slowly moving position)
+and deterministic for a given seed.
+"""
+import random
+from datetime import datetime
+
+import numpy as np
+
+GRAVITY = 16384
+START_MS = 1715000000000
+
+
+def _title_date(time_ms):
+    return datetime.fromtimestamp(time_ms / 1000).strftime('%Y%m%d')
+
+
+def _imu_block(rng, samples, attitude_per_sample):
+    accel, gyro, attitude = [], [], []
+    for _ in range(samples):
+        accel += [rng.randint(-800, 800), rng.randint(-800, 800), GRAVITY + rng.randint(-600, 600)]
+        gyro += [rng.randint(-60, 60), rng.randint(-60, 60), rng.randint(-60, 60)]
+        attitude += [round(rng.uniform(-1, 1), 5) for _ in range(attitude_per_sample)]
+    return {"ACCEL": accel, "GYRO": gyro, "ATTITUDE": attitude}
+
+
+def _gnss(rng):
+    return {
+        "POSITION": [round(37.5 + rng.uniform(0, 0.1), 6), round(126.9 + rng.uniform(0, 0.1), 6)],
+        "VELOCITY": rng.randint(0, 60),
+        "ALTITUDE": rng.randint(0, 120),
+        "BEARING": round(rng.uniform(0, 360), 2),
+    }
+
+
+def ble_payload(samples=50, sensor_id="sensor0001", phone_num="01012345678", start_ms=START_MS,
+                interval_ms=20, seed=0):
+    """BLE payload with one IMU entry (ACCEL/GYRO 3 values, ATTITUDE 2) per sample."""
+    rng = random.Random(seed)
+    imu = [{str(start_ms + i * interval_ms): _imu_block(rng, 1, 2)} for i in range(samples)]
+    return {"TITLE": f"{sensor_id}_{phone_num}_{_title_date(start_ms)}", "IMU": imu, "GNSS": _gnss(rng)}
+
+
+def lte_payload(samples=250, per_block=25, sensor_id="sensor0001", phone_num="01012345678",
+                start_ms=START_MS, seed=0):
+    """LTE V1 payload: samples // per_block IMU blocks of per_block samples, 5 s apart."""
+    rng = random.Random(seed)
+    blocks = max(samples // per_block, 1)
+    imu = [{str(start_ms + i * 5000): _imu_block(rng, per_block, 3)} for i in range(blocks)]
+    return {
+        "TITLE": f"{sensor_id}_{phone_num}",
+        "IMU": imu,
+        "GNSS": _gnss(rng),
+        "TRAVEL": {"TIME": rng.randint(0, 3600), "DISTANCE": round(rng.uniform(0, 50), 2)},
+    }
+
+
+def lte_v2_payload(samples=500, per_block=50, sensor_id="sensor0001", phone_num="01012345678",
+                   start_ms=START_MS, seed=0):
+    """LTE V2 payload: IMU blocks 10 s apart and a LOCATION list (LAT, LON, ALTITUDE, VELOCITY per sample)."""
+    rng = random.Random(seed)
+    blocks = max(samples // per_block, 1)
+    imu = [{str(start_ms + i * 10000): _imu_block(rng, per_block, 3)} for i in range(blocks)]
+    location = []
+    for _ in range(per_block):
+        location += [round(37.5 + rng.uniform(0, 0.1), 6), round(126.9 + rng.uniform(0, 0.1), 6),
+                     rng.randint(0, 120), rng.randint(0, 60)]
+    return {
+        "TITLE": f"{sensor_id}_{phone_num}",
+        "IMU": imu,
+        "GNSS": _gnss(rng),
+        "TRAVEL": {"TIME": rng.randint(0, 3600), "DISTANCE": round(rng.uniform(0, 50), 2)},
+        "LOCATION": location,
+    }
+
+
+def nonesub_payload(phone_num="01012345678", time_ms=START_MS, seed=0):
+    """Nonesub payload: one GNSS fix."""
+    rng = random.Random(seed)
+    return {"TITLE": f"{phone_num}_{_title_date(time_ms)}", "TIME": str(time_ms), "GNSS": _gnss(rng)}
+
+
+PAYLOADS = {
+    "ble": ble_payload,
+    "ltev1": lte_payload,
+    "ltev2": lte_v2_payload,
+    "nonesub": lambda samples=1, **kwargs: nonesub_payload(**kwargs),
+}
+
+
+def payloads(data_type, count, samples, sensors=10):
+    """count payloads of data_type with samples IMU samples each, spread over sensors sensor IDs."""
+    make = PAYLOADS[data_type]
+    result = []
+    for i in range(count):
+        kwargs = {"seed": i}
+        if data_type != "nonesub":
+            kwargs["sensor_id"] = f"sensor{i % sensors:04d}"
+            kwargs["start_ms"] = START_MS + i * 10000
+        else:
+            kwargs["time_ms"] = START_MS + i * 1000
+        result.append(make(samples=samples, **kwargs))
+    return result
+
+
+def sensor_frame(rows, sensors=1, falls=1, interval_ms=40, seed=0):
+    """
+    Flattened IMU samples (the accident_detect() input) as a DataFrame.
+
+    rows samples are split evenly over sensors; falls falls are injected per
+    sensor at evenly spaced points (|ACCEL_X| and |GYRO_Y| above, ACCEL_Z below
+    the thresholds for 6 samples).
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    per_sensor = rows // sensors
+    frames = []
+    for number in range(sensors):
+        accel_x = rng.integers(-800, 800, per_sensor)
+        gyro_y = rng.integers(-60, 60, per_sensor)
+        accel_z = GRAVITY + rng.integers(-600, 600, per_sensor)
+        for fall in range(falls):
+            start = (fall + 1) * per_sensor // (falls + 1)
+            sign = 1 if fall % 2 == 0 else -1
+            accel_x[start:start + 6] = sign * 20000
+            gyro_y[start:start + 6] = -sign * 4000
+            accel_z[start:start + 6] = 3000
+        frames.append(pd.DataFrame({
+            "sensor_id": f"sensor{number:04d}",
+            "phone_num": "01012345678",
+            "time": START_MS + np.arange(per_sensor, dtype=np.int64) * interval_ms,
+            "ACCEL_X": accel_x,
+            "ACCEL_Y": rng.integers(-800, 800, per_sensor),
+            "ACCEL_Z": accel_z,
+            "GYRO_X": rng.integers(-60, 60, per_sensor),
+            "GYRO_Y": gyro_y,
+            "GYRO_Z": rng.integers(-60, 60, per_sensor),
+            "VELOCITY": rng.integers(0, 60, per_sensor),
+        }))
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,284 @@
+"""
+Micro-benchmarks for the processors, the Celery task bodies and accident_detect.
+
+    python benchmarks/run_benchmarks.py                      # everything, results/<stamp>.json
+    python benchmarks/run_benchmarks.py --only processors --sizes 25,250
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/baseline.json
+
+Every case reports records/sec, per-call latency percentiles and the peak
+memory allocated by one call. Results are written as JSON; --compare prints
+the change against an earlier result file and exits with 1 when a case got
+slower than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.join(REPO, "kafka_message_processor"))
+
+from benchmarks.payloads import payloads, sensor_frame  # noqa: E402
+
+# Calls traced for peak memory (tracemalloc slows calls down, so it is a separate pass)
+MEMORY_CALLS = 20
+
+
+def measure(group, name, size, func, inputs):
+    """Runs func over inputs and returns the result record of the case."""
+    latencies = []
+    rows = 0
+    for value in inputs:
+        started = time.perf_counter()
+        result = func(value)
+        latencies.append(time.perf_counter() - started)
+        rows += len(result) if result is not None else 0
+
+    tracemalloc.start()
+    peak = 0
+    for value in inputs[:MEMORY_CALLS]:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func(value)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    seconds = sum(latencies)
+    latency_ms = np.array(latencies) * 1000
+    record = {
+        "group": group,
+        "name": name,
+        "size": size,
+        "calls": len(inputs),
+        "rows": rows,
+        "seconds": round(seconds, 6),
+        "records_per_sec": round(rows / seconds, 1) if seconds else None,
+        "p50_ms": round(float(np.percentile(latency_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(latency_ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(latency_ms, 99)), 4),
+        "peak_kib": round(peak / 1024, 1),
+    }
+    print(f"{group:<11} {name:<32} {size:>9} {record['records_per_sec'] or 0:>14,.0f} rec/s "
+          f"p50 {record['p50_ms']:>9.3f} ms  p95 {record['p95_ms']:>9.3f} ms  "
+          f"p99 {record['p99_ms']:>9.3f} ms  peak {record['peak_kib']:>10,.1f} KiB")
+    return record
+
+
+def bench_processors(sizes, count):
+    from kafka_consumer.processor import PROCESSORS, COLUMNAR_PROCESSORS
+
+    results = []
+    for data_type in PROCESSORS:
+        for size in ([1] if data_type == "nonesub" else sizes):
+            inputs = payloads(data_type, count, size)
+            process = PROCESSORS[data_type]
+            flatten = COLUMNAR_PROCESSORS[data_type]
+            results.append(measure("processors", f"{process.__name__}", size, process, inputs))
+            results.append(measure("processors", f"{flatten.__name__}", size, flatten, inputs))
+            results.append(measure("processors", f"{flatten.__name__}+to_records", size,
+                                   lambda payload: flatten(payload).to_records(), inputs))
+    return results
+
+
+class MemoryCollection:
+    """In-memory stand-in for a pymongo collection: counts what the task bodies write."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.documents = 0
+
+    def insert_many(self, documents, ordered=True):
+        self.documents += len(documents)
+
+    def insert_one(self, document):
+        self.documents += 1
+
+    def bulk_write(self, requests, ordered=True):
+        self.documents += len(requests)
+
+    def create_index(self, keys, **kwargs):
+        return "_".join(str(key) for key, _ in keys)
+
+    def with_options(self, **kwargs):
+        return self
+
+
+class MemoryDatabase:
+    """In-memory stand-in for a pymongo database."""
+
+    def __init__(self, name):
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name):
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = MemoryCollection(self, name)
+        return collection
+
+
+def bench_tasks(sizes, count, log_dir):
+    from riderLogMQReceiver.config import Config
+
+    # Raw payload logs go to a scratch directory instead of /home/ubuntu/log
+    Config.LOG_DIRS = {key: os.path.join(log_dir, key) for key in Config.LOG_DIRS}
+    from riderLogMQReceiver import tasks
+
+    tasks.Doc_BLE = MemoryDatabase("BLE")
+    tasks.Doc_LTE = MemoryDatabase("LTE")
+    tasks.Doc_Nonesub = MemoryDatabase("Nonesub")
+    task_bodies = {
+        "ble": tasks.receiveBLE_Data,
+        "ltev1": tasks.receiveLTE_Data,
+        "ltev2": tasks.receiveLTE_V2_Data,
+        "nonesub": tasks.receiveNonesub_Data,
+    }
+
+    def run(task):
+        def call(payload):
+            task(payload)
+            # Rows written: the IMU samples of the payload
+            return range(_sample_count(payload))
+        return call
+
+    results = []
+    for data_type, task in task_bodies.items():
+        # receiveLTE_V2_Data reads the delivery info of the running task
+        task.push_request(delivery_info={"exchange": "benchmark"})
+        try:
+            for size in ([1] if data_type == "nonesub" else sizes):
+                results.append(measure("tasks", task.name.rsplit(".", 1)[-1], size,
+                                       run(task), payloads(data_type, count, size)))
+        finally:
+            task.pop_request()
+    return results
+
+
+def _sample_count(payload):
+    if "IMU" not in payload:
+        return 1
+    return sum(len(values["ACCEL"]) // 3 for block in payload["IMU"] for values in block.values())
+
+
+def bench_accident(rows_list, sensors, repeat):
+    from riderLogMQReceiver.accident_detection import accident_detect
+
+    def detect(data):
+        accident_detect(data)
+        return data
+
+    results = []
+    for rows in rows_list:
+        for sensor_count in sorted({1, sensors}):
+            frame = sensor_frame(rows, sensors=sensor_count, falls=2)
+            results.append(measure("accident", f"accident_detect[{sensor_count} sensors]", rows,
+                                   detect, [frame] * repeat))
+    return results
+
+
+@contextmanager
+def _working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(record):
+    return record["group"], record["name"], record["size"]
+
+
+def compare(results, baseline_path, threshold):
+    """Prints the change against a baseline result file. Returns the regressed cases."""
+    with open(baseline_path) as file:
+        baseline = {_key(record): record for record in json.load(file)["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline_path} (threshold {threshold:.0%})")
+    for record in results:
+        before = baseline.get(_key(record))
+        if before is None or not before["records_per_sec"] or not record["records_per_sec"]:
+            continue
+        throughput = record["records_per_sec"] / before["records_per_sec"] - 1
+        p95 = record["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        regressed = throughput < -threshold or p95 > threshold
+        if regressed:
+            regressions.append(record)
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {record['group']:<11} {record['name']:<32} "
+              f"{record['size']:>9}  rec/s {throughput:+7.1%}  p95 {p95:+7.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--only", default="processors,tasks,accident",
+                        help="comma separated groups: processors, tasks, accident")
+    parser.add_argument("--sizes", default="25,250,1000", help="IMU samples per payload")
+    parser.add_argument("--payloads", type=int, default=200, help="payloads per case")
+    parser.add_argument("--accident-rows", default="10000,100000,1000000", help="rows per accident_detect call")
+    parser.add_argument("--accident-sensors", type=int, default=10, help="sensors of the multi-sensor case")
+    parser.add_argument("--repeat", type=int, default=3, help="accident_detect calls per case")
+    parser.add_argument("--output", help="result file (default benchmarks/results/<stamp>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as regression")
+    args = parser.parse_args()
+
+    groups = set(args.only.split(","))
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = []
+    with tempfile.TemporaryDirectory() as scratch, _working_directory(scratch):
+        # accident_detect and the task bodies write log files; keep them in the scratch directory
+        if "processors" in groups:
+            results += bench_processors(sizes, args.payloads)
+        if "tasks" in groups:
+            results += bench_tasks(sizes, args.payloads, scratch)
+        if "accident" in groups:
+            rows_list = [int(rows) for rows in args.accident_rows.split(",")]
+            results += bench_accident(rows_list, args.accident_sensors, args.repeat)
+
+    import pandas as pd
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        REPO, "benchmarks", "results", f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
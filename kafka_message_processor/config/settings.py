@@ -1,9 +1,170 @@
 """
 Kafka and other settings
 """
+import os
 
 # Kafka settings
 KAFKA_BROKERS = ['localhost:9092']
 SOURCE_TOPIC = 'source_topic'
 DESTINATION_TOPIC = 'destination_topic'
 CONSUMER_GROUP_ID = 'my-group'
+
+# Routing settings
+# Topics to subscribe to; add the per-type topics of SOURCE_TOPIC_TYPES here
+SOURCE_TOPICS = [SOURCE_TOPIC]
+# Header carrying the data type ('ble', 'ltev1', 'ltev2', 'nonesub') of a record
+TYPE_HEADER = 'data_type'
+# Source topic -> data type, for topics carrying a single data type
+SOURCE_TOPIC_TYPES = {}
+# Data type -> destination topic; types not listed go to DESTINATION_TOPIC
+DESTINATION_TOPICS = {}
+# Use sensor_id (phone_num for Nonesub) as the record key for per-sensor partitioning
+KEYED_OUTPUT = False
+
+# Consumer pool settings (run_pool.py)
+CONSUMER_WORKERS = None  # None uses os.cpu_count()
+WORKER_RESTART_DELAY_S = 5
+WORKER_SHUTDOWN_TIMEOUT_S = 30
+
+# Producer settings
+# Keep many sends in flight and flush only once per poll batch instead of per message
+ASYNC_PRODUCE = False
+PRODUCER_ACKS = 1
+# Batching of asynchronous sends (ASYNC_PRODUCE, MANUAL_COMMIT, pipeline, replay, bridge);
+# synchronous sends keep the client defaults
+PRODUCER_LINGER_MS = 20
+PRODUCER_BATCH_SIZE = 256 * 1024
+PRODUCER_COMPRESSION = 'gzip'  # None, 'gzip', 'snappy', 'lz4' or 'zstd'
+PRODUCER_MAX_IN_FLIGHT = 5
+
+# Offset commit settings
+# At-least-once: disable auto commit and commit only offsets whose output is acknowledged.
+# Implies asynchronous producing; use PRODUCER_ACKS = 'all' for full durability.
+MANUAL_COMMIT = False
+COMMIT_INTERVAL_RECORDS = 5000
+COMMIT_INTERVAL_MS = 5000
+
+# Pipeline settings (see pipeline.py)
+# Run poll, process and produce as separate threads connected by bounded queues
+PIPELINE_ENABLED = False
+# Processing threads; each partition is always handled by the same thread
+PIPELINE_PROCESS_THREADS = 1
+# Capacity (records) of each process queue and of the produce queue
+PIPELINE_QUEUE_SIZE = 1000
+# A partition is paused with this many records between poll and produce, resumed at half
+PIPELINE_PARTITION_MAX_INFLIGHT = 2000
+# The produce stage waits for acknowledgements at least this often (ms)
+PIPELINE_FLUSH_INTERVAL_MS = 100
+
+# Deserializer settings
+JSON_BACKEND = 'json'  # 'json', 'orjson' or 'ujson'
+
+# Duplicate sample suppression (see dedup.py)
+# Drop samples whose (sensor_id or phone_num, time) was already seen
+DEDUP_ENABLED = False
+# Sample times kept per sensor, behind its newest sample (ms)
+DEDUP_WINDOW_MS = 10 * 60 * 1000
+# Sensors not seen for this long are dropped (seconds), and at most DEDUP_MAX_SENSORS are kept
+DEDUP_IDLE_S = 600
+DEDUP_MAX_SENSORS = 10000
+
+# Dead-letter / retry settings (see deadletter.py)
+# Publish failed records to DEAD_LETTER_TOPIC, and retry transient failures through RETRY_TOPIC
+DEAD_LETTER_ENABLED = False
+DEAD_LETTER_TOPIC = 'source_topic_dlq'
+RETRY_TOPIC = 'source_topic_retry'
+# Retries of a transient failure before it is dead-lettered, RETRY_BACKOFF_MS apart (doubling)
+RETRY_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_MS = 1000
+
+# Summary settings (see summary.py)
+# Also send per-sensor window summaries of the IMU samples (BLE / LTE) to SUMMARY_TOPIC
+SUMMARY_ENABLED = False
+SUMMARY_TOPIC = 'summary_topic'
+# Window size by sample time (ms)
+SUMMARY_WINDOW_MS = 1000
+# A window is closed once the sensor's newest sample is this far past its end (ms)
+SUMMARY_ALLOWED_LATENESS_MS = 5000
+# Sensors not seen for this long have their windows closed (seconds), and at most SUMMARY_MAX_SENSORS are kept
+SUMMARY_IDLE_S = 60
+SUMMARY_MAX_SENSORS = 10000
+
+# Load shedding settings (see shedding.py)
+# Degrade processing while the consumer falls behind, back to full fidelity once it has caught up
+SHED_ENABLED = False
+# Lag (records behind the high watermark, summed over partitions) and age of the newest polled
+# record (ms) entering level 1 (degraded) and level 2 (deferring)
+SHED_LAG_THRESHOLDS = (50000, 200000)
+SHED_LATENCY_THRESHOLDS_MS = (60 * 1000, 5 * 60 * 1000)
+# A level is left once lag and age stay below this fraction of its thresholds for SHED_RECOVERY_S seconds
+SHED_RECOVERY_RATIO = 0.5
+SHED_RECOVERY_S = 30
+# Level 1: per-record logging is skipped and the IMU samples of these types are downsampled to every
+# SHED_DOWNSAMPLE_FACTOR-th sample (samples over the accident thresholds are always kept)
+SHED_DOWNSAMPLE_TYPES = ['ble', 'ltev1', 'ltev2']
+SHED_DOWNSAMPLE_FACTOR = 4
+# Level 2: records of these types are moved unprocessed to SHED_DEFER_TOPIC, consumed once below level 2
+SHED_DEFER_TYPES = ['nonesub']
+SHED_DEFER_TOPIC = 'source_topic_deferred'
+
+# Output settings
+# 'records': one message per IMU sample, 'envelope': one message per payload (see envelope.py)
+OUTPUT_FORMAT = 'records'
+ENVELOPE_COMPRESSION = False
+
+# MongoDB settings (replay / sink), same environment as riderLogMQReceiver
+MONGO_URI = os.environ.get('DOCDB_URI')
+MONGO_TLS_CA = os.environ.get('TLSCA_path')
+MONGO_MAX_POOL_SIZE = 50
+# Data type -> database, as written by the riderLogMQReceiver Celery tasks
+MONGO_DATABASES = {'ble': 'BLE', 'ltev1': 'LTE', 'ltev2': 'LTE', 'nonesub': 'Nonesub'}
+
+# MongoDB sink settings (run_sink.py)
+# Destination topics to store; add the per-type topics of DESTINATION_TOPICS here
+SINK_TOPICS = [DESTINATION_TOPIC]
+SINK_GROUP_ID = 'mongo-sink'
+# A collection's buffer is written at this many rows or after this long (ms)
+SINK_BATCH_DOCUMENTS = 5000
+SINK_BATCH_MS = 1000
+# Unordered insert_many calls in flight at once (keep below MONGO_MAX_POOL_SIZE)
+SINK_WRITE_CONCURRENCY = 4
+# Retries of a failed write, with exponential backoff from SINK_RETRY_BACKOFF_MS
+SINK_WRITE_RETRIES = 3
+SINK_RETRY_BACKOFF_MS = 500
+
+# RabbitMQ bridge settings (run_bridge.py)
+# Republish the Celery task messages of riderLogMQReceiver to BRIDGE_TOPIC with the data type header
+BRIDGE_AMQP_URI = os.environ.get('AMQPS_URI')
+BRIDGE_TOPIC = SOURCE_TOPIC
+# Celery queues to take the messages from (the Celery workers no longer get them)
+BRIDGE_QUEUES = ['celery']
+# Mirror mode: consume copies from BRIDGE_MIRROR_QUEUE, bound to BRIDGE_EXCHANGE with the routing keys
+# of the Celery queues, so the Celery workers keep getting every message
+BRIDGE_MIRROR = False
+BRIDGE_MIRROR_QUEUE = 'kafka_bridge_mirror'
+BRIDGE_EXCHANGE = 'celery'
+BRIDGE_ROUTING_KEYS = ['celery']
+# Copies kept while the bridge is behind or stopped; the oldest are dropped beyond this
+BRIDGE_MIRROR_MAX_LENGTH = 1000000
+# Messages per Kafka batch (also the AMQP prefetch) and the longest the first one waits (ms)
+BRIDGE_BATCH_SIZE = 500
+BRIDGE_BATCH_MS = 200
+
+# Streaming accident detection (see accident.py)
+ACCIDENT_DETECTION = False
+ACCIDENT_TOPIC = 'accident_topic'
+# Fallen samples further apart than this are separate accidents (ms)
+ACCIDENT_GAP_MS = 10000
+# Samples kept per sensor for the impact / pre-accident speed window
+ACCIDENT_BUFFER_SAMPLES = 4096
+# Sensors not seen for this long are dropped (seconds), and at most ACCIDENT_MAX_SENSORS are kept
+ACCIDENT_IDLE_S = 600
+ACCIDENT_MAX_SENSORS = 10000
+
+# Metrics settings (see metrics.py)
+# Serve Prometheus text format metrics on http://<host>:METRICS_PORT/metrics
+# (run_pool.py workers use METRICS_PORT + worker index)
+METRICS_ENABLED = False
+METRICS_PORT = 9108
+# Histogram buckets for durations (seconds)
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
@@ -0,0 +1,195 @@
+"""
+Streaming accident detection
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from config.settings import (
+    ACCIDENT_GAP_MS, ACCIDENT_BUFFER_SAMPLES, ACCIDENT_IDLE_S, ACCIDENT_MAX_SENSORS,
+)
+from .columnar import ColumnarBatch, float_column
+
+logger = logging.getLogger(__name__)
+
+# Fall thresholds, as in riderLogMQReceiver/accident_detection.py
+ACCEL_THRESHOLD = 16384
+GYRO_THRESHOLD = 3000
+
+# Ring buffer columns
+COLUMNS = ("time", "VELOCITY", "ACCEL_X", "ACCEL_Y", "ACCEL_Z", "GYRO_Y")
+TIME, VELOCITY, ACCEL_X, ACCEL_Y, ACCEL_Z, GYRO_Y = range(len(COLUMNS))
+
+
+class SensorWindow:
+    """
+    Bounded ring buffer of one sensor's recent samples.
+
+    Holds the samples since the end of the sensor's last accident (at most
+    capacity of them), which is the window accident_detect() takes the impact
+    and pre-accident speed figures from.
+    """
+    __slots__ = ("buffer", "position", "count", "last_fallen", "last_seen")
+
+    def __init__(self, capacity):
+        self.buffer = np.empty((capacity, len(COLUMNS)), dtype=np.float64)
+        self.position = 0
+        self.count = 0
+        self.last_fallen = None
+        self.last_seen = time.monotonic()
+
+    def append(self, block):
+        capacity = len(self.buffer)
+        if len(block) >= capacity:
+            block = block[-capacity:]
+        index = (self.position + np.arange(len(block))) % capacity
+        self.buffer[index] = block
+        self.position = (self.position + len(block)) % capacity
+        self.count = min(self.count + len(block), capacity)
+
+    def window(self):
+        """Returns the buffered samples, oldest first."""
+        capacity = len(self.buffer)
+        return self.buffer[(self.position - self.count + np.arange(self.count)) % capacity]
+
+    def clear(self):
+        self.count = 0
+
+
+def _sample_block(flattened):
+    """
+    Returns (sensor_id, phone_num, samples array in COLUMNS order) of a flattened payload.
+    Samples with a missing or non-numeric column are left out.
+    """
+    if isinstance(flattened, ColumnarBatch):
+        sensor_id = flattened.fields.get("sensor_id")
+        phone_num = flattened.fields.get("phone_num")
+        if sensor_id is None or not len(flattened):
+            return None, None, None
+        block = np.column_stack([float_column(flattened, column) for column in COLUMNS])
+    else:
+        if not flattened or "sensor_id" not in flattened[0]:
+            return None, None, None
+        sensor_id = flattened[0]["sensor_id"]
+        phone_num = flattened[0].get("phone_num")
+        block = np.column_stack([float_column(flattened, column) for column in COLUMNS])
+    valid = np.isfinite(block).all(axis=1)
+    if not valid.all():
+        logger.debug(f"Skipped {int((~valid).sum())} non-numeric samples of sensor {sensor_id}")
+        block = block[valid]
+        if not len(block):
+            return None, None, None
+    return sensor_id, phone_num, block
+
+
+def _accident(sensor_id, phone_num, window, fallen):
+    """Builds the alert for one accident from its window and its fallen samples."""
+    accel_x, accel_y, accel_z = window[:, ACCEL_X], window[:, ACCEL_Y], window[:, ACCEL_Z]
+    impact_xyz = np.round(np.sqrt(accel_x ** 2 + accel_y ** 2 + accel_z ** 2), 2)
+    impact_xy = np.round(np.sqrt(accel_x ** 2 + accel_y ** 2), 2)
+    impact_index = int(np.argmax(impact_xyz))
+
+    if fallen[:, GYRO_Y].min() < -GYRO_THRESHOLD and fallen[:, ACCEL_X].max() > ACCEL_THRESHOLD:
+        direction = "LEFT"
+    elif fallen[:, GYRO_Y].max() > GYRO_THRESHOLD and fallen[:, ACCEL_X].min() < -ACCEL_THRESHOLD:
+        direction = "RIGHT"
+    else:
+        direction = "None"
+
+    accident_time = datetime.fromtimestamp(fallen[0, TIME] / 1000)
+    return {
+        "date": accident_time.strftime("%Y%m%d"),
+        "sensor_id": sensor_id,
+        "phone_num": phone_num,
+        "time": int(fallen[0, TIME]),
+        "accident_time": accident_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "fallen_direction": direction,
+        "impact_scalar_xyz": float(impact_xyz[impact_index]),
+        "impact_scalar_xy": float(impact_xy.max()),
+        "before_accident_max_speed": float(window[:, VELOCITY].max()),
+        "before_accident_mean_speed": float(window[:, VELOCITY].mean()),
+        "impact_degree": float(np.round(np.degrees(np.arctan2(accel_y[impact_index], accel_x[impact_index])), 2)),
+    }
+
+
+class AccidentDetector:
+    """
+    Incremental counterpart of accident_detect() for the consumer pipeline.
+
+    Samples are kept per sensor_id in a SensorWindow. An alert is raised as soon
+    as the first fallen sample of an accident arrives, with the impact and speed
+    figures of the window up to the end of that payload; fallen samples less than
+    gap_ms after the previous one belong to the same accident and raise nothing.
+    Sensors idle for idle_s seconds are dropped, and at most max_sensors are kept
+    (least recently seen first out), which bounds memory. update() and evict()
+    may be called from different threads (see pipeline.py).
+    """
+
+    def __init__(self, capacity=ACCIDENT_BUFFER_SAMPLES, gap_ms=ACCIDENT_GAP_MS,
+                 idle_s=ACCIDENT_IDLE_S, max_sensors=ACCIDENT_MAX_SENSORS):
+        self.capacity = capacity
+        self.gap_ms = gap_ms
+        self.idle_s = idle_s
+        self.max_sensors = max_sensors
+        self.sensors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, flattened):
+        """Adds the samples of one flattened payload and returns the new accident alerts."""
+        sensor_id, phone_num, block = _sample_block(flattened)
+        if sensor_id is None:
+            return []
+        with self._lock:
+            return self._update(sensor_id, phone_num, block)
+
+    def _update(self, sensor_id, phone_num, block):
+        state = self.sensors.get(sensor_id)
+        if state is None:
+            state = self.sensors[sensor_id] = SensorWindow(self.capacity)
+            if len(self.sensors) > self.max_sensors:
+                self.sensors.popitem(last=False)
+        else:
+            self.sensors.move_to_end(sensor_id)
+        state.last_seen = time.monotonic()
+
+        fallen = ((np.abs(block[:, ACCEL_X]) > ACCEL_THRESHOLD)
+                  & (np.abs(block[:, GYRO_Y]) > GYRO_THRESHOLD)
+                  & (block[:, ACCEL_Z] < ACCEL_THRESHOLD))
+        fallen_pos = np.flatnonzero(fallen)
+        if len(fallen_pos) == 0:
+            state.append(block)
+            return []
+
+        # Split the fallen samples of the payload into accidents
+        gaps = np.flatnonzero(np.diff(block[fallen_pos, TIME]) > self.gap_ms) + 1
+        events = np.split(fallen_pos, gaps)
+        alerts = []
+        consumed = 0
+        for number, event in enumerate(events):
+            continued = (number == 0 and state.last_fallen is not None
+                         and block[event[0], TIME] - state.last_fallen <= self.gap_ms)
+            if not continued:
+                window_end = events[number + 1][0] if number + 1 < len(events) else len(block)
+                window = np.concatenate([state.window(), block[consumed:window_end]])
+                alerts.append(_accident(sensor_id, phone_num, window, block[event]))
+            # The next accident's window starts after this accident's last fallen sample
+            state.last_fallen = block[event[-1], TIME]
+            state.clear()
+            consumed = event[-1] + 1
+        state.append(block[consumed:])
+        return alerts
+
+    def evict(self):
+        """Drops sensors not seen for idle_s seconds. Returns how many were dropped."""
+        deadline = time.monotonic() - self.idle_s
+        evicted = 0
+        with self._lock:
+            while self.sensors:
+                sensor_id, state = next(iter(self.sensors.items()))
+                if state.last_seen > deadline:
+                    break
+                del self.sensors[sensor_id]
+                evicted += 1
+        return evicted
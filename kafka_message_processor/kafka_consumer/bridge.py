@@ -0,0 +1,207 @@
+"""
+RabbitMQ to Kafka bridge for the Celery task messages of riderLogMQReceiver
+"""
+import logging
+import signal
+import socket
+import time
+from kombu import Connection, Consumer, Exchange, Queue
+from kombu.entity import binding
+from config.settings import (
+    BRIDGE_AMQP_URI, BRIDGE_QUEUES, BRIDGE_TOPIC, BRIDGE_MIRROR, BRIDGE_MIRROR_QUEUE, BRIDGE_MIRROR_MAX_LENGTH,
+    BRIDGE_EXCHANGE, BRIDGE_ROUTING_KEYS, BRIDGE_BATCH_SIZE, BRIDGE_BATCH_MS, METRICS_ENABLED, METRICS_PORT,
+)
+from .metrics import REGISTRY, start_metrics_server
+from .processor import BLE, LTE, LTE_V2, NONESUB
+from .producer import get_producer
+from .routing import record_headers, record_key
+
+logger = logging.getLogger(__name__)
+
+# Celery task (last part of the task name) -> data type of its payload
+TASK_TYPES = {
+    "receiveBLE_Data": BLE,
+    "receiveLTE_Data": LTE,
+    "receiveLTE_V2_Data": LTE_V2,
+    "receiveNonesub_Data": NONESUB,
+}
+
+# Wait before taking new messages after a failed publish, so a Kafka outage does not spin on redeliveries
+RETRY_DELAY_S = 1
+
+# Global flag for graceful shutdown
+running = True
+
+def signal_handler(sig, frame):
+    """Handle shutdown signals gracefully."""
+    global running
+    logger.info("Shutdown signal received. Stopping bridge...")
+    running = False
+
+def unwrap_task_message(body, headers):
+    """
+    Returns (task name, payload) of a decoded Celery task message: protocol 2
+    (task name in the headers, body [args, kwargs, embed]) or protocol 1 (body
+    {"task", "args", "kwargs"}). The payload is the first argument of the task.
+    """
+    if headers and "task" in headers:
+        task = headers["task"]
+        args, kwargs = body[0], body[1]
+    else:
+        task = body["task"]
+        args, kwargs = body.get("args") or (), body.get("kwargs") or {}
+    payload = args[0] if args else kwargs["payload"]
+    return task, payload
+
+def task_data_type(task):
+    """Returns the data type of a bridged Celery task name, or None for other tasks."""
+    return TASK_TYPES.get(task.rsplit(".", 1)[-1])
+
+def bridge_queues(mirror=BRIDGE_MIRROR):
+    """
+    Returns the queues to consume. Without mirror, the Celery queues themselves
+    (the bridge takes the messages over from the workers). With mirror, a queue
+    of our own bound to the Celery exchange with the same routing keys, so
+    RabbitMQ delivers a copy of every message to both.
+    """
+    if not mirror:
+        return [Queue(name, no_declare=True) for name in BRIDGE_QUEUES]
+    exchange = Exchange(BRIDGE_EXCHANGE, type="direct", durable=True)
+    # Bounded so that a stopped bridge cannot fill up the broker; the oldest copies are dropped first
+    arguments = {"x-max-length": BRIDGE_MIRROR_MAX_LENGTH, "x-overflow": "drop-head"}
+    bindings = [binding(exchange, routing_key=routing_key) for routing_key in BRIDGE_ROUTING_KEYS]
+    return [Queue(BRIDGE_MIRROR_QUEUE, bindings=bindings, durable=True, queue_arguments=arguments)]
+
+class KafkaBridge:
+    """
+    Republishes Celery task messages to Kafka in batches.
+
+    Messages are collected up to batch_size or batch_ms and their payloads sent
+    to the topic with the data type header (and the record key of KEYED_OUTPUT).
+    A message is acknowledged only once Kafka has acknowledged its record;
+    messages whose record failed are requeued. Messages that are not one of the
+    bridged tasks or cannot be decoded are rejected (to the queue's dead-letter
+    exchange, if any), or just acknowledged in mirror mode since they are copies.
+    """
+
+    def __init__(self, producer, topic=BRIDGE_TOPIC, batch_size=BRIDGE_BATCH_SIZE, batch_ms=BRIDGE_BATCH_MS,
+                 mirror=BRIDGE_MIRROR, registry=REGISTRY):
+        self.producer = producer
+        self.topic = topic
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.mirror = mirror
+        self.batch = []
+        self.started = None
+        self._records = registry.counter('bridge_records_total', 'Task messages published to Kafka', ('data_type',))
+        self._skipped = registry.counter('bridge_skipped_total', 'Task messages not bridged (other task or undecodable)')
+        self._failures = registry.counter('bridge_failures_total', 'Task messages requeued after a failed publish')
+
+    def on_message(self, message):
+        """kombu on_message callback: adds one task message to the batch."""
+        try:
+            task, payload = unwrap_task_message(message.decode(), message.headers)
+            data_type = task_data_type(task)
+        except Exception as e:
+            logger.warning(f"Undecodable task message {message.delivery_tag}: {e}")
+            data_type = None
+        if data_type is None:
+            self._skipped.inc()
+            if self.mirror:
+                message.ack()
+            else:
+                message.reject()
+            return
+        if not self.batch:
+            self.started = time.monotonic()
+        self.batch.append((message, data_type, payload))
+
+    def due(self):
+        """True when the batch is full or its first message has waited batch_ms."""
+        if not self.batch:
+            return False
+        return len(self.batch) >= self.batch_size or (time.monotonic() - self.started) * 1000 >= self.batch_ms
+
+    def publish(self):
+        """Sends the batch, waits for Kafka and acks (or requeues) each message. Returns the failure count."""
+        batch, self.batch = self.batch, []
+        if not batch:
+            return 0
+        futures = []
+        for message, data_type, payload in batch:
+            try:
+                key = record_key(payload)
+            except (KeyError, TypeError, AttributeError):
+                key = None
+            try:
+                futures.append(self.producer.send(self.topic, payload, key=key, headers=record_headers(data_type)))
+            except Exception as e:
+                logger.error(f"Failed to send task message {message.delivery_tag}: {e}")
+                futures.append(None)
+        self.producer.flush()
+
+        failed = [future is None or future.failed() for future in futures]
+        if not any(failed):
+            # One ack for the whole batch (every earlier delivery tag of the channel)
+            batch[-1][0].ack(multiple=True)
+        else:
+            for (message, _, _), failure in zip(batch, failed):
+                if failure:
+                    message.requeue()
+                else:
+                    message.ack()
+        counts = {}
+        for (_, data_type, _), failure in zip(batch, failed):
+            if not failure:
+                counts[data_type] = counts.get(data_type, 0) + 1
+        for data_type, count in counts.items():
+            self._records.inc(count, data_type=data_type)
+        failures = sum(failed)
+        if failures:
+            self._failures.inc(failures)
+            logger.error(f"{failures} of {len(batch)} task messages failed to publish to {self.topic}, requeued")
+        else:
+            logger.debug(f"Published {len(batch)} task messages to {self.topic}")
+        return failures
+
+def run_bridge(mirror=BRIDGE_MIRROR):
+    """Consumes the Celery task queues (or their mirror queue) and publishes the payloads to BRIDGE_TOPIC."""
+    global running
+
+    # Register signal handlers
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    if METRICS_ENABLED:
+        start_metrics_server(METRICS_PORT)
+
+    producer = get_producer(batched=True)
+    bridge = KafkaBridge(producer, mirror=mirror)
+    queues = bridge_queues(mirror)
+    connection = Connection(BRIDGE_AMQP_URI)
+    logger.info(f"Bridging {[queue.name for queue in queues]} to {BRIDGE_TOPIC} ({'mirror' if mirror else 'take over'})")
+
+    try:
+        with connection:
+            channel = connection.channel()
+            consumer = Consumer(channel, queues, on_message=bridge.on_message,
+                                prefetch_count=BRIDGE_BATCH_SIZE, accept=["json"])
+            with consumer:
+                while running:
+                    timeout = BRIDGE_BATCH_MS / 1000
+                    if bridge.batch:
+                        timeout = max(0.0, bridge.started + BRIDGE_BATCH_MS / 1000 - time.monotonic())
+                    try:
+                        connection.drain_events(timeout=timeout)
+                    except socket.timeout:
+                        pass
+                    if bridge.due() and bridge.publish():
+                        time.sleep(RETRY_DELAY_S)
+                # Publish what was already taken before the consumer is cancelled
+                bridge.publish()
+    except Exception as e:
+        logger.error(f"Error in bridge loop: {e}", exc_info=True)
+    finally:
+        logger.info("Closing bridge...")
+        producer.close()
+        logger.info("Bridge shutdown complete")
@@ -0,0 +1,228 @@
+"""
+Columnar flattening of sensor payloads
+"""
+import numpy as np
+
+BLE_FIELDS = (
+    "sensor_id", "phone_num", "time",
+    "ACCEL_X", "ACCEL_Y", "ACCEL_Z", "GYRO_X", "GYRO_Y", "GYRO_Z", "PITCH", "ROLL",
+    "LAT", "LON", "VELOCITY", "ALTITUDE", "BEARING",
+)
+LTE_FIELDS = BLE_FIELDS + ("TIME", "DISTANCE")
+NONESUB_FIELDS = ("phone_num", "time", "LAT", "LON", "VELOCITY", "ALTITUDE", "BEARING")
+
+IMU_FIELDS = ("ACCEL_X", "ACCEL_Y", "ACCEL_Z", "GYRO_X", "GYRO_Y", "GYRO_Z", "PITCH", "ROLL")
+LOCATION_FIELDS = ("LAT", "LON", "ALTITUDE", "VELOCITY")
+
+
+class ColumnarBatch:
+    """
+    Flattened samples of one payload, stored column-wise.
+
+    Values shared by every sample (sensor_id, GNSS, TRAVEL, ...) are kept once
+    in ``fields``; per-sample values are NumPy arrays in ``columns``. ``keys``
+    preserves the key order of the row dicts built by ``to_records()``.
+    ``data_type`` is set by the dispatcher (see processor.detect_data_type).
+    """
+    __slots__ = ("keys", "fields", "columns", "data_type")
+
+    def __init__(self, keys, fields, columns, data_type=None):
+        self.keys = keys
+        self.fields = fields
+        self.columns = columns
+        self.data_type = data_type
+
+    def __len__(self):
+        return len(self.columns["time"])
+
+    def get(self, key):
+        """Returns the column for key, broadcasting shared fields to an array."""
+        if key in self.columns:
+            return self.columns[key]
+        return np.full(len(self), self.fields[key], dtype=object)
+
+    def select(self, mask):
+        """Returns a batch with only the samples where mask (a boolean array) is set."""
+        columns = {key: column[mask] for key, column in self.columns.items()}
+        return ColumnarBatch(self.keys, self.fields, columns, self.data_type)
+
+    def to_records(self):
+        """Expands the batch into one dict per sample, as the row processors return."""
+        # Copying a template keeps the key order; only per-sample keys are overwritten.
+        template = {key: self.fields.get(key) for key in self.keys}
+        names = [key for key in self.keys if key in self.columns]
+        values = [self.columns[key].tolist() for key in names]
+        records = []
+        for row in zip(*values):
+            record = template.copy()
+            record.update(zip(names, row))
+            records.append(record)
+        return records
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def float_column(flattened, column):
+    """
+    Returns a column of flattened (a ColumnarBatch or list of dicts) as float64.
+    Missing values and values that are not numbers (e.g. VELOCITY "n/a") become NaN.
+    """
+    if isinstance(flattened, ColumnarBatch):
+        if column not in flattened.columns and column not in flattened.fields:
+            return np.full(len(flattened), np.nan)
+        values = flattened.get(column)
+    else:
+        values = [row.get(column) for row in flattened]
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([_to_float(value) for value in values], dtype=np.float64)
+
+
+def _typed(values):
+    """
+    Converts a list of JSON scalars to an array without changing their Python types.
+
+    Homogeneous int or float lists get a native dtype; anything mixed stays an
+    object array so that ``tolist()`` gives back exactly the decoded values.
+    """
+    kinds = set(map(type, values))
+    if kinds <= {int}:
+        return np.array(values, dtype=np.int64)
+    if kinds <= {float}:
+        return np.array(values, dtype=np.float64)
+    return np.array(values, dtype=object)
+
+
+def _concat(chunks):
+    """Concatenates column chunks, falling back to object dtype when they disagree."""
+    if len(chunks) == 1:
+        return chunks[0]
+    if len({chunk.dtype for chunk in chunks}) > 1:
+        chunks = [chunk.astype(object) for chunk in chunks]
+    return np.concatenate(chunks)
+
+
+def _strided(values, offset, width, k):
+    """Returns column offset of the (k, width) block laid out row-major in values."""
+    column = values[offset:width * k:width]
+    if len(column) != k:
+        raise IndexError("list index out of range")
+    return column
+
+
+def _sample_times(time, k, time_interval):
+    """Spreads k samples evenly over time_interval, as int(t0 + i * (interval / k))."""
+    return (int(time) + np.arange(k) * (time_interval / k)).astype(np.int64)
+
+
+def _flatten_imu_blocks(imu_data_list, time_interval, location=None):
+    """
+    Flattens LTE style IMU blocks, where ACCEL/GYRO/ATTITUDE hold k samples each.
+
+    Returns a dict of concatenated columns. When location is given, the LOCATION
+    list is split into (k, 4) blocks and returned as LAT/LON/ALTITUDE/VELOCITY.
+    """
+    names = ("time",) + IMU_FIELDS + (LOCATION_FIELDS if location is not None else ())
+    chunks = {name: [] for name in names}
+    for imu_data in imu_data_list:
+        for time, imu_values in imu_data.items():
+            accel = imu_values["ACCEL"]
+            k = len(accel) // 3
+            if k == 0:
+                continue
+            gyro = imu_values["GYRO"]
+            attitude = imu_values["ATTITUDE"]
+            chunks["time"].append(_sample_times(time, k, time_interval))
+            for offset, name in enumerate(("ACCEL_X", "ACCEL_Y", "ACCEL_Z")):
+                chunks[name].append(_typed(_strided(accel, offset, 3, k)))
+            for offset, name in enumerate(("GYRO_X", "GYRO_Y", "GYRO_Z")):
+                chunks[name].append(_typed(_strided(gyro, offset, 3, k)))
+            for offset, name in enumerate(("PITCH", "ROLL")):
+                chunks[name].append(_typed(_strided(attitude, offset, 3, k)))
+            if location is not None:
+                for offset, name in enumerate(LOCATION_FIELDS):
+                    chunks[name].append(_typed(_strided(location, offset, 4, k)))
+    if not chunks["time"]:
+        return {name: np.empty(0, dtype=np.int64) for name in names}
+    return {name: _concat(parts) for name, parts in chunks.items()}
+
+
+def _gnss_fields(gnss_data):
+    return {
+        "LAT": gnss_data["POSITION"][0],
+        "LON": gnss_data["POSITION"][1],
+        "VELOCITY": gnss_data["VELOCITY"],
+        "ALTITUDE": gnss_data["ALTITUDE"],
+        "BEARING": gnss_data["BEARING"],
+    }
+
+
+def flatten_ble_data(payload):
+    """Flattens a BLE payload into a ColumnarBatch."""
+    sensor_id, phone_num, date = payload["TITLE"].split("_")
+    gnss_data = payload["GNSS"]
+    times = []
+    rows = []
+    for imu_data in payload["IMU"]:
+        for time, imu_values in imu_data.items():
+            accel = imu_values["ACCEL"]
+            gyro = imu_values["GYRO"]
+            attitude = imu_values["ATTITUDE"]
+            times.append(int(time))
+            rows.append((accel[0], accel[1], accel[2], gyro[0], gyro[1], gyro[2], attitude[0], attitude[1]))
+    fields = {"sensor_id": sensor_id, "phone_num": phone_num}
+    fields.update(_gnss_fields(gnss_data))
+    columns = {"time": np.array(times, dtype=np.int64)}
+    if rows:
+        for name, values in zip(IMU_FIELDS, zip(*rows)):
+            columns[name] = _typed(list(values))
+    else:
+        columns.update({name: np.empty(0, dtype=np.int64) for name in IMU_FIELDS})
+    return ColumnarBatch(BLE_FIELDS, fields, columns)
+
+
+def flatten_lte_data(payload, time_interval=5000):
+    """Flattens an LTE (V1) payload into a ColumnarBatch."""
+    sensor_id, phone_num = payload["TITLE"].split("_")
+    gnss_data = payload["GNSS"]
+    travel_data = payload["TRAVEL"]
+    fields = {"sensor_id": sensor_id, "phone_num": phone_num}
+    fields.update(_gnss_fields(gnss_data))
+    fields.update({"TIME": travel_data["TIME"], "DISTANCE": travel_data["DISTANCE"]})
+    columns = _flatten_imu_blocks(payload["IMU"], time_interval)
+    return ColumnarBatch(LTE_FIELDS, fields, columns)
+
+
+def flatten_lte_v2_data(payload, time_interval=10000):
+    """
+    Flattens an LTE V2 payload into a ColumnarBatch.
+
+    When LOCATION is present, per-sample LAT/LON/ALTITUDE/VELOCITY replace the
+    single GNSS fix.
+    """
+    sensor_id, phone_num = payload["TITLE"].split("_")
+    gnss_data = payload["GNSS"]
+    travel_data = payload["TRAVEL"]
+    location = payload["LOCATION"] if "LOCATION" in payload else None
+    fields = {"sensor_id": sensor_id, "phone_num": phone_num}
+    fields.update(_gnss_fields(gnss_data))
+    fields.update({"TIME": travel_data["TIME"], "DISTANCE": travel_data["DISTANCE"]})
+    columns = _flatten_imu_blocks(payload["IMU"], time_interval, location)
+    for name in columns:
+        fields.pop(name, None)
+    return ColumnarBatch(LTE_FIELDS, fields, columns)
+
+
+def flatten_nonesub_data(payload):
+    """Wraps a Nonesub payload as a single-sample ColumnarBatch."""
+    phone_num, date = payload["TITLE"].split("_")
+    fields = {"phone_num": phone_num}
+    fields.update(_gnss_fields(payload["GNSS"]))
+    columns = {"time": np.array([int(payload["TIME"])], dtype=np.int64)}
+    return ColumnarBatch(NONESUB_FIELDS, fields, columns)
@@ -0,0 +1,92 @@
+"""
+Manual offset commits tied to produce acknowledgements
+"""
+import logging
+import time
+from kafka import ConsumerRebalanceListener, TopicPartition
+from kafka.structs import OffsetAndMetadata
+from config.settings import COMMIT_INTERVAL_RECORDS, COMMIT_INTERVAL_MS
+from .producer import flush_messages
+
+logger = logging.getLogger(__name__)
+
+class OffsetCommitter:
+    """
+    Commits source offsets in batches, only once their produced records are acknowledged.
+
+    processed() records the next offset to commit for a partition. commit() flushes
+    the producer first; if a produced record failed, its partition is rewound to the
+    failed source offset so that it is processed again (at-least-once), and the
+    samples of the rewound records are taken back from dedup (see DedupCache).
+    """
+
+    def __init__(self, consumer, producer, tracker,
+                 interval_records=COMMIT_INTERVAL_RECORDS, interval_ms=COMMIT_INTERVAL_MS, metrics=None, dedup=None):
+        self.consumer = consumer
+        self.producer = producer
+        self.tracker = tracker
+        self.metrics = metrics
+        self.dedup = dedup
+        self.interval_records = interval_records
+        self.interval_ms = interval_ms
+        self._pending = {}
+        self._records = 0
+        self._last_commit = time.monotonic()
+
+    def processed(self, message):
+        """Marks a source record as fully handed to the producer."""
+        self._pending[TopicPartition(message.topic, message.partition)] = message.offset + 1
+        self._records += 1
+
+    def maybe_commit(self):
+        """Commits when the record count or time threshold is reached."""
+        elapsed_ms = (time.monotonic() - self._last_commit) * 1000
+        if self._records >= self.interval_records or (self._pending and elapsed_ms >= self.interval_ms):
+            self.commit()
+
+    def commit(self, revoked=()):
+        """
+        Flushes the producer and commits the processed offsets.
+        Partitions in revoked are not rewound, their new owner resumes from the commit.
+        """
+        flush_started = time.perf_counter()
+        failures = flush_messages(self.producer, self.tracker)
+        for data_item, error in failures:
+            logger.error(f"Failed to deliver message: {error}. Message: {data_item}")
+        if self.metrics:
+            self.metrics.flushed(time.perf_counter() - flush_started, len(failures))
+        failed = self.tracker.take_failed_offsets()
+
+        offsets = {}
+        for topic_partition, offset in self._pending.items():
+            if topic_partition in failed:
+                # Re-deliver everything from the first record whose output was lost
+                offset = failed[topic_partition]
+                logger.warning(f"Rewinding {topic_partition} to offset {offset} after failed deliveries")
+                if topic_partition not in revoked:
+                    self.consumer.seek(topic_partition, offset)
+                if self.dedup:
+                    self.dedup.forget(topic_partition, offset)
+            if self.dedup:
+                self.dedup.acknowledged(topic_partition, offset)
+            offsets[topic_partition] = OffsetAndMetadata(offset, '', -1)
+        self._pending = {}
+
+        if offsets:
+            self.consumer.commit(offsets)
+            logger.debug(f"Committed offsets: {offsets}")
+        self._records = 0
+        self._last_commit = time.monotonic()
+
+class CommitOnRevoke(ConsumerRebalanceListener):
+    """Commits acknowledged progress for partitions before they are reassigned."""
+
+    def __init__(self, committer):
+        self.committer = committer
+
+    def on_partitions_revoked(self, revoked):
+        if revoked:
+            self.committer.commit(revoked=set(revoked))
+
+    def on_partitions_assigned(self, assigned):
+        pass
@@ -1,14 +1,32 @@
 """
 Kafka Consumer
 """
-import json
 import signal
 import sys
+import time
 import logging
+from collections import namedtuple
 from kafka import KafkaConsumer
-from config.settings import KAFKA_BROKERS, SOURCE_TOPIC, CONSUMER_GROUP_ID, DESTINATION_TOPIC
-from .producer import get_producer, send_message
-from .processor import dispatch_processor
+from config.settings import (
+    KAFKA_BROKERS, CONSUMER_GROUP_ID,
+    ASYNC_PRODUCE, MANUAL_COMMIT, OUTPUT_FORMAT, ENVELOPE_COMPRESSION,
+    ACCIDENT_DETECTION, ACCIDENT_TOPIC, METRICS_ENABLED, METRICS_PORT, PIPELINE_ENABLED,
+    DEDUP_ENABLED, DEAD_LETTER_ENABLED, SUMMARY_ENABLED, SHED_ENABLED,
+)
+from .producer import (
+    get_producer, send_message, send_message_async, flush_messages, DeliveryTracker,
+)
+from .commit import OffsetCommitter, CommitOnRevoke
+from .accident import AccidentDetector
+from .dedup import DedupCache
+from .summary import SummaryAggregator, send_summaries
+from .deadletter import InvalidRecord, RetryGate, route_failure, source_topics
+from .shedding import LoadShedder
+from .metrics import ConsumerMetrics, start_metrics_server, timed_deserializer
+from .envelope import encode_envelope
+from .processor import dispatch_processor, dispatch_columnar, detect_data_type
+from .deserializer import DecodedPayload, get_value_deserializer, invalid_reason
+from .routing import resolve_data_type, destination_topic, record_key, record_headers
 
 # Configure logging
 logging.basicConfig(
@@ -17,6 +35,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# What to send for one source record; ok is False for a failed record
+Outcome = namedtuple("Outcome", ["data_type", "ok", "topic", "key", "headers", "messages", "alerts"])
+
 # Global flag for graceful shutdown
 running = True
 
@@ -26,50 +47,280 @@ def signal_handler(sig, frame):
     logger.info("Shutdown signal received. Closing consumer...")
     running = False
 
-def run_consumer():
-    """Runs the Kafka consumer with graceful shutdown support."""
+def flatten_payload(payload, data_type=None):
+    """
+    Flattens a payload: a ColumnarBatch for envelope output, else a list of dicts. None on failure.
+    Records output keeps the row processors, building the dicts directly is faster than
+    flattening column-wise and expanding with ColumnarBatch.to_records().
+    """
+    if OUTPUT_FORMAT == 'envelope':
+        return dispatch_columnar(payload, data_type)
+    return dispatch_processor(payload, data_type)
+
+def output_messages(flattened):
+    """Returns the list of messages to send for a flattened payload, or None."""
+    if flattened is None:
+        return None
+    if OUTPUT_FORMAT == 'envelope':
+        if not len(flattened):
+            return None
+        return [encode_envelope(flattened, flattened.data_type, ENVELOPE_COMPRESSION)]
+    return flattened
+
+def process_payload(payload, data_type=None):
+    """Flattens a payload into the list of messages to send, or None."""
+    return output_messages(flatten_payload(payload, data_type))
+
+def process_record(message, topic_partition, producer, detector=None, dedup=None, summary=None, shedder=None,
+                   partition=None):
+    """
+    Decodes, routes and flattens one source record, drops samples seen before,
+    detects accidents and sends closed summary windows. While shedding,
+    the samples to send are downsampled after accident detection and summaries
+    have seen all of them.
+    partition is the key the record's deliveries are tracked under (topic_partition
+    unless given, see DedupCache).
+    Returns (data_type, payload, messages to send, accident alerts to send).
+    Raises InvalidRecord for a record that can never be processed.
+    """
+    # Header / source topic routing first, key probing as fallback
+    data_type = resolve_data_type(message)
+    payload = message.value
+    if isinstance(payload, DecodedPayload):
+        raise InvalidRecord(payload.error, data_type)
+    elif data_type is None:
+        data_type = detect_data_type(payload)
+        if data_type is None:
+            raise InvalidRecord("Unknown message type")
+    if logger.isEnabledFor(logging.DEBUG) and not (shedder and shedder.quiet):
+        logger.debug(f"Received message: {payload}")
+
+    # Dispatch the payload to the correct processor
+    flattened = flatten_payload(payload, data_type)
+    if flattened is None:
+        raise InvalidRecord(invalid_reason(payload, data_type), data_type)
+
+    if dedup:
+        flattened = dedup.filter(flattened, (partition or topic_partition, message.offset))
+        if not len(flattened):
+            logger.debug(f"Dropped duplicate payload at {topic_partition} offset {message.offset}")
+            return data_type, payload, [], []
+
+    alerts = []
+    if detector:
+        # Sent with the record's messages, so they are tracked and committed alike
+        alerts = detector.update(flattened)
+        for alert in alerts:
+            logger.warning(f"Accident detected: {alert}")
+
+    if summary:
+        # Summaries are a side output: failing them must not fail the record
+        try:
+            send_summaries(producer, summary.update(flattened, data_type))
+        except Exception as e:
+            logger.error(f"Failed to update summaries at {topic_partition} offset {message.offset}: {e}", exc_info=True)
+
+    if shedder:
+        flattened = shedder.downsample(flattened, data_type)
+
+    return data_type, payload, output_messages(flattened), alerts
+
+def _failed_payload(message):
+    """The decoded payload of a failed record, or its raw bytes when it was not JSON."""
+    value = message.value
+    if isinstance(value, DecodedPayload):
+        return value.payload if value.payload is not None else value.raw
+    return value
+
+def handle_record(message, topic_partition, producer, detector=None, dedup=None, summary=None, shedder=None,
+                  partition=None):
+    """
+    Processes one source record with its failure isolated from the rest of the partition.
+
+    Returns an Outcome; its alerts go to ACCIDENT_TOPIC with the record's key
+    and headers. A failed record is logged and, with DEAD_LETTER_ENABLED,
+    its messages are the retry or dead-letter record to publish (see deadletter.py).
+    A record deferred by the shedder is republished unprocessed to the deferred lane.
+    """
+    if shedder:
+        outcome = _deferred(message, shedder)
+        if outcome:
+            return outcome
+    try:
+        data_type, payload, messages, alerts = process_record(
+            message, topic_partition, producer, detector, dedup, summary, shedder, partition)
+    except InvalidRecord as e:
+        logger.warning(f"Invalid message at {topic_partition} offset {message.offset}: {e}")
+        return _failed(message, e)
+    except Exception as e:
+        logger.error(f"Failed to process message at {topic_partition} offset {message.offset}: {e}", exc_info=True)
+        if dedup:
+            # Its samples come back through RETRY_TOPIC
+            dedup.forget(partition or topic_partition, message.offset)
+        return _failed(message, e)
+    if not messages and not alerts:
+        return Outcome(data_type, True, None, None, None, messages, alerts)
+    # Send the processed data to the destination topic of its type
+    return Outcome(data_type, True, destination_topic(data_type), record_key(payload),
+                   record_headers(data_type), messages, alerts)
+
+def _deferred(message, shedder):
+    payload = message.value
+    if isinstance(payload, DecodedPayload):
+        if payload.error:
+            # Left to the normal processing, which dead-letters it
+            return None
+        payload = payload.payload
+    data_type = shedder.deferred_type(message, payload)
+    if data_type is None:
+        return None
+    return Outcome(data_type, True, shedder.defer_topic, message.key,
+                   shedder.deferred_headers(message, data_type), [payload], [])
+
+def _failed(message, error):
+    data_type = getattr(error, 'data_type', None)
+    if not DEAD_LETTER_ENABLED:
+        return Outcome(data_type, False, None, None, None, None, [])
+    topic, value, headers = route_failure(message, error, data_type, _failed_payload(message))
+    return Outcome(data_type, False, topic, message.key, headers, [value], [])
+
+def run_consumer(worker_index=0):
+    """
+    Runs the Kafka consumer with graceful shutdown support.
+    worker_index (set by run_pool) offsets the metrics port of each worker process.
+    With PIPELINE_ENABLED the staged pipeline of pipeline.py runs instead.
+    """
     global running
 
+    if PIPELINE_ENABLED:
+        from .pipeline import run_pipeline
+        return run_pipeline(worker_index)
+
     # Register signal handlers
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    metrics = None
+    value_deserializer = get_value_deserializer()
+    if METRICS_ENABLED:
+        metrics = ConsumerMetrics()
+        value_deserializer = timed_deserializer(value_deserializer, metrics)
+        start_metrics_server(METRICS_PORT + worker_index)
+
     consumer = KafkaConsumer(
-        SOURCE_TOPIC,
         bootstrap_servers=KAFKA_BROKERS,
         auto_offset_reset='earliest',
-        enable_auto_commit=True,
+        enable_auto_commit=not MANUAL_COMMIT,
         group_id=CONSUMER_GROUP_ID,
-        value_deserializer=lambda x: json.loads(x.decode('utf-8'))
+        value_deserializer=value_deserializer
     )
 
-    producer = get_producer()
+    async_produce = ASYNC_PRODUCE or MANUAL_COMMIT
+    producer = get_producer(batched=async_produce)
+    tracker = DeliveryTracker()
+    committer = None
+    topics = source_topics()
+    dedup = DedupCache() if DEDUP_ENABLED else None
+    if MANUAL_COMMIT:
+        committer = OffsetCommitter(consumer, producer, tracker, metrics=metrics, dedup=dedup)
+        consumer.subscribe(topics, listener=CommitOnRevoke(committer))
+    else:
+        consumer.subscribe(topics)
+    retries = RetryGate(consumer) if DEAD_LETTER_ENABLED else None
+
+    detector = AccidentDetector() if ACCIDENT_DETECTION else None
+    summary = SummaryAggregator() if SUMMARY_ENABLED else None
+    shedder = LoadShedder() if SHED_ENABLED else None
 
-    logger.info(f"Subscribed to topic: {SOURCE_TOPIC}")
+    logger.info(f"Subscribed to topics: {topics}")
 
     try:
         while running:
+            if retries:
+                retries.release()
+            if shedder:
+                shedder.gate(consumer)
+
             # Poll with timeout to allow checking the running flag
+            poll_started = time.perf_counter()
             messages = consumer.poll(timeout_ms=1000)
+            poll_seconds = time.perf_counter() - poll_started
+            if shedder:
+                shedder.observe(consumer, messages)
 
             for topic_partition, records in messages.items():
                 for message in records:
-                    payload = message.value
-                    logger.debug(f"Received message: {payload}")
-
-                    # Dispatch the payload to the correct processor
-                    processed_data = dispatch_processor(payload)
+                    if retries and retries.hold(topic_partition, message):
+                        # A retried record that is not due yet; its partition is parked
+                        break
+                    started = time.perf_counter()
+                    outcome = handle_record(message, topic_partition, producer, detector, dedup, summary, shedder)
 
+                    processed_data, topic = outcome.messages, outcome.topic
+                    source = (topic_partition, message.offset)
+                    for alert in outcome.alerts:
+                        if async_produce:
+                            send_message_async(producer, alert, tracker, source, ACCIDENT_TOPIC, outcome.key, outcome.headers)
+                        else:
+                            send_message(producer, alert, ACCIDENT_TOPIC, outcome.key, outcome.headers)
                     if processed_data:
-                        # Send the processed data to the destination topic
+                        send_started = time.perf_counter()
                         for data_item in processed_data:
-                            send_message(producer, data_item)
-                        logger.info(f"Sent {len(processed_data)} processed messages to {DESTINATION_TOPIC}")
+                            if async_produce:
+                                send_message_async(producer, data_item, tracker, source, topic, outcome.key, outcome.headers)
+                            else:
+                                send_message(producer, data_item, topic, outcome.key, outcome.headers)
+                        if metrics and not async_produce:
+                            metrics.flushed(time.perf_counter() - send_started)
+                        if not (shedder and shedder.quiet):
+                            logger.info(f"Sent {len(processed_data)} processed messages to {topic}")
+
+                    if metrics:
+                        if not outcome.ok:
+                            metrics.invalid_record()
+                        metrics.processed(outcome.data_type, time.perf_counter() - started,
+                                          topic, len(processed_data) if processed_data else 0)
+
+                    if committer:
+                        committer.processed(message)
+
+            if detector:
+                detector.evict()
+            if summary:
+                send_summaries(producer, summary.evict())
+
+            if committer:
+                # Flush and commit on record count / time boundaries only
+                committer.maybe_commit()
+            elif async_produce and messages:
+                # Wait for the whole poll batch at once instead of per message
+                flush_started = time.perf_counter()
+                failures = flush_messages(producer, tracker)
+                for data_item, error in failures:
+                    logger.error(f"Failed to deliver message: {error}. Message: {data_item}")
+                if metrics:
+                    metrics.flushed(time.perf_counter() - flush_started, len(failures))
+            if dedup:
+                if not committer:
+                    # Nothing is consumed again without manual commits
+                    for topic_partition, records in messages.items():
+                        dedup.acknowledged(topic_partition, records[-1].offset + 1)
+                dedup.evict()
+
+            if metrics:
+                metrics.end_batch(consumer, messages, poll_seconds)
     except Exception as e:
         logger.error(f"Error in consumer loop: {e}", exc_info=True)
     finally:
         # Close resources gracefully
         logger.info("Closing consumer and producer...")
+        if summary:
+            send_summaries(producer, summary.close())
+        if committer:
+            try:
+                committer.commit()
+            except Exception as e:
+                logger.error(f"Final offset commit failed: {e}", exc_info=True)
         consumer.close()
         producer.close()
         logger.info("Consumer shutdown complete")
\ No newline at end of file
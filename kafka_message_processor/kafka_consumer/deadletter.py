@@ -0,0 +1,168 @@
+"""
+Dead-letter and delayed retry routing of failed records
+
+A record that can never be processed (undecodable, unknown type, invalid
+structure) is raised as InvalidRecord and goes straight to DEAD_LETTER_TOPIC.
+Any other exception is treated as transient: the record is re-published to
+RETRY_TOPIC with a due time (exponential backoff) and consumed again from there,
+so the source partition moves on. After RETRY_MAX_ATTEMPTS it is dead-lettered.
+
+Dead-letter records carry the error and where the record came from:
+
+    {
+        "error": "Missing GNSS.POSITION",
+        "error_type": "InvalidRecord",
+        "transient": false,
+        "attempts": 1,
+        "failed_at": 1715000000000,
+        "data_type": "ltev2",
+        "source": {"topic": "source_topic", "partition": 0, "offset": 42, "timestamp": 1715000000000},
+        "payload": {...}        # or "payload_raw": "..." when it was not valid JSON
+    }
+"""
+import time
+from config.settings import (
+    SOURCE_TOPICS, TYPE_HEADER, DEAD_LETTER_ENABLED, DEAD_LETTER_TOPIC,
+    RETRY_TOPIC, RETRY_MAX_ATTEMPTS, RETRY_BACKOFF_MS, SHED_ENABLED, SHED_DEFER_TOPIC,
+)
+from .routing import header_value
+
+RETRY_ATTEMPT_HEADER = 'retry_attempt'
+RETRY_DUE_HEADER = 'retry_due_ms'
+ERROR_HEADER = 'error'
+SOURCE_TOPIC_HEADER = 'source_topic'
+SOURCE_PARTITION_HEADER = 'source_partition'
+SOURCE_OFFSET_HEADER = 'source_offset'
+ROUTING_HEADERS = (
+    RETRY_ATTEMPT_HEADER, RETRY_DUE_HEADER, ERROR_HEADER,
+    SOURCE_TOPIC_HEADER, SOURCE_PARTITION_HEADER, SOURCE_OFFSET_HEADER,
+)
+
+class InvalidRecord(Exception):
+    """A record that can never be processed; it is dead-lettered without retries."""
+
+    def __init__(self, error, data_type=None, payload=None):
+        super().__init__(error)
+        self.data_type = data_type
+        self.payload = payload
+
+def source_topics():
+    """
+    Returns the topics the consumer subscribes to: SOURCE_TOPICS, plus RETRY_TOPIC
+    with DEAD_LETTER_ENABLED and SHED_DEFER_TOPIC (see shedding.py) with SHED_ENABLED.
+    """
+    topics = list(SOURCE_TOPICS)
+    if DEAD_LETTER_ENABLED:
+        topics.append(RETRY_TOPIC)
+    if SHED_ENABLED:
+        topics.append(SHED_DEFER_TOPIC)
+    return topics
+
+def _int_header(message, name):
+    value = header_value(message, name)
+    return int(value) if value and value.isdigit() else None
+
+def retry_attempt(message):
+    """Returns how many times the record was retried already (0 for a source record)."""
+    return _int_header(message, RETRY_ATTEMPT_HEADER) or 0
+
+def retry_due(message):
+    """Returns the epoch ms a retried record may be processed at, or None."""
+    return _int_header(message, RETRY_DUE_HEADER)
+
+def _source(message):
+    """Returns the original (topic, partition, offset) of a record, through its retries."""
+    topic = header_value(message, SOURCE_TOPIC_HEADER)
+    partition = _int_header(message, SOURCE_PARTITION_HEADER)
+    offset = _int_header(message, SOURCE_OFFSET_HEADER)
+    if topic is None or partition is None or offset is None:
+        return message.topic, message.partition, message.offset
+    return topic, partition, offset
+
+def route_failure(message, error, data_type=None, payload=None):
+    """
+    Returns (topic, value, headers) to publish a failed record to: RETRY_TOPIC for a
+    transient error with attempts left, else DEAD_LETTER_TOPIC.
+    payload is the decoded payload, or the raw value when it could not be decoded.
+    """
+    if isinstance(error, InvalidRecord):
+        data_type = error.data_type or data_type
+        payload = error.payload if error.payload is not None else payload
+    attempt = retry_attempt(message) + 1
+    now_ms = int(time.time() * 1000)
+    topic, partition, offset = _source(message)
+
+    headers = [(key, value) for key, value in message.headers or () if key not in ROUTING_HEADERS]
+    if data_type and not any(key == TYPE_HEADER for key, _ in headers):
+        headers.append((TYPE_HEADER, data_type.encode('utf-8')))
+    headers += [
+        (SOURCE_TOPIC_HEADER, topic.encode('utf-8')),
+        (SOURCE_PARTITION_HEADER, str(partition).encode('utf-8')),
+        (SOURCE_OFFSET_HEADER, str(offset).encode('utf-8')),
+        (ERROR_HEADER, str(error)[:1000].encode('utf-8')),
+    ]
+
+    transient = not isinstance(error, InvalidRecord)
+    if transient and attempt <= RETRY_MAX_ATTEMPTS and isinstance(payload, dict):
+        due_ms = now_ms + RETRY_BACKOFF_MS * 2 ** (attempt - 1)
+        headers += [
+            (RETRY_ATTEMPT_HEADER, str(attempt).encode('utf-8')),
+            (RETRY_DUE_HEADER, str(due_ms).encode('utf-8')),
+        ]
+        return RETRY_TOPIC, payload, headers
+
+    record = {
+        "error": str(error),
+        "error_type": type(error).__name__,
+        "transient": transient,
+        "attempts": attempt,
+        "failed_at": now_ms,
+        "data_type": data_type,
+        "source": {"topic": topic, "partition": partition, "offset": offset, "timestamp": message.timestamp},
+    }
+    if isinstance(payload, (bytes, bytearray)):
+        record["payload_raw"] = bytes(payload).decode('utf-8', errors='replace')
+    else:
+        record["payload"] = payload
+    return DEAD_LETTER_TOPIC, record, headers
+
+class RetryGate:
+    """
+    Holds back RETRY_TOPIC partitions until their next record is due.
+
+    A record polled before its due time rewinds its partition to it and pauses
+    the partition; release() resumes it once due. Source partitions are never
+    held, so a failing record delays only itself.
+    """
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.waiting = {}
+
+    def hold(self, topic_partition, message):
+        """Returns True (and parks the partition) when message is not due yet."""
+        if message.topic != RETRY_TOPIC:
+            return False
+        due_ms = retry_due(message)
+        if due_ms is None or due_ms <= time.time() * 1000:
+            return False
+        self.consumer.seek(topic_partition, message.offset)
+        self.consumer.pause(topic_partition)
+        self.waiting[topic_partition] = due_ms
+        return True
+
+    def release(self):
+        """Resumes the held partitions whose record is due."""
+        if not self.waiting:
+            return
+        now_ms = time.time() * 1000
+        due = [topic_partition for topic_partition, due_ms in self.waiting.items() if due_ms <= now_ms]
+        if not due:
+            return
+        for topic_partition in due:
+            del self.waiting[topic_partition]
+        # Partitions revoked while held are not ours to resume
+        assigned = self.consumer.assignment()
+        due = [topic_partition for topic_partition in due if topic_partition in assigned]
+        if due:
+            self.consumer.resume(*due)
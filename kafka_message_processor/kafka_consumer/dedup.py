@@ -0,0 +1,48 @@
+"""
+Duplicate sample suppression
+"""
+import numpy as np
+from rider_common.dedup import DedupCache as _DedupCache
+from config.settings import DEDUP_WINDOW_MS, DEDUP_IDLE_S, DEDUP_MAX_SENSORS
+from .columnar import ColumnarBatch
+from .metrics import REGISTRY
+
+class DedupCache(_DedupCache):
+    """
+    Drops samples whose (sensor_id, time) was already seen, on the cache shared with
+    riderLogMQReceiver (see rider_common.dedup).
+
+    Sensors are keyed by sensor_id (phone_num for Nonesub). A sample counts as seen
+    as soon as its record is processed, before its output is acknowledged. So that
+    a record consumed again (after a rewind for failed deliveries, or through
+    RETRY_TOPIC) is not dropped as its own duplicate, the times each record added
+    are journaled per partition until acknowledged() and can be taken back with
+    forget().
+    """
+
+    def __init__(self, window_ms=DEDUP_WINDOW_MS, idle_s=DEDUP_IDLE_S,
+                 max_sensors=DEDUP_MAX_SENSORS, registry=REGISTRY):
+        super().__init__(window_ms, idle_s, max_sensors, registry)
+
+    def filter(self, flattened, source=None):
+        """
+        Returns flattened (a ColumnarBatch or list of dicts) without the samples seen before.
+        source is the (partition, offset) of the record, to journal the times it added.
+        """
+        if isinstance(flattened, ColumnarBatch):
+            sensor = flattened.fields.get("sensor_id") or flattened.fields.get("phone_num")
+            times = flattened.columns["time"].tolist()
+        else:
+            if not flattened:
+                return flattened
+            sensor = flattened[0].get("sensor_id") or flattened[0].get("phone_num")
+            times = [row["time"] for row in flattened]
+        if sensor is None or not times:
+            return flattened
+
+        new = self.check(sensor, times, source)
+        if all(new):
+            return flattened
+        if isinstance(flattened, ColumnarBatch):
+            return flattened.select(np.array(new, dtype=bool))
+        return [row for row, keep in zip(flattened, new) if keep]
@@ -0,0 +1,115 @@
+"""
+Source topic deserializers
+"""
+import json
+import logging
+from collections import namedtuple
+from config.settings import JSON_BACKEND
+from .processor import BLE, LTE, LTE_V2, NONESUB
+
+logger = logging.getLogger(__name__)
+
+# What the deserializer returns for a value that is not valid JSON: error says why, raw keeps the bytes.
+DecodedPayload = namedtuple("DecodedPayload", ["data_type", "payload", "error", "raw"], defaults=(None,))
+
+def get_json_loads(backend=JSON_BACKEND):
+    """
+    Returns a bytes -> object JSON decoder for the given backend.
+    'orjson' and 'ujson' fall back to the standard library when not installed.
+    """
+    if backend == 'orjson':
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            logger.warning("orjson is not installed. Falling back to json")
+    elif backend == 'ujson':
+        try:
+            import ujson
+            return ujson.loads
+        except ImportError:
+            logger.warning("ujson is not installed. Falling back to json")
+    elif backend != 'json':
+        raise ValueError(f"Unknown JSON backend: {backend}")
+    return lambda x: json.loads(x.decode('utf-8'))
+
+def _require(mapping, key, kind, where):
+    if not isinstance(mapping, dict) or key not in mapping:
+        raise ValueError(f"Missing {where}{key}")
+    value = mapping[key]
+    if kind is not None and not isinstance(value, kind):
+        names = "/".join(k.__name__ for k in (kind if isinstance(kind, tuple) else (kind,)))
+        raise ValueError(f"{where}{key} must be {names}, got {type(value).__name__}")
+    return value
+
+def _validate_title(payload, parts):
+    title = _require(payload, "TITLE", str, "")
+    if title.count("_") != parts - 1:
+        raise ValueError(f"Invalid TITLE format: {title}")
+
+def _validate_gnss(payload):
+    gnss = _require(payload, "GNSS", dict, "")
+    if len(_require(gnss, "POSITION", list, "GNSS.")) < 2:
+        raise ValueError("GNSS.POSITION must hold latitude and longitude")
+    for key in ("VELOCITY", "ALTITUDE", "BEARING"):
+        _require(gnss, key, None, "GNSS.")
+
+def _validate_imu(payload, channels):
+    for imu_data in _require(payload, "IMU", list, ""):
+        if not isinstance(imu_data, dict):
+            raise ValueError("IMU entries must be objects")
+        for time, imu_values in imu_data.items():
+            if not time.isdigit():
+                raise ValueError(f"Invalid IMU timestamp: {time}")
+            for key in channels:
+                _require(imu_values, key, list, "IMU.")
+
+def _validate_travel(payload):
+    travel = _require(payload, "TRAVEL", dict, "")
+    for key in ("TIME", "DISTANCE"):
+        _require(travel, key, None, "TRAVEL.")
+
+def validate_payload(payload, data_type):
+    """
+    Checks the structure the processor of data_type relies on.
+    Raises ValueError describing the first problem found.
+    """
+    if data_type == BLE:
+        _validate_title(payload, 3)
+        _validate_imu(payload, ("ACCEL", "GYRO", "ATTITUDE"))
+        _validate_gnss(payload)
+    elif data_type in (LTE, LTE_V2):
+        _validate_title(payload, 2)
+        _validate_imu(payload, ("ACCEL", "GYRO", "ATTITUDE"))
+        _validate_gnss(payload)
+        _validate_travel(payload)
+        if data_type == LTE_V2:
+            _require(payload, "LOCATION", list, "")
+    elif data_type == NONESUB:
+        _validate_title(payload, 2)
+        _validate_gnss(payload)
+        _require(payload, "TIME", (str, int, float), "")
+
+def get_value_deserializer(backend=JSON_BACKEND):
+    """
+    Returns the value_deserializer for the source topic consumer, which returns
+    the decoded payload. Records that are not valid JSON never raise (that would
+    abort the poll) but come back as a DecodedPayload with error set.
+    """
+    loads = get_json_loads(backend)
+
+    def deserialize(value):
+        try:
+            return loads(value)
+        except ValueError as e:
+            return DecodedPayload(None, None, f"Invalid JSON: {e}", value)
+
+    return deserialize
+
+def invalid_reason(payload, data_type):
+    """Returns why a payload of data_type could not be processed: its first structural problem, if any."""
+    try:
+        validate_payload(payload, data_type)
+    except ValueError as e:
+        return str(e)
+    return f"Failed to process {data_type} data"
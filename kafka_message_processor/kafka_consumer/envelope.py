@@ -0,0 +1,79 @@
+"""
+Per-payload envelope output format
+
+One envelope replaces the per-sample records of a payload: values shared by all
+samples are stored once in "fields" and per-sample values as arrays in "columns".
+
+    {
+        "format": "envelope",
+        "version": 1,
+        "type": "ltev2",
+        "keys": ["sensor_id", "phone_num", "time", ...],
+        "fields": {"sensor_id": "...", "BEARING": 0, "TIME": 0, ...},
+        "columns": {"time": [...], "ACCEL_X": [...], ...}
+    }
+
+Compressed envelopes are the zlib-compressed JSON bytes. Consumers can use
+decode_envelope() to get back the rows the per-sample format would have sent.
+"""
+import json
+import zlib
+
+ENVELOPE_FORMAT = "envelope"
+ENVELOPE_VERSION = 1
+
+def build_envelope(batch, data_type=None):
+    """Builds the envelope dict of a ColumnarBatch."""
+    return {
+        "format": ENVELOPE_FORMAT,
+        "version": ENVELOPE_VERSION,
+        "type": data_type,
+        "keys": list(batch.keys),
+        "fields": batch.fields,
+        "columns": {key: column.tolist() for key, column in batch.columns.items()},
+    }
+
+def encode_envelope(batch, data_type=None, compress=False):
+    """
+    Encodes a ColumnarBatch as an envelope.
+    Returns the envelope dict, or zlib-compressed JSON bytes when compress is set.
+    """
+    envelope = build_envelope(batch, data_type)
+    if not compress:
+        return envelope
+    return zlib.compress(json.dumps(envelope, separators=(',', ':')).encode('utf-8'))
+
+def is_envelope(value):
+    """Returns True if a decoded record value is an envelope."""
+    return isinstance(value, dict) and value.get("format") == ENVELOPE_FORMAT
+
+def load_envelope(value):
+    """Parses a raw record value (JSON or zlib-compressed JSON bytes) into an envelope dict."""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        return json.loads(value)
+    # zlib streams start with 0x78, JSON objects with '{'
+    if value[:1] == b'{':
+        return json.loads(value.decode('utf-8'))
+    return json.loads(zlib.decompress(value).decode('utf-8'))
+
+def decode_envelope(value):
+    """
+    Expands an envelope back into one dict per sample.
+    value may be the envelope dict or the raw record bytes.
+    """
+    envelope = load_envelope(value)
+    if envelope.get("version") != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version: {envelope.get('version')}")
+    keys = envelope["keys"]
+    fields = envelope["fields"]
+    columns = envelope["columns"]
+    template = {key: fields.get(key) for key in keys}
+    names = [key for key in keys if key in columns]
+    records = []
+    for row in zip(*(columns[key] for key in names)):
+        record = template.copy()
+        record.update(zip(names, row))
+        records.append(record)
+    return records
@@ -0,0 +1,124 @@
+"""
+Consumer metrics, served in the Prometheus text exposition format (see prometheus_text)
+"""
+import threading
+import time
+from prometheus_text import Registry, start_metrics_server as _start_metrics_server
+from config.settings import METRICS_BUCKETS
+
+REGISTRY = Registry(buckets=METRICS_BUCKETS)
+
+def start_metrics_server(port, registry=REGISTRY):
+    """Serves registry on http://0.0.0.0:port/metrics from a daemon thread."""
+    return _start_metrics_server(port, registry)
+
+def timed_deserializer(deserializer, metrics):
+    """Wraps a value deserializer to add its time to metrics.decode_seconds."""
+    def deserialize(value):
+        started = time.perf_counter()
+        try:
+            return deserializer(value)
+        finally:
+            metrics.decode_seconds += time.perf_counter() - started
+    return deserialize
+
+class ConsumerMetrics:
+    """
+    Measurements of the consumer loop, aggregated per poll batch.
+
+    Per-record values are collected in plain lists / floats while a batch is
+    handled and written to the shared metrics once in end_batch(), so the hot
+    path only takes one uncontended lock. The lock is needed because pipeline
+    produce threads record while the poll thread swaps the batch state.
+    decode_seconds is only touched by the poll thread.
+    """
+
+    def __init__(self, registry=REGISTRY):
+        self.records = registry.counter(
+            'consumer_records_total', 'Source records processed', ('data_type',))
+        self.invalid = registry.counter(
+            'consumer_invalid_records_total', 'Source records that could not be decoded or processed')
+        self.produced = registry.counter(
+            'producer_records_total', 'Records sent to the producer', ('topic',))
+        self.produce_errors = registry.counter(
+            'producer_errors_total', 'Records whose delivery failed')
+        self.poll_seconds = registry.histogram(
+            'consumer_poll_seconds', 'Time spent in poll() per batch')
+        self.batch_records = registry.histogram(
+            'consumer_batch_records', 'Records per poll batch',
+            buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+        self.batch_decode_seconds = registry.histogram(
+            'consumer_decode_seconds', 'Value deserialization time per poll batch')
+        self.process_seconds = registry.histogram(
+            'consumer_process_seconds', 'Processing time per payload', ('data_type',))
+        self.flush_seconds = registry.histogram(
+            'producer_flush_seconds', 'Time waiting for producer acknowledgements per flush')
+        self.lag = registry.gauge(
+            'consumer_lag', 'High watermark minus the next offset to consume', ('topic', 'partition'))
+        self.queued = registry.gauge(
+            'pipeline_queued_records', 'Records waiting in a pipeline stage queue', ('stage',))
+        self.paused = registry.gauge(
+            'pipeline_paused_partitions', 'Partitions paused by pipeline backpressure')
+        self._lock = threading.Lock()
+        self.start_batch()
+
+    def start_batch(self):
+        self.decode_seconds = 0.0
+        self._process = {}
+        self._produced = {}
+        self._invalid = 0
+        self._flushes = []
+        self._failures = 0
+
+    def processed(self, data_type, seconds, topic=None, messages=0):
+        """Records one payload; called per record, only touches local state."""
+        with self._lock:
+            self._process.setdefault(data_type or 'unknown', []).append(seconds)
+            if messages:
+                self._produced[topic] = self._produced.get(topic, 0) + messages
+
+    def invalid_record(self):
+        with self._lock:
+            self._invalid += 1
+
+    def end_batch(self, consumer, messages, poll_seconds):
+        """Publishes the measurements since the last call and the lag of the batch's partitions."""
+        # Swap the batch state first, pipeline stage threads keep adding to it
+        with self._lock:
+            process, produced, invalid = self._process, self._produced, self._invalid
+            flushes, failures, decode_seconds = self._flushes, self._failures, self.decode_seconds
+            self.start_batch()
+        if messages:
+            self.poll_seconds.observe(poll_seconds)
+            self.batch_records.observe(sum(len(records) for records in messages.values()))
+            self.batch_decode_seconds.observe(decode_seconds)
+        for data_type, durations in process.items():
+            self.records.inc(len(durations), data_type=data_type)
+            self.process_seconds.observe_many(durations, data_type=data_type)
+        for topic, count in produced.items():
+            self.produced.inc(count, topic=topic)
+        if invalid:
+            self.invalid.inc(invalid)
+        if flushes:
+            self.flush_seconds.observe_many(flushes)
+        if failures:
+            self.produce_errors.inc(failures)
+        for topic_partition, records in messages.items():
+            # highwater() comes with the fetch response, it does not query the broker
+            highwater = consumer.highwater(topic_partition)
+            if highwater is not None and records:
+                self.lag.set(highwater - records[-1].offset - 1,
+                             topic=topic_partition.topic, partition=topic_partition.partition)
+
+    def flushed(self, seconds, failures=0):
+        """Records one wait for acknowledgements (a flush, or a synchronous send)."""
+        with self._lock:
+            self._flushes.append(seconds)
+            self._failures += failures
+
+    def pipeline_state(self, backlog, process, produce, paused):
+        """Sets the queue depths of the pipeline stages and the paused partition count."""
+        self.queued.set(backlog, stage='backlog')
+        self.queued.set(process, stage='process')
+        self.queued.set(produce, stage='produce')
+        self.paused.set(paused)
@@ -0,0 +1,44 @@
+"""
+MongoDB storage helpers
+"""
+import hashlib
+from datetime import datetime
+from bson import ObjectId
+from pymongo import MongoClient
+from config.settings import MONGO_URI, MONGO_TLS_CA, MONGO_MAX_POOL_SIZE, MONGO_DATABASES
+from .processor import BLE, NONESUB
+
+def get_mongo_client(max_pool_size=MONGO_MAX_POOL_SIZE):
+    """Returns a pooled MongoClient for the DocumentDB cluster."""
+    if MONGO_TLS_CA:
+        return MongoClient(host=MONGO_URI, tls=True, tlsCAFile=MONGO_TLS_CA, maxPoolSize=max_pool_size)
+    return MongoClient(host=MONGO_URI, maxPoolSize=max_pool_size)
+
+def sample_id(row):
+    """
+    Deterministic ObjectId of a sample: its time in seconds, then a hash of
+    (sensor_id, phone_num, time). Writing the same sample twice is a duplicate key
+    error instead of a second document, and _id order still follows sample time.
+    """
+    digest = hashlib.blake2b(f"{row.get('sensor_id')}|{row.get('phone_num')}|{row['time']}".encode(), digest_size=8)
+    return ObjectId((int(row["time"]) // 1000).to_bytes(4, "big") + digest.digest())
+
+def _date(timestamp_ms):
+    return datetime.fromtimestamp(timestamp_ms / 1000).strftime('%Y%m%d')
+
+def group_by_collection(data_type, rows, title_date=None, received_ms=None):
+    """
+    Groups flattened rows by the (database, daily collection) the Celery tasks write them to.
+
+    BLE uses the date in TITLE, LTE the date of each sample and Nonesub the day
+    the payload was received. Without title_date / received_ms, the sample date is used.
+    """
+    database = MONGO_DATABASES[data_type]
+    if data_type == BLE and title_date:
+        return {(database, title_date): rows}
+    if data_type == NONESUB and received_ms is not None:
+        return {(database, _date(received_ms)): rows}
+    groups = {}
+    for row in rows:
+        groups.setdefault((database, _date(row["time"])), []).append(row)
+    return groups
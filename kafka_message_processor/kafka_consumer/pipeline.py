@@ -0,0 +1,422 @@
+"""
+Staged consumer pipeline with backpressure
+"""
+import itertools
+import logging
+import queue
+import signal
+import threading
+import time
+from collections import deque, namedtuple
+from kafka import KafkaConsumer, ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
+from config.settings import (
+    KAFKA_BROKERS, CONSUMER_GROUP_ID, MANUAL_COMMIT, COMMIT_INTERVAL_MS,
+    ACCIDENT_DETECTION, ACCIDENT_TOPIC, DEDUP_ENABLED, METRICS_ENABLED, METRICS_PORT,
+    PIPELINE_PROCESS_THREADS, PIPELINE_QUEUE_SIZE, PIPELINE_PARTITION_MAX_INFLIGHT,
+    PIPELINE_FLUSH_INTERVAL_MS, DEAD_LETTER_ENABLED, SUMMARY_ENABLED, SHED_ENABLED,
+)
+from .producer import get_producer, send_message_async, flush_messages, DeliveryTracker
+from .accident import AccidentDetector
+from .dedup import DedupCache
+from .deadletter import RetryGate, source_topics
+from .summary import SummaryAggregator, send_summaries
+from .shedding import LoadShedder
+from .metrics import ConsumerMetrics, start_metrics_server, timed_deserializer
+from .deserializer import get_value_deserializer
+from .consumer import handle_record
+
+logger = logging.getLogger(__name__)
+
+# Short poll timeout: rewinds, queue room and paused partitions are checked between polls
+POLL_TIMEOUT_MS = 100
+
+# A source record on its way to a process stage
+Work = namedtuple("Work", ["topic_partition", "epoch", "message"])
+# A processed record on its way to the produce stage (the fields of consumer.Outcome in between)
+Output = namedtuple("Output", [
+    "topic_partition", "epoch", "offset", "data_type", "ok", "topic", "key", "headers", "messages", "alerts", "seconds",
+])
+
+# Queue sentinel asking a stage thread to finish
+STOP = object()
+
+# Global flag for graceful shutdown
+running = True
+
+def signal_handler(sig, frame):
+    """Handle shutdown signals gracefully."""
+    global running
+    logger.info("Shutdown signal received. Stopping pipeline...")
+    running = False
+
+class Pipeline:
+    """
+    Poll, process and produce stages of one consumer, connected by bounded queues.
+
+    The calling thread polls. It is the only thread using the KafkaConsumer (poll,
+    pause / resume, seek, commit) and it never blocks on a queue: records wait in a
+    per-partition backlog until their process queue has room. A partition is paused
+    once max_inflight of its records are between poll and produce, and resumed when
+    that drops to half, so memory stays bounded while poll() keeps being called.
+
+    Process threads flatten records; a partition always maps to the same thread.
+    One produce thread sends in queue order without waiting and collects the
+    acknowledgements every flush_interval_ms, so flattening overlaps with network
+    I/O and the order within a partition is kept.
+
+    Each partition has an epoch, replaced when the partition is rewound after a
+    failed delivery and removed when it is revoked. Records of an older epoch are
+    dropped by the stages instead of being sent out of order.
+
+    With retries, a RETRY_TOPIC record that is not due yet ends its poll batch:
+    the rest of that partition is dropped and re-polled once the record is due.
+    Deferred-lane partitions paused by the shedder are not resumed by backpressure.
+    """
+
+    def __init__(self, consumer, producer, detector=None, dedup=None, metrics=None, retries=None, summary=None,
+                 shedder=None, threads=PIPELINE_PROCESS_THREADS, queue_size=PIPELINE_QUEUE_SIZE,
+                 max_inflight=PIPELINE_PARTITION_MAX_INFLIGHT, flush_interval_ms=PIPELINE_FLUSH_INTERVAL_MS):
+        self.consumer = consumer
+        self.producer = producer
+        self.tracker = DeliveryTracker()
+        self.detector = detector
+        self.dedup = dedup
+        self.metrics = metrics
+        self.retries = retries
+        self.summary = summary
+        self.shedder = shedder
+        self.max_inflight = max_inflight
+        self.flush_interval = flush_interval_ms / 1000
+        self.process_queues = [queue.Queue(queue_size) for _ in range(threads)]
+        self.produce_queue = queue.Queue(queue_size)
+        self.backlog = {}
+        self.paused = set()
+        self.epochs = {}
+        self._epoch_ids = itertools.count()
+        # Guards the state shared with the produce thread
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._acked = {}
+        self._rewind = {}
+        self._process_threads = [
+            threading.Thread(target=self._process_stage, args=(work,), name=f"pipeline-process-{index}", daemon=True)
+            for index, work in enumerate(self.process_queues)
+        ]
+        self._produce_thread = threading.Thread(target=self._produce_stage, name="pipeline-produce", daemon=True)
+
+    def start(self):
+        for thread in self._process_threads + [self._produce_thread]:
+            thread.start()
+
+    def stop(self):
+        """Lets the stages finish the records already polled, then waits for the last acknowledgements."""
+        for topic_partition, records in self.backlog.items():
+            work = self._process_queue(topic_partition)
+            for message in records:
+                work.put(Work(topic_partition, self.epochs[topic_partition], message))
+        self.backlog.clear()
+        for work in self.process_queues:
+            work.put(STOP)
+        for thread in self._process_threads:
+            thread.join()
+        self.produce_queue.put(STOP)
+        self._produce_thread.join()
+
+    # Poll stage (calling thread)
+
+    def _process_queue(self, topic_partition):
+        return self.process_queues[hash(topic_partition) % len(self.process_queues)]
+
+    def add(self, messages):
+        """Queues the records of a poll batch behind the backlog of their partitions."""
+        for topic_partition, records in messages.items():
+            if topic_partition not in self.epochs:
+                self.epochs[topic_partition] = next(self._epoch_ids)
+            if self.retries:
+                records = self._due(topic_partition, records)
+            self.backlog.setdefault(topic_partition, deque()).extend(records)
+            with self._lock:
+                self._inflight[topic_partition] = self._inflight.get(topic_partition, 0) + len(records)
+        self.drain()
+
+    def _due(self, topic_partition, records):
+        for index, message in enumerate(records):
+            if self.retries.hold(topic_partition, message):
+                return records[:index]
+        return records
+
+    def drain(self):
+        """Moves backlog records into the process queues as far as they have room."""
+        for topic_partition, records in list(self.backlog.items()):
+            work = self._process_queue(topic_partition)
+            epoch = self.epochs[topic_partition]
+            try:
+                while records:
+                    work.put_nowait(Work(topic_partition, epoch, records[0]))
+                    records.popleft()
+            except queue.Full:
+                continue
+            del self.backlog[topic_partition]
+
+    def backpressure(self):
+        """Pauses partitions with too many records in flight and resumes the drained ones."""
+        with self._lock:
+            inflight = dict(self._inflight)
+        pause = [topic_partition for topic_partition, count in inflight.items()
+                 if count >= self.max_inflight and topic_partition not in self.paused]
+        held = set(self.retries.waiting) if self.retries else set()
+        if self.shedder:
+            held |= self.shedder.paused
+        resume = [topic_partition for topic_partition in self.paused
+                  if inflight.get(topic_partition, 0) <= self.max_inflight // 2 and topic_partition not in held]
+        if pause:
+            self.consumer.pause(*pause)
+            self.paused.update(pause)
+            logger.info(f"Paused {pause}, downstream stages are full")
+        if resume:
+            self.consumer.resume(*resume)
+            self.paused.difference_update(resume)
+            logger.info(f"Resumed {resume}")
+
+    def apply_rewinds(self):
+        """Seeks partitions with failed deliveries back to the first failed source offset."""
+        with self._lock:
+            rewind, self._rewind = self._rewind, {}
+            dropped = {}
+            for topic_partition in rewind:
+                self._reset(topic_partition)
+                dropped[topic_partition] = self.epochs.get(topic_partition)
+                self.epochs[topic_partition] = next(self._epoch_ids)
+        for topic_partition, offset in rewind.items():
+            logger.warning(f"Rewinding {topic_partition} to offset {offset} after failed deliveries")
+            self.consumer.seek(topic_partition, offset)
+            if self.dedup:
+                # Records of the old epoch still in flight are forgotten as _send drops them
+                partition = (topic_partition, dropped[topic_partition])
+                self.dedup.forget(partition, offset)
+                self.dedup.acknowledged(partition, offset)
+
+    def revoke(self, revoked):
+        """Drops every record of revoked partitions; their new owner resumes from the commit."""
+        with self._lock:
+            for topic_partition in revoked:
+                self._reset(topic_partition)
+                epoch = self.epochs.pop(topic_partition, None)
+                self._acked.pop(topic_partition, None)
+                if self.dedup:
+                    self.dedup.forget((topic_partition, epoch))
+        self.paused.difference_update(revoked)
+
+    def _reset(self, topic_partition):
+        self.backlog.pop(topic_partition, None)
+        self._inflight.pop(topic_partition, None)
+        self._rewind.pop(topic_partition, None)
+
+    def commit(self):
+        """Commits the offsets whose output has been acknowledged."""
+        with self._lock:
+            acked, self._acked = self._acked, {}
+        offsets = {topic_partition: OffsetAndMetadata(offset, '', -1) for topic_partition, offset in acked.items()}
+        if offsets:
+            self.consumer.commit(offsets)
+            logger.debug(f"Committed offsets: {offsets}")
+
+    def report(self):
+        """Publishes the queue depths to the metrics."""
+        self.metrics.pipeline_state(
+            sum(len(records) for records in self.backlog.values()),
+            sum(work.qsize() for work in self.process_queues),
+            self.produce_queue.qsize(),
+            len(self.paused),
+        )
+
+    # Process stage
+
+    def _process_stage(self, work):
+        while True:
+            item = work.get()
+            if item is STOP:
+                return
+            topic_partition, epoch, message = item
+            if epoch != self.epochs.get(topic_partition):
+                continue
+            started = time.perf_counter()
+            # Never raises; a failed record comes back with ok False (and its dead-letter record)
+            outcome = handle_record(message, topic_partition, self.producer, self.detector, self.dedup, self.summary,
+                                    self.shedder, (topic_partition, epoch))
+            # Blocks while the produce queue is full, which in turn fills this queue
+            self.produce_queue.put(Output(topic_partition, epoch, message.offset, *outcome,
+                                          time.perf_counter() - started))
+
+    # Produce stage
+
+    def _produce_stage(self):
+        unflushed = {}
+        flush_at = None
+        while True:
+            timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+            try:
+                item = self.produce_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is STOP:
+                break
+            if item is not None and self._send(item, unflushed) and flush_at is None:
+                flush_at = time.monotonic() + self.flush_interval
+            if flush_at is not None and time.monotonic() >= flush_at:
+                self._flush(unflushed)
+                unflushed = {}
+                flush_at = None
+        if unflushed:
+            self._flush(unflushed)
+
+    def _send(self, item, unflushed):
+        """Sends the messages of one processed record. Returns False for a dropped record."""
+        topic_partition, epoch = item.topic_partition, item.epoch
+        if epoch != self.epochs.get(topic_partition):
+            if self.dedup:
+                # The record is consumed again from the rewind offset, or by the partition's new owner
+                self.dedup.forget((topic_partition, epoch), item.offset)
+            return False
+        # The epoch is part of the source so that failures of dropped records are ignored
+        source = ((topic_partition, epoch), item.offset)
+        for alert in item.alerts:
+            send_message_async(self.producer, alert, self.tracker, source, ACCIDENT_TOPIC, item.key, item.headers)
+        if item.messages:
+            for data_item in item.messages:
+                send_message_async(self.producer, data_item, self.tracker, source, item.topic, item.key, item.headers)
+            if not (self.shedder and self.shedder.quiet):
+                logger.info(f"Sent {len(item.messages)} processed messages to {item.topic}")
+        if self.metrics:
+            if not item.ok:
+                self.metrics.invalid_record()
+            self.metrics.processed(item.data_type, item.seconds, item.topic,
+                                   len(item.messages) if item.messages else 0)
+        unflushed[topic_partition] = (epoch, item.offset + 1)
+        with self._lock:
+            if epoch == self.epochs.get(topic_partition):
+                self._inflight[topic_partition] -= 1
+        return True
+
+    def _flush(self, unflushed):
+        """Waits for the acknowledgements of the sent records and marks their offsets for commit."""
+        flush_started = time.perf_counter()
+        failures = flush_messages(self.producer, self.tracker)
+        for data_item, error in failures:
+            logger.error(f"Failed to deliver message: {error}. Message: {data_item}")
+        if self.metrics:
+            self.metrics.flushed(time.perf_counter() - flush_started, len(failures))
+        failed = self.tracker.take_failed_offsets()
+
+        with self._lock:
+            for (topic_partition, epoch), offset in failed.items():
+                if epoch == self.epochs.get(topic_partition) and topic_partition not in self._rewind:
+                    # Re-deliver everything from the first record whose output was lost
+                    self._rewind[topic_partition] = offset
+                    self._acked[topic_partition] = offset
+            for topic_partition, (epoch, offset) in unflushed.items():
+                if epoch == self.epochs.get(topic_partition) and topic_partition not in self._rewind:
+                    self._acked[topic_partition] = offset
+                    if self.dedup:
+                        self.dedup.acknowledged((topic_partition, epoch), offset)
+
+class CommitAndDrop(ConsumerRebalanceListener):
+    """Commits acknowledged progress and drops the queued records of revoked partitions."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def on_partitions_revoked(self, revoked):
+        if MANUAL_COMMIT:
+            self.pipeline.commit()
+        self.pipeline.revoke(set(revoked))
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+def run_pipeline(worker_index=0):
+    """Runs the consumer as a staged pipeline (see Pipeline) with graceful shutdown support."""
+    global running
+
+    # Register signal handlers
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    metrics = None
+    value_deserializer = get_value_deserializer()
+    if METRICS_ENABLED:
+        metrics = ConsumerMetrics()
+        value_deserializer = timed_deserializer(value_deserializer, metrics)
+        start_metrics_server(METRICS_PORT + worker_index)
+
+    consumer = KafkaConsumer(
+        bootstrap_servers=KAFKA_BROKERS,
+        auto_offset_reset='earliest',
+        enable_auto_commit=not MANUAL_COMMIT,
+        group_id=CONSUMER_GROUP_ID,
+        value_deserializer=value_deserializer
+    )
+    producer = get_producer(batched=True)
+    detector = AccidentDetector() if ACCIDENT_DETECTION else None
+    dedup = DedupCache() if DEDUP_ENABLED else None
+
+    summary = SummaryAggregator() if SUMMARY_ENABLED else None
+    retries = RetryGate(consumer) if DEAD_LETTER_ENABLED else None
+    shedder = LoadShedder() if SHED_ENABLED else None
+
+    pipeline = Pipeline(consumer, producer, detector, dedup, metrics, retries, summary, shedder)
+    topics = source_topics()
+    consumer.subscribe(topics, listener=CommitAndDrop(pipeline))
+    pipeline.start()
+    logger.info(f"Subscribed to topics: {topics} ({len(pipeline.process_queues)} process threads)")
+
+    last_commit = time.monotonic()
+    try:
+        while running:
+            pipeline.apply_rewinds()
+            if retries:
+                retries.release()
+            if shedder:
+                shedder.gate(consumer, keep_paused=pipeline.paused)
+            pipeline.drain()
+            pipeline.backpressure()
+
+            poll_started = time.perf_counter()
+            messages = consumer.poll(timeout_ms=POLL_TIMEOUT_MS)
+            poll_seconds = time.perf_counter() - poll_started
+            if shedder:
+                shedder.observe(consumer, messages)
+            pipeline.add(messages)
+
+            if detector:
+                detector.evict()
+            if dedup:
+                dedup.evict()
+            if summary:
+                send_summaries(producer, summary.evict())
+
+            if MANUAL_COMMIT and (time.monotonic() - last_commit) * 1000 >= COMMIT_INTERVAL_MS:
+                pipeline.commit()
+                last_commit = time.monotonic()
+
+            if metrics:
+                pipeline.report()
+                metrics.end_batch(consumer, messages, poll_seconds)
+    except Exception as e:
+        logger.error(f"Error in pipeline poll loop: {e}", exc_info=True)
+    finally:
+        # Close resources gracefully
+        logger.info("Draining pipeline stages...")
+        pipeline.stop()
+        if summary:
+            send_summaries(producer, summary.close())
+        if MANUAL_COMMIT:
+            try:
+                pipeline.commit()
+            except Exception as e:
+                logger.error(f"Final offset commit failed: {e}", exc_info=True)
+        logger.info("Closing consumer and producer...")
+        consumer.close()
+        producer.close()
+        logger.info("Pipeline shutdown complete")
@@ -0,0 +1,70 @@
+"""
+Multi-process consumer pool
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from config.settings import CONSUMER_WORKERS, WORKER_RESTART_DELAY_S, WORKER_SHUTDOWN_TIMEOUT_S
+from .consumer import run_consumer
+
+logger = logging.getLogger(__name__)
+
+# Global flag for graceful shutdown
+running = True
+
+def signal_handler(sig, frame):
+    """Handle shutdown signals gracefully."""
+    global running
+    logger.info("Shutdown signal received. Stopping workers...")
+    running = False
+
+def _worker_count():
+    return CONSUMER_WORKERS or os.cpu_count() or 1
+
+def _start_worker(index):
+    process = multiprocessing.Process(target=run_consumer, args=(index,), name=f"consumer-{index}")
+    process.start()
+    logger.info(f"Started worker {process.name} (pid {process.pid})")
+    return process
+
+def run_pool(workers=None):
+    """
+    Runs N run_consumer processes in the same consumer group and supervises them.
+
+    Kafka assigns each partition to exactly one member of the group, so ordering
+    within a partition is kept. Workers that exit while the pool is running are
+    restarted; on SIGINT/SIGTERM every worker is asked to shut down gracefully.
+    """
+    global running
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    count = workers or _worker_count()
+    logger.info(f"Starting consumer pool with {count} workers")
+    processes = [_start_worker(index) for index in range(count)]
+
+    try:
+        while running:
+            time.sleep(1)
+            for index, process in enumerate(processes):
+                if process.is_alive() or not running:
+                    continue
+                logger.error(f"Worker {process.name} (pid {process.pid}) exited with code {process.exitcode}. Restarting...")
+                time.sleep(WORKER_RESTART_DELAY_S)
+                processes[index] = _start_worker(index)
+    finally:
+        # Workers run the consumer's own SIGTERM handler and close cleanly
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT_S
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {process.name} did not stop in time. Killing...")
+                process.kill()
+                process.join()
+        logger.info("Consumer pool shutdown complete")
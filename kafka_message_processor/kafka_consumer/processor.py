@@ -4,10 +4,19 @@ Message Processor
 import json
 import logging
 from datetime import datetime
+from .columnar import (
+    flatten_ble_data, flatten_lte_data, flatten_lte_v2_data, flatten_nonesub_data,
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Data types, named after the per-type topics of java_kafka_processor
+BLE = "ble"
+LTE = "ltev1"
+LTE_V2 = "ltev2"
+NONESUB = "nonesub"
+
 def process_ble_data(payload):
     """Processes BLE data payload."""
     try:
@@ -156,22 +165,66 @@ def process_nonesub_data(payload):
         logger.error(f"Error processing Nonesub data: {e}", exc_info=True)
         return None
 
-def dispatch_processor(payload):
+def detect_data_type(payload):
     """
-    Dispatches the payload to the correct processor based on its structure.
+    Detects the data type of a payload from its key structure.
+    Returns None for unknown payloads.
     """
     # A more robust solution would be to have a 'type' field in the message.
     # This dispatch logic is based on the key structures observed in tasks.py.
     if "TRAVEL" in payload:
         # Differentiate between LTE and LTE_V2 by checking for the 'LOCATION' key.
         if "LOCATION" in payload:
-            return process_lte_v2_data(payload)
+            return LTE_V2
         else:
-            return process_lte_data(payload)
+            return LTE
     elif "IMU" in payload and "GNSS" in payload:
-        return process_ble_data(payload)
+        return BLE
     elif "TIME" in payload and "GNSS" in payload:
-        return process_nonesub_data(payload)
+        return NONESUB
     else:
+        return None
+
+PROCESSORS = {
+    BLE: process_ble_data,
+    LTE: process_lte_data,
+    LTE_V2: process_lte_v2_data,
+    NONESUB: process_nonesub_data,
+}
+
+COLUMNAR_PROCESSORS = {
+    BLE: flatten_ble_data,
+    LTE: flatten_lte_data,
+    LTE_V2: flatten_lte_v2_data,
+    NONESUB: flatten_nonesub_data,
+}
+
+def dispatch_processor(payload, data_type=None):
+    """
+    Dispatches the payload to the correct processor based on its structure.
+    A data_type already known (e.g. from a header or the source topic) skips detection.
+    """
+    if data_type is None:
+        data_type = detect_data_type(payload)
+    if data_type is None:
         logger.warning(f"Unknown message type. Payload: {json.dumps(payload)}")
-        return None
\ No newline at end of file
+        return None
+    return PROCESSORS[data_type](payload)
+
+def dispatch_columnar(payload, data_type=None):
+    """
+    Columnar counterpart of dispatch_processor.
+    Returns a ColumnarBatch instead of a list of dicts, or None on failure.
+    """
+    if data_type is None:
+        data_type = detect_data_type(payload)
+    if data_type is None:
+        logger.warning(f"Unknown message type. Payload: {json.dumps(payload)}")
+        return None
+    try:
+        batch = COLUMNAR_PROCESSORS[data_type](payload)
+        batch.data_type = data_type
+        return batch
+    except Exception as e:
+        logger.error(f"Error processing {data_type} data: {e}", exc_info=True)
+        return None
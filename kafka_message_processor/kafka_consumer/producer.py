@@ -2,17 +2,115 @@
 Kafka Producer
 """
 import json
+import threading
 from kafka import KafkaProducer
-from config.settings import KAFKA_BROKERS, DESTINATION_TOPIC
+from kafka.errors import KafkaError
+from config.settings import (
+    KAFKA_BROKERS, DESTINATION_TOPIC, PRODUCER_ACKS, PRODUCER_LINGER_MS,
+    PRODUCER_BATCH_SIZE, PRODUCER_COMPRESSION, PRODUCER_MAX_IN_FLIGHT,
+)
 
-def get_producer():
-    """Returns a KafkaProducer instance."""
+def serialize_value(value):
+    """Serializes a message as JSON; already encoded bytes (compressed envelopes) pass through."""
+    if isinstance(value, bytes):
+        return value
+    return json.dumps(value).encode('utf-8')
+
+def serialize_key(key):
+    """Serializes a record key (sensor_id / phone_num)."""
+    return key.encode('utf-8') if isinstance(key, str) else key
+
+def get_producer(batched=False):
+    """
+    Returns a KafkaProducer instance.
+    With batched (asynchronous sends flushed per batch), records linger and are
+    compressed in PRODUCER_BATCH_SIZE batches; otherwise the client defaults apply.
+    """
+    options = {}
+    if batched:
+        options = dict(
+            linger_ms=PRODUCER_LINGER_MS,
+            batch_size=PRODUCER_BATCH_SIZE,
+            compression_type=PRODUCER_COMPRESSION,
+        )
     return KafkaProducer(
         bootstrap_servers=KAFKA_BROKERS,
-        value_serializer=lambda v: json.dumps(v).encode('utf-8')
+        value_serializer=serialize_value,
+        key_serializer=serialize_key,
+        acks=PRODUCER_ACKS,
+        max_in_flight_requests_per_connection=PRODUCER_MAX_IN_FLIGHT,
+        **options,
     )
 
-def send_message(producer, message):
+def send_message(producer, message, topic=DESTINATION_TOPIC, key=None, headers=None):
     """Sends a message to the destination topic."""
-    producer.send(DESTINATION_TOPIC, message)
+    producer.send(topic, message, key=key, headers=headers)
+    producer.flush()
+
+class DeliveryTracker:
+    """
+    Tracks delivery of asynchronously sent messages.
+
+    Callbacks are invoked from the producer's I/O thread, so all counters are
+    guarded by a lock. Failed messages are kept until take_failures() is called,
+    and the lowest failed source offset per partition until take_failed_offsets().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.delivered = 0
+        self._failures = []
+        self._failed_offsets = {}
+
+    def sent(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def on_success(self, metadata):
+        with self._lock:
+            self.in_flight -= 1
+            self.delivered += 1
+
+    def on_error(self, message, source, exception):
+        with self._lock:
+            self.in_flight -= 1
+            self._failures.append((message, exception))
+            if source is not None:
+                topic_partition, offset = source
+                failed = self._failed_offsets.get(topic_partition)
+                if failed is None or offset < failed:
+                    self._failed_offsets[topic_partition] = offset
+
+    def take_failures(self):
+        """Returns the (message, exception) pairs failed since the last call."""
+        with self._lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+    def take_failed_offsets(self):
+        """Returns {TopicPartition: lowest source offset} of failures since the last call."""
+        with self._lock:
+            failed, self._failed_offsets = self._failed_offsets, {}
+        return failed
+
+def send_message_async(producer, message, tracker, source=None,
+                       topic=DESTINATION_TOPIC, key=None, headers=None):
+    """
+    Sends a message to the destination topic without waiting for the broker.
+    The result is reported to tracker; call flush_messages() at batch boundaries.
+    source is the (TopicPartition, offset) of the record the message came from.
+    """
+    tracker.sent()
+    try:
+        future = producer.send(topic, message, key=key, headers=headers)
+    except KafkaError as e:
+        tracker.on_error(message, source, e)
+        return
+    future.add_callback(tracker.on_success)
+    future.add_errback(tracker.on_error, message, source)
+
+def flush_messages(producer, tracker):
+    """Blocks until every in-flight message is acknowledged and returns the failures."""
     producer.flush()
+    return tracker.take_failures()
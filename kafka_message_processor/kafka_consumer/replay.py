@@ -0,0 +1,273 @@
+"""
+Replay / backfill of archived raw payloads
+"""
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from rider_common.archive import read_segment, segment_matches, title_key
+from config.settings import SOURCE_TOPIC
+from .processor import BLE, dispatch_processor, detect_data_type
+from .producer import get_producer, send_message_async, flush_messages, DeliveryTracker
+from .routing import destination_topic, record_headers, record_key
+from .mongo import get_mongo_client, group_by_collection, sample_id
+
+logger = logging.getLogger(__name__)
+
+# Duplicate key errors are not failures: the document is already stored
+DUPLICATE_KEY = 11000
+
+ReplayOptions = namedtuple("ReplayOptions", [
+    "sink",        # 'mongo', 'kafka' (processed records) or 'raw' (payloads back to SOURCE_TOPIC)
+    "sensors",     # set of sensor_id / phone_num to keep, or None
+    "start",       # epoch ms, inclusive, or None
+    "end",         # epoch ms, inclusive, or None
+    "rate",        # max payloads per second per worker, or None
+    "batch_size",  # rows per bulk write
+])
+
+def read_archive_segment(path):
+    """Yields (received_ms, payload) from an archive segment (*.jsonl.gz)."""
+    for record in read_segment(path):
+        yield record["ts"], record["payload"]
+
+def read_text_log(path):
+    """
+    Yields (received_ms, payload) from the legacy text logs.
+    Payload logs alternate a timestamp line and a JSON line; error logs put the
+    JSON after "Payload: ".
+    """
+    received_ms = None
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if line.startswith("Payload: "):
+                line = line[len("Payload: "):]
+            if line.startswith("{"):
+                try:
+                    yield received_ms, json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping unreadable payload line in {path}")
+                continue
+            try:
+                received_ms = int(datetime.fromisoformat(line).timestamp() * 1000)
+            except ValueError:
+                pass
+
+def read_source(path):
+    if path.endswith(".jsonl.gz"):
+        return read_archive_segment(path)
+    return read_text_log(path)
+
+def list_sources(paths, options):
+    """Expands files and directories into the archive segments / text logs to replay."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl.gz"))))
+            files.extend(sorted(glob.glob(os.path.join(path, "*.txt"))))
+        else:
+            files.append(path)
+    return [path for path in files if segment_matches(path, options.sensors, options.start, options.end)]
+
+class RateLimiter:
+    """Blocks so that at most rate events per second pass on average."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._started = time.monotonic()
+        self._count = 0
+
+    def acquire(self):
+        if not self.rate:
+            return
+        self._count += 1
+        ahead = self._count / self.rate - (time.monotonic() - self._started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+class MongoSink:
+    """
+    Buffers rows per (database, collection) and writes them with unordered insert_many.
+    Rows get a deterministic _id (see sample_id), so replaying a file again skips
+    the samples it already stored. Rows that could not be written are counted in failures.
+    """
+
+    def __init__(self, batch_size):
+        self.client = get_mongo_client()
+        self.batch_size = batch_size
+        self.failures = 0
+        self._groups = {}
+
+    def write(self, data_type, payload, rows, received_ms):
+        title_date = payload["TITLE"].split("_")[-1] if data_type == BLE else None
+        for key, group in group_by_collection(data_type, rows, title_date, received_ms).items():
+            buffered = self._groups.setdefault(key, [])
+            buffered.extend(group)
+            if len(buffered) >= self.batch_size:
+                self._write(key)
+
+    def _write(self, key):
+        documents = self._groups.pop(key, None)
+        if documents:
+            database, collection = key
+            for document in documents:
+                document["_id"] = sample_id(document)
+            try:
+                self.client[database][collection].insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+                if errors:
+                    logger.error(f"{len(errors)} rows failed to write to {database}.{collection}: {errors[0].get('errmsg')}")
+                    self.failures += len(errors)
+
+    def close(self):
+        for key in list(self._groups):
+            self._write(key)
+        self.client.close()
+
+class KafkaSink:
+    """
+    Produces processed records (or raw payloads) asynchronously, flushing every batch_size sends.
+    Records whose delivery failed are counted in failures.
+    """
+
+    def __init__(self, batch_size, raw=False):
+        self.producer = get_producer(batched=True)
+        self.tracker = DeliveryTracker()
+        self.batch_size = batch_size
+        self.raw = raw
+        self.failures = 0
+        self._sent = 0
+
+    def write(self, data_type, payload, rows, received_ms):
+        headers = record_headers(data_type)
+        key = record_key(payload)
+        if self.raw:
+            send_message_async(self.producer, payload, self.tracker, topic=SOURCE_TOPIC, key=key, headers=headers)
+            self._sent += 1
+        else:
+            topic = destination_topic(data_type)
+            for row in rows:
+                send_message_async(self.producer, row, self.tracker, topic=topic, key=key, headers=headers)
+            self._sent += len(rows)
+        if self._sent >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self._sent = 0
+        failures = flush_messages(self.producer, self.tracker)
+        if failures:
+            logger.error(f"{len(failures)} records failed to deliver: {failures[0][1]}")
+            self.failures += len(failures)
+
+    def close(self):
+        self.flush()
+        self.producer.close()
+
+def _make_sink(options):
+    if options.sink == 'mongo':
+        return MongoSink(options.batch_size)
+    return KafkaSink(options.batch_size, raw=options.sink == 'raw')
+
+def replay_file(path, options):
+    """
+    Replays one file. Returns (path, payloads, rows, error); error describes why
+    the file was not fully written (failed records or an exception), else None.
+    """
+    try:
+        sink = _make_sink(options)
+    except Exception as e:
+        logger.error(f"Failed to replay {path}: {e}", exc_info=True)
+        return path, 0, 0, str(e)
+    limiter = RateLimiter(options.rate)
+    payloads = rows_written = 0
+    error = None
+    try:
+        for received_ms, payload in read_source(path):
+            if options.start is not None and (received_ms is None or received_ms < options.start):
+                continue
+            if options.end is not None and (received_ms is None or received_ms > options.end):
+                continue
+            if options.sensors and title_key(payload) not in options.sensors:
+                continue
+            limiter.acquire()
+            data_type = detect_data_type(payload)
+            if data_type is None:
+                logger.warning(f"Unknown message type in {path}")
+                continue
+            rows = [] if options.sink == 'raw' else dispatch_processor(payload, data_type)
+            if rows is None:
+                continue
+            sink.write(data_type, payload, rows, received_ms)
+            payloads += 1
+            rows_written += len(rows)
+    except Exception as e:
+        logger.error(f"Failed to replay {path}: {e}", exc_info=True)
+        error = str(e)
+    finally:
+        try:
+            sink.close()
+        except Exception as e:
+            logger.error(f"Failed to close the sink of {path}: {e}", exc_info=True)
+            error = error or str(e)
+    if error is None and sink.failures:
+        error = f"{sink.failures} records failed to write"
+    return path, payloads, rows_written, error
+
+def _replay_file_star(args):
+    return replay_file(*args)
+
+def load_checkpoint(checkpoint):
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as file:
+            return set(json.load(file)["done"])
+    return set()
+
+def save_checkpoint(checkpoint, done):
+    # Write then rename so an interrupted save never corrupts the checkpoint
+    tmp_path = checkpoint + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"done": sorted(done)}, file)
+    os.replace(tmp_path, checkpoint)
+
+def run_replay(paths, options, processes=1, checkpoint=None):
+    """
+    Replays archived payloads from paths (files or directories) in parallel.
+
+    Each file is handled by one worker process; the global rate limit is split
+    evenly across workers. Finished files are recorded in checkpoint so an
+    interrupted replay resumes with the remaining files (a file that was only
+    partly replayed is replayed again, so the sink sees it at least once).
+    Files with failed records are reported and left out of the checkpoint, so a
+    rerun replays them again. Returns (payloads, rows, failed files).
+    """
+    done = load_checkpoint(checkpoint)
+    files = [path for path in list_sources(paths, options) if path not in done]
+    if options.rate:
+        options = options._replace(rate=options.rate / processes)
+    logger.info(f"Replaying {len(files)} files with {processes} processes ({len(done)} already done)")
+
+    total_payloads = total_rows = 0
+    failed = []
+    started = time.monotonic()
+    with multiprocessing.Pool(processes) as pool:
+        for path, payloads, rows, error in pool.imap_unordered(_replay_file_star, [(path, options) for path in files]):
+            total_payloads += payloads
+            total_rows += rows
+            if error:
+                logger.error(f"Replay of {path} incomplete ({error}), not checkpointed")
+                failed.append(path)
+                continue
+            done.add(path)
+            if checkpoint:
+                save_checkpoint(checkpoint, done)
+            elapsed = time.monotonic() - started
+            logger.info(f"Replayed {path}: {payloads} payloads, {rows} rows "
+                        f"(total {total_payloads} payloads, {total_payloads / max(elapsed, 1e-9):.0f}/s)")
+    return total_payloads, total_rows, failed
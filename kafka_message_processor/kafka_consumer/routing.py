@@ -0,0 +1,45 @@
+"""
+Message routing
+"""
+from config.settings import (
+    DESTINATION_TOPIC, DESTINATION_TOPICS, SOURCE_TOPIC_TYPES, TYPE_HEADER, KEYED_OUTPUT,
+)
+from .processor import PROCESSORS
+
+def header_value(message, name):
+    """Returns the first non-empty value of a record header as text, or None. Invalid UTF-8 is replaced."""
+    for key, value in message.headers or ():
+        if key == name and value:
+            return value.decode('utf-8', errors='replace')
+    return None
+
+def header_data_type(message):
+    """Returns the data type of the TYPE_HEADER header, or None when missing or not a known type."""
+    data_type = header_value(message, TYPE_HEADER)
+    return data_type if data_type in PROCESSORS else None
+
+def resolve_data_type(message):
+    """
+    Returns the data type given by the TYPE_HEADER header or the source topic mapping.
+    Returns None when neither applies; the caller then falls back to key probing.
+    """
+    return header_data_type(message) or SOURCE_TOPIC_TYPES.get(message.topic)
+
+def destination_topic(data_type):
+    """Returns the destination topic for a data type."""
+    return DESTINATION_TOPICS.get(data_type, DESTINATION_TOPIC)
+
+def record_key(payload):
+    """
+    Returns the record key of a payload's output: sensor_id for BLE/LTE,
+    phone_num for Nonesub. Both are the first part of TITLE.
+    """
+    if not KEYED_OUTPUT:
+        return None
+    return payload["TITLE"].split("_", 1)[0]
+
+def record_headers(data_type):
+    """Returns the headers tagging an output record with its data type."""
+    if data_type is None:
+        return None
+    return [(TYPE_HEADER, data_type.encode('utf-8'))]
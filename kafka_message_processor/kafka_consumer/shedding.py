@@ -0,0 +1,199 @@
+"""
+Adaptive load shedding driven by consumer lag and record age
+
+While the consumer falls behind, processing is degraded step by step and
+restored automatically once it has caught up:
+
+    level 0  full fidelity
+    level 1  per-record logging is skipped and the IMU samples of
+             SHED_DOWNSAMPLE_TYPES are downsampled to every
+             SHED_DOWNSAMPLE_FACTOR-th sample; samples over the accident
+             thresholds are always kept
+    level 2  in addition, records of SHED_DEFER_TYPES are moved unprocessed to
+             SHED_DEFER_TOPIC, whose partitions stay paused until the consumer
+             is back below level 2 (the deferred lane)
+
+A level is entered as soon as the lag (records behind the high watermark,
+summed over the source partitions) or the age of the newest polled record
+passes its threshold, and left one step at a time once both stayed below
+SHED_RECOVERY_RATIO of the level's thresholds for SHED_RECOVERY_S seconds.
+"""
+import logging
+import time
+import numpy as np
+from config.settings import (
+    TYPE_HEADER, SHED_LAG_THRESHOLDS, SHED_LATENCY_THRESHOLDS_MS, SHED_RECOVERY_RATIO, SHED_RECOVERY_S,
+    SHED_DOWNSAMPLE_TYPES, SHED_DOWNSAMPLE_FACTOR, SHED_DEFER_TYPES, SHED_DEFER_TOPIC,
+)
+from .accident import ACCEL_THRESHOLD, GYRO_THRESHOLD
+from .columnar import ColumnarBatch, float_column
+from .metrics import REGISTRY
+from .processor import detect_data_type
+from .routing import resolve_data_type
+
+logger = logging.getLogger(__name__)
+
+FULL, DEGRADED, DEFERRING = 0, 1, 2
+LEVEL_NAMES = ("full", "degraded", "deferring")
+
+# Partition measurements older than this are dropped (revoked or idle partitions)
+STALE_S = 60
+
+# Samples kept regardless of downsampling: a horizontal axis over 1 g or any gyro axis over the fall threshold
+ACCEL_COLUMNS = ("ACCEL_X", "ACCEL_Y")
+GYRO_COLUMNS = ("GYRO_X", "GYRO_Y", "GYRO_Z")
+
+
+class LoadShedder:
+    """
+    Shedding level of one consumer and the degradations it applies.
+
+    observe() and gate() are called by the polling thread; quiet, downsample()
+    and deferred_type() may be called from the pipeline's process threads,
+    which only read the current level.
+    """
+
+    def __init__(self, lag_thresholds=SHED_LAG_THRESHOLDS, latency_thresholds_ms=SHED_LATENCY_THRESHOLDS_MS,
+                 recovery_ratio=SHED_RECOVERY_RATIO, recovery_s=SHED_RECOVERY_S,
+                 downsample_types=SHED_DOWNSAMPLE_TYPES, downsample_factor=SHED_DOWNSAMPLE_FACTOR,
+                 defer_types=SHED_DEFER_TYPES, defer_topic=SHED_DEFER_TOPIC, registry=REGISTRY):
+        self.lag_thresholds = lag_thresholds
+        self.latency_thresholds_ms = latency_thresholds_ms
+        self.recovery_ratio = recovery_ratio
+        self.recovery_s = recovery_s
+        self.downsample_types = set(downsample_types)
+        self.downsample_factor = downsample_factor
+        self.defer_types = set(defer_types)
+        self.defer_topic = defer_topic
+        self.level = FULL
+        self.lag = 0
+        self.age_ms = 0
+        self.paused = set()
+        self._partitions = {}
+        self._recovering_since = None
+        self._level = registry.gauge('load_shedding_level', 'Load shedding level (0 full, 1 degraded, 2 deferring)')
+        self._lag = registry.gauge('load_shedding_lag', 'Records behind the high watermark, summed over source partitions')
+        self._age = registry.gauge('load_shedding_record_age_seconds', 'Age of the newest polled record')
+        self._changes = registry.counter('load_shedding_changes_total', 'Load shedding level changes', ('level',))
+        self._shed = registry.counter('shed_samples_total', 'Samples dropped by downsampling', ('data_type',))
+        self._deferred = registry.counter('deferred_records_total', 'Records moved to the deferred lane', ('data_type',))
+
+    @property
+    def quiet(self):
+        """True while per-record logging is skipped."""
+        return self.level >= DEGRADED
+
+    def observe(self, consumer, messages):
+        """Updates the lag / age measurements with a poll batch and changes the level if needed."""
+        now = time.monotonic()
+        now_ms = int(time.time() * 1000)
+        for topic_partition, records in messages.items():
+            if topic_partition.topic == self.defer_topic or not records:
+                continue
+            # highwater() comes with the fetch response, it does not query the broker
+            highwater = consumer.highwater(topic_partition)
+            lag = highwater - records[-1].offset - 1 if highwater is not None else 0
+            timestamp = records[-1].timestamp
+            age_ms = max(0, now_ms - timestamp) if timestamp and timestamp > 0 else 0
+            self._partitions[topic_partition] = (lag, age_ms, now)
+        for topic_partition, (_, _, measured) in list(self._partitions.items()):
+            if now - measured > STALE_S:
+                del self._partitions[topic_partition]
+        self.lag = sum(lag for lag, _, _ in self._partitions.values())
+        self.age_ms = max((age_ms for _, age_ms, _ in self._partitions.values()), default=0)
+        self._lag.set(self.lag)
+        self._age.set(self.age_ms / 1000)
+        self._update_level(now)
+
+    def _over(self, level, ratio=1.0):
+        """True when lag or age is over the thresholds of level (scaled by ratio)."""
+        return (self.lag > self.lag_thresholds[level - 1] * ratio
+                or self.age_ms > self.latency_thresholds_ms[level - 1] * ratio)
+
+    def _update_level(self, now):
+        target = FULL
+        for level in (DEGRADED, DEFERRING):
+            if self._over(level):
+                target = level
+        if target > self.level:
+            self._recovering_since = None
+            self._set_level(target)
+            return
+        if self.level == FULL or self._over(self.level, self.recovery_ratio):
+            self._recovering_since = None
+            return
+        if self._recovering_since is None:
+            self._recovering_since = now
+        elif now - self._recovering_since >= self.recovery_s:
+            self._recovering_since = None
+            self._set_level(self.level - 1)
+
+    def _set_level(self, level):
+        previous, self.level = self.level, level
+        self._level.set(level)
+        self._changes.inc(level=LEVEL_NAMES[level])
+        message = (f"Load shedding {LEVEL_NAMES[previous]} -> {LEVEL_NAMES[level]} "
+                   f"(lag {self.lag} records, newest record {self.age_ms / 1000:.1f}s old)")
+        if level > previous:
+            logger.warning(message)
+        else:
+            logger.info(message)
+
+    def gate(self, consumer, keep_paused=()):
+        """
+        Pauses the assigned SHED_DEFER_TOPIC partitions at the deferring level and
+        resumes them below it. Partitions in keep_paused (paused by someone else)
+        are not resumed.
+        """
+        assigned = {topic_partition for topic_partition in consumer.assignment()
+                    if topic_partition.topic == self.defer_topic}
+        self.paused &= assigned
+        if self.level >= DEFERRING:
+            pause = assigned - self.paused
+            if pause:
+                consumer.pause(*pause)
+                self.paused |= pause
+        elif self.paused:
+            resume = self.paused - set(keep_paused)
+            if resume:
+                consumer.resume(*resume)
+                logger.info(f"Resumed deferred lane {sorted(resume)}")
+            self.paused = set()
+
+    def deferred_type(self, message, payload):
+        """Returns the data type of a record to move to the deferred lane, or None to process it."""
+        if self.level < DEFERRING or message.topic == self.defer_topic:
+            return None
+        data_type = resolve_data_type(message)
+        if data_type is None and isinstance(payload, dict):
+            data_type = detect_data_type(payload)
+        if data_type not in self.defer_types:
+            return None
+        self._deferred.inc(data_type=data_type)
+        return data_type
+
+    def deferred_headers(self, message, data_type):
+        """Headers of a deferred record: the source headers, tagged with the data type for its later routing."""
+        headers = list(message.headers or ())
+        if not any(key == TYPE_HEADER for key, _ in headers):
+            headers.append((TYPE_HEADER, data_type.encode('utf-8')))
+        return headers
+
+    def downsample(self, flattened, data_type):
+        """Returns the flattened samples to send: every downsample_factor-th and every high-magnitude one when degraded."""
+        if self.level < DEGRADED or data_type not in self.downsample_types or self.downsample_factor <= 1:
+            return flattened
+        if not len(flattened):
+            return flattened
+        keep = np.arange(len(flattened)) % self.downsample_factor == 0
+        for name in ACCEL_COLUMNS:
+            keep |= np.abs(float_column(flattened, name)) > ACCEL_THRESHOLD
+        for name in GYRO_COLUMNS:
+            keep |= np.abs(float_column(flattened, name)) > GYRO_THRESHOLD
+        kept = int(keep.sum())
+        if kept == len(flattened):
+            return flattened
+        self._shed.inc(len(flattened) - kept, data_type=data_type)
+        if isinstance(flattened, ColumnarBatch):
+            return flattened.select(keep)
+        return [row for row, flag in zip(flattened, keep.tolist()) if flag]
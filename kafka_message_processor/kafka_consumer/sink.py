@@ -0,0 +1,271 @@
+"""
+Kafka to MongoDB sink for the processed destination topics
+"""
+import json
+import logging
+import signal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from kafka import KafkaConsumer, ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
+from pymongo.errors import BulkWriteError
+from config.settings import (
+    KAFKA_BROKERS, COMMIT_INTERVAL_MS, SINK_TOPICS, SINK_GROUP_ID,
+    SINK_BATCH_DOCUMENTS, SINK_BATCH_MS, SINK_WRITE_CONCURRENCY, SINK_WRITE_RETRIES, SINK_RETRY_BACKOFF_MS,
+)
+from .envelope import is_envelope, decode_envelope
+from .mongo import get_mongo_client, group_by_collection
+from .processor import BLE, LTE, NONESUB
+from .routing import header_data_type
+
+logger = logging.getLogger(__name__)
+
+# Duplicate key errors are not retried: the document is already stored
+DUPLICATE_KEY = 11000
+
+# Global flag for graceful shutdown
+running = True
+
+def signal_handler(sig, frame):
+    """Handle shutdown signals gracefully."""
+    global running
+    logger.info("Shutdown signal received. Stopping sink...")
+    running = False
+
+def decode_value(value):
+    """Decodes a destination record value: a per-sample record or an envelope (plain or compressed)."""
+    if value[:1] == b'{':
+        decoded = json.loads(value.decode('utf-8'))
+        return decode_envelope(decoded) if is_envelope(decoded) else [decoded]
+    return decode_envelope(value)
+
+def record_data_type(message, rows):
+    """
+    Returns the data type of a destination record: the TYPE_HEADER header, else
+    guessed from the row fields (LTE V1 and V2 share a database).
+    """
+    data_type = header_data_type(message)
+    if data_type is not None:
+        return data_type
+    if not rows:
+        return None
+    if "sensor_id" not in rows[0]:
+        return NONESUB
+    return LTE if "DISTANCE" in rows[0] else BLE
+
+class _Pending:
+    """A source record whose rows are not all written yet."""
+    __slots__ = ("offset", "remaining")
+
+    def __init__(self, offset, remaining):
+        self.offset = offset
+        self.remaining = remaining
+
+class _Buffer:
+    __slots__ = ("documents", "records", "started")
+
+    def __init__(self):
+        self.documents = []
+        self.records = []
+        self.started = time.monotonic()
+
+class MongoSinkWriter:
+    """
+    Buffers rows per (database, daily collection) and writes them with up to
+    concurrency unordered insert_many calls in flight.
+
+    A buffer is written once it holds batch_documents rows or is batch_ms old.
+    Every source record remembers how many buffers still hold its rows; the
+    committable offset of a partition is the offset after its longest prefix of
+    fully written records, so offsets are only committed after MongoDB has
+    acknowledged the rows (at-least-once). A write that still fails after
+    retries raises, and the sink stops without committing past it.
+    """
+
+    def __init__(self, client, batch_documents=SINK_BATCH_DOCUMENTS, batch_ms=SINK_BATCH_MS,
+                 concurrency=SINK_WRITE_CONCURRENCY, retries=SINK_WRITE_RETRIES,
+                 retry_backoff_ms=SINK_RETRY_BACKOFF_MS):
+        self.client = client
+        self.batch_documents = batch_documents
+        self.batch_ms = batch_ms
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_backoff_ms = retry_backoff_ms
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="mongo-sink")
+        self.written = 0
+        self._buffers = {}
+        self._pending = {}
+        self._in_flight = {}
+
+    def add(self, topic_partition, message, data_type, rows):
+        """Adds the rows of one destination record."""
+        groups = group_by_collection(data_type, rows, received_ms=message.timestamp) if rows else {}
+        entry = _Pending(message.offset, len(groups))
+        self._pending.setdefault(topic_partition, deque()).append(entry)
+        for key, documents in groups.items():
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = _Buffer()
+            buffer.documents.extend(documents)
+            buffer.records.append(entry)
+            if len(buffer.documents) >= self.batch_documents:
+                self._submit(key)
+
+    def flush_due(self):
+        """Writes the buffers older than batch_ms and collects finished writes."""
+        deadline = time.monotonic() - self.batch_ms / 1000
+        for key in [key for key, buffer in self._buffers.items() if buffer.started <= deadline]:
+            self._submit(key)
+        self._collect(block=False)
+
+    def drain(self):
+        """Writes every buffer and waits for all writes."""
+        for key in list(self._buffers):
+            self._submit(key)
+        while self._in_flight:
+            self._collect(block=True)
+
+    def committable(self):
+        """Returns {TopicPartition: next offset} of the fully written records since the last call."""
+        offsets = {}
+        for topic_partition, entries in self._pending.items():
+            offset = None
+            while entries and entries[0].remaining == 0:
+                offset = entries.popleft().offset + 1
+            if offset is not None:
+                offsets[topic_partition] = offset
+        return offsets
+
+    def forget(self, topic_partitions):
+        """Drops the bookkeeping of revoked partitions (call after drain())."""
+        for topic_partition in topic_partitions:
+            self._pending.pop(topic_partition, None)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _submit(self, key):
+        buffer = self._buffers.pop(key)
+        # Bound the writes in flight; waiting here is the sink's backpressure on poll
+        while len(self._in_flight) >= self.concurrency:
+            self._collect(block=True)
+        future = self.executor.submit(self._write, key, buffer.documents)
+        self._in_flight[future] = buffer
+
+    def _collect(self, block):
+        if not self._in_flight:
+            return
+        done, _ = wait(list(self._in_flight), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            buffer = self._in_flight.pop(future)
+            # Raises when the write failed after its retries
+            self.written += future.result()
+            for entry in buffer.records:
+                entry.remaining -= 1
+
+    def _write(self, key, documents):
+        database, collection = key
+        count = len(documents)
+        attempt = 0
+        while True:
+            try:
+                self.client[database][collection].insert_many(documents, ordered=False)
+                return count
+            except BulkWriteError as e:
+                # Unordered inserts keep going past errors; only retry what was not stored
+                failed = {error["index"] for error in e.details.get("writeErrors", ())
+                          if error.get("code") != DUPLICATE_KEY}
+                if not failed:
+                    return count
+                documents = [document for index, document in enumerate(documents) if index in failed]
+                error = e
+            except Exception as e:
+                error = e
+            attempt += 1
+            if attempt > self.retries:
+                raise error
+            logger.warning(f"Write to {database}.{collection} failed ({error}), retry {attempt}/{self.retries}")
+            time.sleep(self.retry_backoff_ms * 2 ** (attempt - 1) / 1000)
+
+class DrainOnRevoke(ConsumerRebalanceListener):
+    """Writes and commits everything buffered before partitions are reassigned."""
+
+    def __init__(self, consumer, writer):
+        self.consumer = consumer
+        self.writer = writer
+
+    def on_partitions_revoked(self, revoked):
+        if not revoked:
+            return
+        self.writer.drain()
+        commit_written(self.consumer, self.writer)
+        self.writer.forget(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+def commit_written(consumer, writer):
+    """Commits the offsets of the records whose rows are acknowledged by MongoDB."""
+    offsets = {topic_partition: OffsetAndMetadata(offset, '', -1)
+               for topic_partition, offset in writer.committable().items()}
+    if offsets:
+        consumer.commit(offsets)
+        logger.debug(f"Committed offsets: {offsets}")
+
+def run_sink():
+    """Consumes SINK_TOPICS and writes the rows to the databases of the Celery tasks."""
+    global running
+
+    # Register signal handlers
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    consumer = KafkaConsumer(
+        bootstrap_servers=KAFKA_BROKERS,
+        auto_offset_reset='earliest',
+        enable_auto_commit=False,
+        group_id=SINK_GROUP_ID,
+    )
+    client = get_mongo_client()
+    writer = MongoSinkWriter(client)
+    consumer.subscribe(SINK_TOPICS, listener=DrainOnRevoke(consumer, writer))
+    logger.info(f"Sinking topics {SINK_TOPICS} into MongoDB")
+
+    last_commit = time.monotonic()
+    try:
+        while running:
+            messages = consumer.poll(timeout_ms=min(1000, SINK_BATCH_MS))
+            for topic_partition, records in messages.items():
+                for message in records:
+                    try:
+                        rows = decode_value(message.value)
+                    except Exception as e:
+                        logger.warning(f"Undecodable record at {topic_partition} offset {message.offset}: {e}")
+                        rows = []
+                    data_type = record_data_type(message, rows)
+                    if rows and data_type is None:
+                        logger.warning(f"Unknown record type at {topic_partition} offset {message.offset}")
+                        rows = []
+                    writer.add(topic_partition, message, data_type, rows)
+            writer.flush_due()
+
+            if (time.monotonic() - last_commit) * 1000 >= COMMIT_INTERVAL_MS:
+                commit_written(consumer, writer)
+                last_commit = time.monotonic()
+    except Exception as e:
+        logger.error(f"Error in sink loop: {e}", exc_info=True)
+    finally:
+        logger.info("Writing buffered rows and closing the sink...")
+        try:
+            writer.drain()
+        except Exception as e:
+            logger.error(f"Final writes failed: {e}", exc_info=True)
+        try:
+            commit_written(consumer, writer)
+        except Exception as e:
+            logger.error(f"Final offset commit failed: {e}", exc_info=True)
+        writer.close()
+        consumer.close()
+        client.close()
+        logger.info(f"Sink shutdown complete ({writer.written} documents written)")
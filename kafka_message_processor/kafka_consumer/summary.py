@@ -0,0 +1,272 @@
+"""
+Per-sensor windowed summaries of IMU samples
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from config.settings import (
+    SUMMARY_TOPIC, SUMMARY_WINDOW_MS, SUMMARY_ALLOWED_LATENESS_MS, SUMMARY_IDLE_S,
+    SUMMARY_MAX_SENSORS, KEYED_OUTPUT,
+)
+from .columnar import ColumnarBatch, float_column
+from .metrics import REGISTRY
+from .routing import record_headers
+
+logger = logging.getLogger(__name__)
+
+# Sample block columns; DISTANCE is NaN for BLE
+COLUMNS = (
+    "time", "ACCEL_X", "ACCEL_Y", "ACCEL_Z", "GYRO_X", "GYRO_Y", "GYRO_Z",
+    "LAT", "LON", "VELOCITY", "ALTITUDE", "BEARING", "DISTANCE",
+)
+TIME, ACCEL_X, ACCEL_Y, ACCEL_Z, GYRO_X, GYRO_Y, GYRO_Z = range(7)
+# Columns reported with their value at the last sample of a window
+LAST_COLUMNS = ("LAT", "LON", "VELOCITY", "ALTITUDE", "BEARING", "DISTANCE")
+LAST = [COLUMNS.index(column) for column in LAST_COLUMNS]
+VELOCITY = COLUMNS.index("VELOCITY")
+
+
+class Window:
+    """
+    Running aggregates of one sensor's samples in [start, start + window_ms).
+    Means and maxima leave out missing (NaN) values, accel_count / velocity_count
+    are the samples that had one.
+    """
+    __slots__ = ("start", "data_type", "count", "accel_sum", "accel_count", "accel_max", "gyro_max",
+                 "velocity_sum", "velocity_count", "velocity_max", "last_time", "last")
+
+    def __init__(self, start, data_type):
+        self.start = start
+        self.data_type = data_type
+        self.count = 0
+        self.accel_sum = 0.0
+        self.accel_count = 0
+        self.accel_max = float("-inf")
+        self.gyro_max = float("-inf")
+        self.velocity_sum = 0.0
+        self.velocity_count = 0
+        self.velocity_max = float("-inf")
+        self.last_time = None
+        self.last = None
+
+
+class SensorSummaries:
+    """Open windows of one sensor and how far its event time has progressed."""
+    __slots__ = ("phone_num", "windows", "newest", "closed_until", "last_seen")
+
+    def __init__(self):
+        self.phone_num = None
+        self.windows = {}
+        self.newest = None
+        self.closed_until = None
+        self.last_seen = time.monotonic()
+
+
+def _sample_block(flattened):
+    """
+    Returns (sensor_id, phone_num, samples array in COLUMNS order) of a flattened payload.
+    Missing and non-numeric values are NaN.
+    """
+    if isinstance(flattened, ColumnarBatch):
+        sensor_id = flattened.fields.get("sensor_id")
+        phone_num = flattened.fields.get("phone_num")
+        if sensor_id is None or not len(flattened):
+            return None, None, None
+    else:
+        if not flattened or "sensor_id" not in flattened[0]:
+            return None, None, None
+        sensor_id = flattened[0]["sensor_id"]
+        phone_num = flattened[0].get("phone_num")
+    return sensor_id, phone_num, np.column_stack([float_column(flattened, column) for column in COLUMNS])
+
+
+def _value(value, digits=6):
+    """A summary value: None for a missing (NaN) or empty (infinite) one, which JSON cannot carry."""
+    return round(float(value), digits) if np.isfinite(value) else None
+
+
+def _mean(total, count):
+    return round(total / count, 2) if count else None
+
+
+def _sums(values, first):
+    """Per-group (sum, count) of the values that are not NaN."""
+    present = ~np.isnan(values)
+    return (np.add.reduceat(np.where(present, values, 0.0), first).tolist(),
+            np.add.reduceat(present, first).tolist())
+
+
+class SummaryAggregator:
+    """
+    Downsamples IMU payloads (BLE / LTE) into one summary per sensor and window.
+
+    Samples are bucketed into window_ms windows by their own time (event time),
+    and every payload is reduced with NumPy (np.*.reduceat over the samples sorted
+    by time) before being merged into the sensor's open windows. A window is
+    closed once the sensor's newest sample is allowed_lateness_ms past its end;
+    samples arriving for a closed window are dropped from the summaries (counted
+    as summary_late_samples_total) but still sent raw. Sensors idle for idle_s
+    seconds have their windows closed and are dropped, and at most max_sensors
+    are kept (least recently seen first out). update() and evict() may be
+    called from different threads (see pipeline.py).
+
+    Summaries are kept in memory only: the windows still open at shutdown are
+    emitted by close(), so a window may be emitted twice across a restart and
+    readers should upsert on (sensor_id, window_start).
+    """
+
+    def __init__(self, window_ms=SUMMARY_WINDOW_MS, allowed_lateness_ms=SUMMARY_ALLOWED_LATENESS_MS,
+                 idle_s=SUMMARY_IDLE_S, max_sensors=SUMMARY_MAX_SENSORS, registry=REGISTRY):
+        self.window_ms = window_ms
+        self.allowed_lateness_ms = allowed_lateness_ms
+        self.idle_s = idle_s
+        self.max_sensors = max_sensors
+        self.sensors = OrderedDict()
+        self.open_windows = 0
+        self._lock = threading.Lock()
+        self._windows = registry.counter('summary_windows_total', 'Summary windows emitted')
+        self._late = registry.counter('summary_late_samples_total', 'Samples of already closed summary windows')
+        self._open = registry.gauge('summary_open_windows', 'Summary windows waiting to be closed')
+
+    def update(self, flattened, data_type=None):
+        """Adds the samples of one flattened payload and returns the closed windows as (data_type, summary)."""
+        sensor_id, phone_num, block = _sample_block(flattened)
+        if sensor_id is None:
+            return []
+        with self._lock:
+            summaries = self._update(sensor_id, phone_num, data_type, block)
+            self._open.set(self.open_windows)
+        return summaries
+
+    def _update(self, sensor_id, phone_num, data_type, block):
+        summaries = []
+        state = self.sensors.get(sensor_id)
+        if state is None:
+            state = self.sensors[sensor_id] = SensorSummaries()
+            if len(self.sensors) > self.max_sensors:
+                evicted_id, evicted = self.sensors.popitem(last=False)
+                summaries += self._close(evicted_id, evicted, None)
+        else:
+            self.sensors.move_to_end(sensor_id)
+        state.last_seen = time.monotonic()
+        state.phone_num = phone_num
+
+        block = block[np.argsort(block[:, TIME], kind="stable")]
+        times = block[:, TIME].astype(np.int64)
+        starts = times // self.window_ms * self.window_ms
+        first = np.concatenate(([0], np.flatnonzero(np.diff(starts)) + 1))
+        last = np.append(first[1:], len(block)) - 1
+        counts = last - first + 1
+
+        accel = np.sqrt(block[:, ACCEL_X] ** 2 + block[:, ACCEL_Y] ** 2 + block[:, ACCEL_Z] ** 2)
+        gyro = np.sqrt(block[:, GYRO_X] ** 2 + block[:, GYRO_Y] ** 2 + block[:, GYRO_Z] ** 2)
+        velocity = block[:, VELOCITY]
+        # fmax skips NaN (a group with no value at all stays NaN, which max() below ignores)
+        accel_sum, accel_count = _sums(accel, first)
+        accel_max = np.fmax.reduceat(accel, first).tolist()
+        gyro_max = np.fmax.reduceat(gyro, first).tolist()
+        velocity_sum, velocity_count = _sums(velocity, first)
+        velocity_max = np.fmax.reduceat(velocity, first).tolist()
+        counts = counts.tolist()
+
+        late = 0
+        for group, start in enumerate(starts[first].tolist()):
+            if state.closed_until is not None and start < state.closed_until:
+                late += counts[group]
+                continue
+            window = state.windows.get(start)
+            if window is None:
+                window = state.windows[start] = Window(start, data_type)
+                self.open_windows += 1
+            window.count += counts[group]
+            window.accel_sum += accel_sum[group]
+            window.accel_count += accel_count[group]
+            window.accel_max = max(window.accel_max, accel_max[group])
+            window.gyro_max = max(window.gyro_max, gyro_max[group])
+            window.velocity_sum += velocity_sum[group]
+            window.velocity_count += velocity_count[group]
+            window.velocity_max = max(window.velocity_max, velocity_max[group])
+            last_time = int(times[last[group]])
+            if window.last_time is None or last_time >= window.last_time:
+                window.last_time = last_time
+                window.last = block[last[group], LAST]
+        if late:
+            self._late.inc(late)
+
+        newest = int(times[-1])
+        if state.newest is None or newest > state.newest:
+            state.newest = newest
+        watermark = state.newest - self.allowed_lateness_ms
+        summaries += self._close(sensor_id, state, watermark // self.window_ms * self.window_ms)
+        return summaries
+
+    def _close(self, sensor_id, state, until):
+        """Closes the windows of a sensor starting before until (all of them for None)."""
+        if until is not None:
+            if state.closed_until is not None and until <= state.closed_until:
+                return []
+            state.closed_until = until
+        closing = sorted(start for start in state.windows if until is None or start < until)
+        summaries = []
+        for start in closing:
+            window = state.windows.pop(start)
+            summaries.append((window.data_type, self._summary(sensor_id, state, window)))
+        self.open_windows -= len(closing)
+        if closing:
+            self._windows.inc(len(closing))
+        return summaries
+
+    def _summary(self, sensor_id, state, window):
+        summary = {
+            "sensor_id": sensor_id,
+            "phone_num": state.phone_num,
+            "window_start": window.start,
+            "window_end": window.start + self.window_ms,
+            "time": window.last_time,
+            "samples": window.count,
+            "accel_mean": _mean(window.accel_sum, window.accel_count),
+            "accel_max": _value(window.accel_max, 2),
+            "gyro_max": _value(window.gyro_max, 2),
+            "velocity_mean": _mean(window.velocity_sum, window.velocity_count),
+            "velocity_max": _value(window.velocity_max),
+        }
+        summary.update(zip(LAST_COLUMNS, (_value(value) for value in window.last)))
+        return summary
+
+    def evict(self):
+        """Closes the windows of sensors idle for longer than idle_s and drops them; returns their summaries."""
+        deadline = time.monotonic() - self.idle_s
+        summaries = []
+        with self._lock:
+            while self.sensors:
+                sensor_id, state = next(iter(self.sensors.items()))
+                if state.last_seen > deadline:
+                    break
+                del self.sensors[sensor_id]
+                summaries += self._close(sensor_id, state, None)
+            self._open.set(self.open_windows)
+        return summaries
+
+    def close(self):
+        """Closes every open window; returns their summaries."""
+        summaries = []
+        with self._lock:
+            for sensor_id, state in self.sensors.items():
+                summaries += self._close(sensor_id, state, None)
+            self.sensors.clear()
+            self._open.set(self.open_windows)
+        return summaries
+
+
+def send_summaries(producer, summaries, topic=SUMMARY_TOPIC):
+    """
+    Sends (data_type, summary) pairs to the summary topic without waiting;
+    they are delivered by the next flush of the producer.
+    """
+    for data_type, summary in summaries:
+        key = summary["sensor_id"] if KEYED_OUTPUT else None
+        producer.send(topic, summary, key=key, headers=record_headers(data_type))
+    if summaries:
+        logger.debug(f"Sent {len(summaries)} summaries to {topic}")
@@ -0,0 +1,25 @@
+"""
+Bridge the Celery task messages of riderLogMQReceiver from RabbitMQ to Kafka.
+
+    python run_bridge.py            # take the messages over from the Celery workers
+    python run_bridge.py --mirror   # consume copies, the Celery workers keep running
+"""
+import argparse
+import logging
+from config.settings import BRIDGE_MIRROR
+from kafka_consumer.bridge import run_bridge
+
+def main():
+    parser = argparse.ArgumentParser(description="Republish Celery task payloads from RabbitMQ to Kafka.")
+    parser.add_argument("--mirror", action="store_true", default=BRIDGE_MIRROR,
+                        help="consume a copy of every message from BRIDGE_MIRROR_QUEUE")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    run_bridge(mirror=args.mirror)
+
+if __name__ == "__main__":
+    main()
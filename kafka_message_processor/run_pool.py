@@ -0,0 +1,7 @@
+"""
+Run a pool of Kafka consumer processes.
+"""
+from kafka_consumer.pool import run_pool
+
+if __name__ == "__main__":
+    run_pool()
@@ -0,0 +1,7 @@
+"""
+Run the Kafka to MongoDB sink.
+"""
+from kafka_consumer.sink import run_sink
+
+if __name__ == "__main__":
+    run_sink()
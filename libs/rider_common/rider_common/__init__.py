@@ -0,0 +1,3 @@
+"""
+Code shared by kafka_message_processor and riderLogMQReceiver
+"""
@@ -0,0 +1,68 @@
+"""
+Reading the raw payload archive written by riderLogMQReceiver (archive.ArchiveWriter)
+
+Segments are gzip files (*.jsonl.gz) of newline-delimited JSON records
+{"ts", "sensor_id", "payload", ["error"]}. A closed segment has an index
+(<segment>.idx.json) with its record count, time range and sensor IDs.
+"""
+import glob
+import gzip
+import json
+import os
+import zlib
+
+
+def title_key(payload):
+    """sensor_id (BLE/LTE) or phone_num (Nonesub): the first part of TITLE, if any."""
+    title = payload.get("TITLE") if isinstance(payload, dict) else None
+    return title.split("_", 1)[0] if isinstance(title, str) else None
+
+
+def read_segment(path):
+    """Yields the records of a segment. A truncated last member (crash while writing) ends the read."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                yield json.loads(line)
+    except (EOFError, zlib.error, gzip.BadGzipFile):
+        return
+
+
+def segment_matches(path, sensors=None, start=None, end=None):
+    """
+    Uses the index of a segment to tell whether it may hold records of any of
+    sensors within start..end (epoch milliseconds). A segment without an index
+    (still open or not closed cleanly) always matches.
+    """
+    index_path = path + ".idx.json"
+    if not os.path.exists(index_path):
+        return True
+    with open(index_path) as file:
+        index = json.load(file)
+    if sensors and not set(sensors).intersection(index["sensors"]):
+        return False
+    if start is not None and index["max_ts"] is not None and index["max_ts"] < start:
+        return False
+    if end is not None and index["min_ts"] is not None and index["min_ts"] > end:
+        return False
+    return True
+
+
+def find_segments(directory, sensor_id=None, start=None, end=None):
+    """Returns the segments in directory that may hold matching records, oldest first."""
+    sensors = None if sensor_id is None else (sensor_id,)
+    return [path for path in sorted(glob.glob(os.path.join(directory, "*.jsonl.gz")))
+            if segment_matches(path, sensors, start, end)]
+
+
+def read_archive(directory, sensor_id=None, start=None, end=None):
+    """Yields archived records of directory filtered by sensor and time range."""
+    for path in find_segments(directory, sensor_id, start, end):
+        for record in read_segment(path):
+            if sensor_id is not None and record.get("sensor_id") != sensor_id:
+                continue
+            if start is not None and record["ts"] < start:
+                continue
+            if end is not None and record["ts"] > end:
+                continue
+            yield record
@@ -0,0 +1,165 @@
+"""
+Duplicate sample suppression, keyed by (sensor, sample time)
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class SensorTimes:
+    """Sample times seen for one sensor, oldest first, within the window behind the newest one."""
+    __slots__ = ("seen", "order", "newest", "last_seen")
+
+    def __init__(self):
+        self.seen = set()
+        self.order = deque()
+        self.newest = None
+        self.last_seen = time.monotonic()
+
+    def discard(self, times):
+        """Removes times from seen and order alike. Returns how many were held."""
+        removed = self.seen.intersection(times)
+        if removed:
+            self.seen -= removed
+            self.order = deque(sample_time for sample_time in self.order if sample_time not in removed)
+        return len(removed)
+
+
+class DedupCache:
+    """
+    Drops samples whose (sensor, time) was already seen, e.g. payloads resent over a flaky LTE link.
+
+    Per sensor, the times of the last window_ms behind its newest sample are kept;
+    samples older than that can no longer be checked and pass through. Sensors
+    idle for idle_s seconds are dropped and at most max_sensors are kept (least
+    recently seen first out), which bounds memory to about max_sensors x samples
+    per window. Hit (duplicate) and miss counts are exported to registry as
+    dedup_hits_total / dedup_misses_total, and the number of times held as
+    dedup_cached_samples.
+
+    The cache lives in the memory of one process: only resends handled by the
+    same process are caught.
+
+    A sample counts as seen as soon as check() returns. Times that end up not
+    stored can be taken back with discard(), or, when check() was given the
+    (partition, offset) of their record, with forget() until that record is
+    acknowledged().
+    """
+
+    def __init__(self, window_ms, idle_s, max_sensors, registry):
+        self.window_ms = window_ms
+        self.idle_s = idle_s
+        self.max_sensors = max_sensors
+        self.sensors = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._journal = {}
+        self._lock = threading.Lock()
+        self._hits = registry.counter('dedup_hits_total', 'Duplicate samples dropped')
+        self._misses = registry.counter('dedup_misses_total', 'Samples passed as new')
+        self._size = registry.gauge('dedup_cached_samples', 'Sample times held by the dedup cache')
+
+    def check(self, sensor, times, source=None):
+        """
+        Records times for sensor; returns a list of flags, True for samples not seen before.
+        source is the (partition, offset) of the record, to journal the times it added.
+        """
+        with self._lock:
+            state = self.sensors.get(sensor)
+            if state is None:
+                state = self.sensors[sensor] = SensorTimes()
+                if len(self.sensors) > self.max_sensors:
+                    self.size -= len(self.sensors.popitem(last=False)[1].seen)
+            else:
+                self.sensors.move_to_end(sensor)
+            state.last_seen = time.monotonic()
+
+            seen, order = state.seen, state.order
+            held = len(seen)
+            newest = max(times) if state.newest is None else max(state.newest, max(times))
+            cutoff = newest - self.window_ms
+            new = []
+            added = []
+            for sample_time in times:
+                if sample_time in seen:
+                    new.append(False)
+                    continue
+                new.append(True)
+                if sample_time >= cutoff:
+                    seen.add(sample_time)
+                    order.append(sample_time)
+                    added.append(sample_time)
+            state.newest = newest
+            if source is not None and added:
+                partition, offset = source
+                self._journal.setdefault(partition, OrderedDict())[offset] = (sensor, added)
+            while order and order[0] < cutoff:
+                seen.discard(order.popleft())
+            self.size += len(seen) - held
+            hits = new.count(False)
+            self.hits += hits
+            self.misses += len(new) - hits
+        if hits:
+            self._hits.inc(hits)
+        self._misses.inc(len(new) - hits)
+        return new
+
+    def discard(self, sensor, times):
+        """Takes back times of sensor that were not stored after all. Returns how many were held."""
+        with self._lock:
+            state = self.sensors.get(sensor)
+            if state is None:
+                return 0
+            discarded = state.discard(times)
+            self.size -= discarded
+        return discarded
+
+    def acknowledged(self, partition, offset):
+        """Drops the journal of the partition's records before offset, their output is delivered."""
+        with self._lock:
+            records = self._journal.get(partition)
+            if records is None:
+                return
+            while records and next(iter(records)) < offset:
+                records.popitem(last=False)
+            if not records:
+                del self._journal[partition]
+
+    def forget(self, partition, offset=0):
+        """
+        Takes back the times added by the partition's records from offset on, which
+        will be consumed again. Returns how many times were forgotten.
+        """
+        taken = {}
+        with self._lock:
+            records = self._journal.get(partition)
+            if records is None:
+                return 0
+            while records and next(reversed(records)) >= offset:
+                sensor, added = records.popitem(last=True)[1]
+                taken.setdefault(sensor, []).extend(added)
+            if not records:
+                del self._journal[partition]
+            forgotten = 0
+            for sensor, times in taken.items():
+                state = self.sensors.get(sensor)
+                if state is not None:
+                    forgotten += state.discard(times)
+            self.size -= forgotten
+        return forgotten
+
+    def evict(self):
+        """Drops sensors not seen for idle_s seconds. Returns how many were dropped."""
+        deadline = time.monotonic() - self.idle_s
+        evicted = 0
+        with self._lock:
+            while self.sensors:
+                sensor, state = next(iter(self.sensors.items()))
+                if state.last_seen > deadline:
+                    break
+                del self.sensors[sensor]
+                self.size -= len(state.seen)
+                evicted += 1
+            self._size.set(self.size)
+        return evicted
@@ -1,82 +1,160 @@
 import pandas as pd
 import numpy as np
+from collections import namedtuple
 from datetime import datetime
 import os
 
-def line_logging(*messages):
+# 넘어짐 판단 기준치
+ACCEL_THRESHOLD = 16384
+GYRO_THRESHOLD = 3000
+# 넘어짐 데이터 사이 간격이 이보다 크면 별개의 사고로 판단 (ms)
+ACCIDENT_GAP_MS = 10000
+
+Accident = namedtuple("Accident", [
+    "date",
+    "sensor_id",
+    "accident_time",
+    "fallen_direction",
+    "impact_scalar_xyz",
+    "impact_scalar_xy",
+    "before_accident_max_speed",
+    "before_accident_mean_speed",
+    "impact_degree",
+])
+
+
+def _write_log(entries):
+    """Writes several log lines (each a list of messages) with one open of the log file."""
     today = datetime.now()
     log_time = today.strftime('[%Y/%m/%d %H:%M:%S]')
-    log = [str(message) for message in messages]
     pid = os.getpid()
-    log_line = f'{log_time}[PID: {pid}]:[' + ', '.join(log) + ']'
+    lines = [f'{log_time}[PID: {pid}]:[' + ', '.join(str(message) for message in messages) + ']\n'
+             for messages in entries]
     log_file_name = f"log_{today.strftime('%Y%m%d')}.txt"
     with open(log_file_name, 'a') as log_file:
-        log_file.write(log_line + '\n')
+        log_file.writelines(lines)
+
+
+def line_logging(*messages):
+    _write_log([messages])
+
+
+def _accident_log(accident, xyz_index, xy_index):
+    message = f" {accident.date} {accident.sensor_id} 사고 발생"
+    return [
+        [f'Sensor_ID : {accident.sensor_id}'],
+        [f"accident time : {accident.accident_time}"],
+        [f"falled direction : {accident.fallen_direction}" if accident.fallen_direction != "None" else "not fall"],
+        [f"impact scalar xyz : {accident.impact_scalar_xyz:,}"],
+        [f"impact scalar xz : {accident.impact_scalar_xy:,}"],
+        [f"Before Accident Max Speed : {round(accident.before_accident_max_speed, 2)} km/h"],
+        [f"Before Accident Mean Speed : {round(accident.before_accident_mean_speed, 2)} km/h"],
+        [f"impact_scalar_xyz_max_index : {xyz_index}"],
+        [f"impact_scalar_xy_index : {xy_index}"],
+        [f"Accident Impact Degree : {accident.impact_degree}"],
+        [message],
+        [[tuple(accident)]],
+    ]
 
 
-def accident_detect(data: pd.DataFrame):
-    data['DATE'] = data['time'].apply(lambda x : datetime.fromtimestamp(x / 1000).strftime('%Y-%m-%d %H:%M:%S'))    
-    sub_df = data[["DATE", "sensor_id", "VELOCITY", "ACCEL_X", "ACCEL_Y", "ACCEL_Z", "GYRO_X", "GYRO_Y", "GYRO_Z"]].copy()
-    
-    fallen_df = sub_df.loc[(abs(sub_df["ACCEL_X"]) > 16384) & (abs(sub_df["GYRO_Y"]) > 3000) & (sub_df["ACCEL_Z"] < 16384)]
+def accident_detect(data: pd.DataFrame, gap_ms=ACCIDENT_GAP_MS):
+    """
+    Detects every accident (fall) in data, which may hold one or more sensors.
 
-    # (TODO) 차분한 센서의 데이터를 확인하여, 표준편차 이상의 변동을 가지는 데이터를 확인
-    # 1. 해당 데이터의 GYRO, ACCEL 의 값이 기준치 이상인 경우 사고가 발생한 경우라고 판단할 수 있음
-    # 2. 해당 사건의 인덱스를 추출할 수 있고 각 인덱스의 범위의 분석을 통해 실제 사고의 발생 부분을 추려 낼 수 있는 방법이 될 수 있음
+    A row is a fallen row when |ACCEL_X| and |GYRO_Y| exceed the thresholds and
+    ACCEL_Z is below the gravity threshold. Fallen rows of the same sensor less
+    than gap_ms apart form one accident. The rows of a sensor are split right
+    after the last fallen row of each accident (the rows after the last accident
+    go to that accident), and the impact / speed figures of an accident are taken
+    over its part. With a single accident the part is the sensor's whole data,
+    which gives the same figures as the original single-accident detection.
+
+    Returns a list of Accident records, by sensor (order of first appearance) and time.
+    """
+    if data.empty:
+        line_logging(f"*------- None Accident Sensor -------*")
+        return []
+
+    # 센서별로 행을 모으되 센서 안에서는 원래 순서를 유지
+    codes, sensors = pd.factorize(data["sensor_id"])
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    labels = data.index.to_numpy()[order]
+    time = data["time"].to_numpy()[order]
+    velocity = data["VELOCITY"].to_numpy()[order]
+    accel_x = data["ACCEL_X"].to_numpy()[order]
+    accel_y = data["ACCEL_Y"].to_numpy()[order]
+    accel_z = data["ACCEL_Z"].to_numpy()[order]
+    gyro_y = data["GYRO_Y"].to_numpy()[order]
 
     # 넘어짐 여부 판단(사고 데이터의특징으로 나타는 경우임)
-    # 1 : Left, 2 : Right, 0 : Not Fallen
-
-    if fallen_df.shape[0] > 0:
-        line_logging(f'Sensor_ID : {sub_df["sensor_id"].unique()}')
-
-        # 사고 시점
-        accident_index = fallen_df.index[0]
-        accident_time = sub_df.iloc[accident_index]["DATE"]
-
-        line_logging(f"accident time : {accident_time}")
-
-        # 넘어진 방향 판단
-        if (fallen_df["GYRO_Y"].min() < -3000) & (fallen_df["ACCEL_X"].max() > 16384):
-            fallen_direction = "LEFT"
-            line_logging(f"falled direction : {fallen_direction}")
-        elif (fallen_df["GYRO_Y"].max() > 3000) & (fallen_df["ACCEL_X"].min() < -16384):
-            fallen_direction = "RIGHT"
-            line_logging(f"falled direction : {fallen_direction}")
-        else:
-            fallen_direction = "None"
-            line_logging(f"not fall")
-
-        # 충격량
-        impact_scalar_xyz = (sub_df.iloc[:].apply(lambda row: round(np.sqrt(row["ACCEL_X"] ** 2 + row["ACCEL_Y"] ** 2 + row["ACCEL_Z"] ** 2 ), 2, ), axis=1, ).max())
-        impact_scalar_xy = (sub_df.iloc[:].apply(lambda row: round(np.sqrt(row["ACCEL_X"] ** 2 + row["ACCEL_Y"] ** 2), 2 ), axis=1,  ).max())
-
-        line_logging(f"impact scalar xyz : {impact_scalar_xyz:,}")
-        line_logging(f"impact scalar xz : {impact_scalar_xy:,}")
-
-        # 사고 직전 속도
-        before_accident_max_speed = sub_df.iloc[:]["VELOCITY"].max()
-        before_accident_mean_speed = sub_df.iloc[:]["VELOCITY"].mean()
-        line_logging( f"Before Accident Max Speed : {round(before_accident_max_speed,2)} km/h" )
-        line_logging( f"Before Accident Mean Speed : {round(before_accident_mean_speed,2)} km/h" )
-
-        impact_scalar_xyz_index = ( sub_df.iloc[:].apply( lambda row: round( np.sqrt( row["ACCEL_X"] ** 2 + row["ACCEL_Y"] ** 2 + row["ACCEL_Z"] ** 2 ),  2, ), axis=1, ).idxmax())
-        impact_scalar_xy_index = ( sub_df.iloc[:].apply( lambda row: round( np.sqrt(row["ACCEL_X"] ** 2 + row["ACCEL_Y"] ** 2), 2 ), axis=1, ).idxmax() )
-        line_logging(f"impact_scalar_xyz_max_index : {impact_scalar_xyz_index}")
-        line_logging(f"impact_scalar_xy_index : {impact_scalar_xy_index}")
-
-        # 충격 방향
-        impact_degree = round(np.degrees( np.arctan2( sub_df.iloc[impact_scalar_xyz_index]["ACCEL_Y"], sub_df.iloc[impact_scalar_xyz_index]["ACCEL_X"], ) ), 2, )
-        line_logging(f"Accident Impact Degree : {impact_degree}")
-        
-        # Slack Alram
-        date = data["DATE"].dt.strftime("%Y-%m-%d").unique()[0].replace("-", "")
-        sensor_id = data["ID"].unique()[0]
-        message = f" {date} {sensor_id} 사고 발생"
-        # slack_alram(message)
-        line_logging(message)
-        accident_info = [ tuple( [date, sensor_id, accident_time.strftime("%Y-%m-%d %H:%M:%S"), fallen_direction, impact_scalar_xyz, impact_scalar_xy, before_accident_max_speed, before_accident_mean_speed, impact_degree, ])]
-        line_logging(accident_info)
-
-    else:
-        line_logging(f"*------- None Accident Sensor -------*")
\ No newline at end of file
+    fallen = (np.abs(accel_x) > ACCEL_THRESHOLD) & (np.abs(gyro_y) > GYRO_THRESHOLD) & (accel_z < ACCEL_THRESHOLD)
+    fallen_pos = np.flatnonzero(fallen)
+    if len(fallen_pos) == 0:
+        line_logging(f"*------- None Accident Sensor -------*")
+        return []
+
+    # 센서가 바뀌거나 넘어짐 데이터 간격이 gap_ms 보다 크면 새로운 사고
+    new_event = np.ones(len(fallen_pos), dtype=bool)
+    new_event[1:] = (codes[fallen_pos[1:]] != codes[fallen_pos[:-1]]) | (np.diff(time[fallen_pos]) > gap_ms)
+    event_first = np.flatnonzero(new_event)
+    starts = fallen_pos[event_first]
+    ends = fallen_pos[np.append(event_first[1:] - 1, len(fallen_pos) - 1)]
+    event_sensor = codes[starts]
+    n_events = len(starts)
+
+    # 각 행을 그 이후 처음 끝나는 같은 센서의 사고에 배정, 마지막 사고 이후의 행은 마지막 사고에 배정
+    last_event = np.full(len(sensors), -1)
+    last_event[event_sensor] = np.arange(n_events)
+    segment = np.searchsorted(ends, np.arange(len(codes)), side="left")
+    outside = (segment >= n_events) | (event_sensor[np.minimum(segment, n_events - 1)] != codes)
+    segment[outside] = last_event[codes[outside]]
+    rows = segment >= 0
+
+    # 충격량 (행별 반올림 후 최대값: 기존 계산과 동일)
+    impact = pd.DataFrame({
+        "segment": segment[rows],
+        "xyz": np.round(np.sqrt(accel_x ** 2 + accel_y ** 2 + accel_z ** 2), 2)[rows],
+        "xy": np.round(np.sqrt(accel_x ** 2 + accel_y ** 2), 2)[rows],
+        "VELOCITY": velocity[rows],
+    }, index=np.flatnonzero(rows))
+    grouped = impact.groupby("segment", sort=True)
+    xyz_max = grouped["xyz"].max().to_numpy()
+    xy_max = grouped["xy"].max().to_numpy()
+    xyz_pos = grouped["xyz"].idxmax().to_numpy()
+    xy_pos = grouped["xy"].idxmax().to_numpy()
+    max_speed = grouped["VELOCITY"].max().to_numpy()
+    mean_speed = grouped["VELOCITY"].mean().to_numpy()
+
+    # 넘어진 방향 판단 (사고별 넘어짐 데이터의 최소/최대)
+    gyro_min = np.minimum.reduceat(gyro_y[fallen_pos], event_first)
+    gyro_max = np.maximum.reduceat(gyro_y[fallen_pos], event_first)
+    accel_min = np.minimum.reduceat(accel_x[fallen_pos], event_first)
+    accel_max = np.maximum.reduceat(accel_x[fallen_pos], event_first)
+    left = (gyro_min < -GYRO_THRESHOLD) & (accel_max > ACCEL_THRESHOLD)
+    right = (gyro_max > GYRO_THRESHOLD) & (accel_min < -ACCEL_THRESHOLD)
+    direction = np.where(left, "LEFT", np.where(right, "RIGHT", "None"))
+
+    # 충격 방향
+    impact_degree = np.round(np.degrees(np.arctan2(accel_y[xyz_pos], accel_x[xyz_pos])), 2)
+
+    accidents = []
+    log_entries = []
+    for event in range(n_events):
+        accident_time = datetime.fromtimestamp(time[starts[event]] / 1000)
+        accident = Accident(
+            date=accident_time.strftime("%Y%m%d"),
+            sensor_id=sensors[event_sensor[event]],
+            accident_time=accident_time.strftime("%Y-%m-%d %H:%M:%S"),
+            fallen_direction=str(direction[event]),
+            impact_scalar_xyz=xyz_max[event].item(),
+            impact_scalar_xy=xy_max[event].item(),
+            before_accident_max_speed=max_speed[event].item(),
+            before_accident_mean_speed=mean_speed[event].item(),
+            impact_degree=impact_degree[event].item(),
+        )
+        accidents.append(accident)
+        log_entries.extend(_accident_log(accident, labels[xyz_pos[event]], labels[xy_pos[event]]))
+    # slack_alram(message)
+    _write_log(log_entries)
+    return accidents
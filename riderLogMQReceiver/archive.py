@@ -0,0 +1,170 @@
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from celery.signals import worker_process_shutdown
+# 읽기(title_key / read_segment / find_segments / read_archive)는 kafka_message_processor의 재처리와 공유
+from rider_common.archive import title_key, read_segment, find_segments, read_archive
+
+from .config import Config
+
+
+class ArchiveWriter:
+    """
+    Buffered, compressed raw payload archive.
+
+    Records are newline-delimited JSON ({"ts", "sensor_id", "payload", ["error"]})
+    appended to gzip segments. Every flush writes one gzip member, so a segment
+    stays readable with gzip.open() record by record. Segments rotate on size or
+    age; on rotation an index file (<segment>.idx.json) with the record count,
+    time range and sensor IDs is written next to it. Segments are read with
+    rider_common.archive.
+    """
+
+    def __init__(self, directory, prefix):
+        self.directory = directory
+        self.prefix = prefix
+        # _lock 은 버퍼만 보호하고, 압축/파일 쓰기/세그먼트 교체는 _io_lock 에서 순서대로 처리
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._lines = []
+        self._entries = []
+        self._size = 0
+        self._oldest = None
+        self._segment = None
+        self._sequence = 0
+        self._reset_index()
+
+    def _reset_index(self):
+        self._segment_bytes = 0
+        self._segment_opened = None
+        self._records = 0
+        self._min_ts = None
+        self._max_ts = None
+        self._sensors = set()
+
+    def write(self, payload, sensor_id=None, error=None):
+        record = {"ts": int(time.time() * 1000), "sensor_id": sensor_id, "payload": payload}
+        if error is not None:
+            record["error"] = error
+        line = (json.dumps(record) + "\n").encode('utf-8')
+        with self._lock:
+            self._lines.append(line)
+            self._entries.append((record["ts"], sensor_id))
+            self._size += len(line)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = self._size >= Config.ARCHIVE_FLUSH_BYTES
+        if full:
+            self.flush()
+
+    def flush(self, rotate=False):
+        """Compresses the buffered records into the current segment."""
+        with self._io_lock:
+            with self._lock:
+                lines, self._lines = self._lines, []
+                entries, self._entries = self._entries, []
+                self._size = 0
+                self._oldest = None
+            if lines:
+                if self._segment is None:
+                    stamp = datetime.today().strftime('%Y%m%d%H%M%S')
+                    self._sequence += 1
+                    name = f"{self.prefix}_{stamp}_{os.getpid()}_{self._sequence}.jsonl.gz"
+                    self._segment = os.path.join(self.directory, name)
+                    self._segment_opened = time.monotonic()
+                member = gzip.compress(b"".join(lines), compresslevel=Config.ARCHIVE_COMPRESS_LEVEL)
+                with open(self._segment, "ab") as file:
+                    file.write(member)
+                self._segment_bytes += len(member)
+                self._add_to_index(entries)
+            if self._segment is not None and (
+                    rotate
+                    or self._segment_bytes >= Config.ARCHIVE_SEGMENT_BYTES
+                    or time.monotonic() - self._segment_opened >= Config.ARCHIVE_SEGMENT_SECONDS):
+                self._write_index()
+                self._segment = None
+                self._reset_index()
+
+    def _add_to_index(self, entries):
+        times = [ts for ts, _ in entries]
+        self._records += len(entries)
+        self._min_ts = min(times) if self._min_ts is None else min(self._min_ts, min(times))
+        self._max_ts = max(times) if self._max_ts is None else max(self._max_ts, max(times))
+        self._sensors.update(sensor_id for _, sensor_id in entries if sensor_id is not None)
+
+    def _write_index(self):
+        index = {
+            "segment": os.path.basename(self._segment),
+            "records": self._records,
+            "min_ts": self._min_ts,
+            "max_ts": self._max_ts,
+            "sensors": sorted(self._sensors),
+        }
+        with open(self._segment + ".idx.json", "w") as file:
+            json.dump(index, file)
+
+    def due(self):
+        """True when buffered records or the open segment are old enough to flush / rotate."""
+        now = time.monotonic()
+        oldest = self._oldest
+        if oldest is not None and now - oldest >= Config.ARCHIVE_FLUSH_SECONDS:
+            return True
+        opened = self._segment_opened
+        return opened is not None and now - opened >= Config.ARCHIVE_SEGMENT_SECONDS
+
+
+_writers = {}
+_pid = None
+_flusher = None
+_lock = threading.Lock()
+
+
+def get_archive(log_dir_key):
+    """Returns the per-process archive writer for a Config.LOG_DIRS entry."""
+    global _pid, _flusher
+    if _pid != os.getpid():
+        # fork 이후에는 부모 프로세스의 버퍼를 버리고 새로 시작
+        _writers.clear()
+        _pid = os.getpid()
+        _flusher = None
+    writer = _writers.get(log_dir_key)
+    if writer is None:
+        with _lock:
+            writer = _writers.get(log_dir_key)
+            if writer is None:
+                writer = ArchiveWriter(Config.LOG_DIRS[log_dir_key], log_dir_key)
+                _writers[log_dir_key] = writer
+            if _flusher is None:
+                _flusher = threading.Thread(target=_run_flusher, name="archive-flusher", daemon=True)
+                _flusher.start()
+    return writer
+
+
+def _run_flusher():
+    while True:
+        time.sleep(1)
+        for writer in list(_writers.values()):
+            if writer.due():
+                writer.flush()
+
+
+def close_archives():
+    """Flushes every writer and closes its segment (writes the index)."""
+    if _pid != os.getpid():
+        return
+    for writer in list(_writers.values()):
+        writer.flush(rotate=True)
+
+
+@worker_process_shutdown.connect
+def _close_on_shutdown(**kwargs):
+    close_archives()
+
+
+atexit.register(close_archives)
+
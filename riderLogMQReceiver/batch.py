@@ -0,0 +1,69 @@
+import logging
+
+from celery_batches import Batches, SimpleRequest
+from celery_batches.trace import apply_batches_task
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PerMessageAckBatches(Batches):
+    """
+    celery-batches task base that settles every message of a batch on its own.
+
+    The task runs with the requests buffered up to flush_every messages or
+    flush_interval seconds and returns {"rejected": [ids], "requeued": [ids]}.
+    Once it returns, rejected messages are rejected without requeue (to the
+    queue's dead-letter exchange, if configured), requeued ones are republished
+    with the task retry backoff (see requeue()) and all others are acknowledged.
+    A batch that raises has all of its messages requeued that way.
+    """
+    abstract = True
+    acks_late = True
+
+    def flush(self, requests):
+        serializable_requests = ([SimpleRequest.from_request(request) for request in requests],)
+
+        def on_return(result):
+            if result is None:
+                # 배치 태스크가 예외로 끝난 경우 (apply_batches_task가 None 반환)
+                rejected, requeued = set(), {request.id for request in requests}
+            else:
+                rejected, requeued = set(result["rejected"]), set(result["requeued"])
+            for request in requests:
+                if request.id in requeued:
+                    self.requeue(request)
+                elif request.id in rejected:
+                    request.reject(requeue=False)
+                else:
+                    request.acknowledge()
+
+        return self._pool.apply_async(
+            apply_batches_task,
+            (self, serializable_requests, 0, None),
+            callback=on_return,
+        )
+
+    def requeue(self, request):
+        """
+        Republishes a request to run again after TASK_RETRY_BACKOFF seconds, doubled
+        per retry (at most TASK_RETRY_BACKOFF_MAX), and acknowledges the original.
+        After TASK_MAX_RETRIES retries the request is rejected instead.
+        """
+        # 바로 requeue하면 같은 오류로 즉시 다시 실패하므로 (예: MongoDB 장애 중) 지연 후 재전송
+        retries = (request.request_dict or {}).get("retries") or 0
+        if retries >= Config.TASK_MAX_RETRIES:
+            logger.warning(f"Rejecting {self.name}[{request.id}] after {retries} retries")
+            request.reject(requeue=False)
+            return
+        countdown = min(Config.TASK_RETRY_BACKOFF * 2 ** retries, Config.TASK_RETRY_BACKOFF_MAX)
+        try:
+            self.apply_async(request.args, request.kwargs, task_id=request.id,
+                             countdown=countdown, retries=retries + 1)
+        except Exception as e:
+            logger.error(f"Failed to republish {self.name}[{request.id}]: {e}")
+            request.reject(requeue=True)
+            return
+        request.acknowledge()
+
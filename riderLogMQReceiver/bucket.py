@@ -0,0 +1,150 @@
+import threading
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .config import Config
+
+# 버킷 문서 식별 필드 (샘플 배열에는 포함하지 않음)
+KEY_FIELDS = ("sensor_id", "phone_num")
+DUPLICATE_KEY = 11000
+# 중복 키 오류(동시 생성, 이미 저장된 샘플)로 남은 샘플을 다시 쓰는 최대 횟수
+BUCKET_WRITE_ATTEMPTS = 3
+
+
+def bucket_collection_name(date):
+    return f"{date}{Config.BUCKET_COLLECTION_SUFFIX}"
+
+
+def _group_samples(documents, bucket_seconds=None):
+    """Groups sample documents by (sensor_id, phone_num, bucket start ms)."""
+    bucket_ms = (bucket_seconds or Config.BUCKET_SECONDS) * 1000
+    groups = {}
+    for document in documents:
+        key = (document.get("sensor_id"), document["phone_num"], document["time"] // bucket_ms * bucket_ms)
+        groups.setdefault(key, []).append(document)
+    return groups
+
+
+def _bucket_update(key, samples):
+    sensor_id, phone_num, bucket = key
+    fields = [field for field in samples[0] if field not in KEY_FIELDS and field != "_id"]
+    times = [sample["time"] for sample in samples]
+    return UpdateOne(
+        # 이미 들어간 샘플 시간이 있으면 매칭되지 않으므로 재시도된 $push가 샘플을 두 번 넣지 않음
+        {"sensor_id": sensor_id, "phone_num": phone_num, "bucket": bucket, "samples.time": {"$nin": times}},
+        {
+            "$push": {f"samples.{field}": {"$each": [sample[field] for sample in samples]} for field in fields},
+            "$min": {"min_time": min(times)},
+            "$max": {"max_time": max(times)},
+            "$inc": {"count": len(samples)},
+        },
+        upsert=True,
+    )
+
+
+def bucket_updates(documents, bucket_seconds=None):
+    """
+    Packs sample documents into per-sensor time buckets.
+
+    Returns one upsert per (sensor_id, phone_num, bucket) which appends the
+    samples as parallel arrays and maintains the bucket's min/max time and count.
+    An update only matches a bucket holding none of its sample times; against a
+    bucket that does, the upsert fails with a duplicate key error (see
+    write_buckets()).
+
+    Bucket document:
+        {"sensor_id", "phone_num", "bucket": <bucket start ms>,
+         "min_time", "max_time", "count",
+         "samples": {"time": [...], "ACCEL_X": [...], ...}}
+    """
+    return [_bucket_update(key, samples) for key, samples in _group_samples(documents, bucket_seconds).items()]
+
+
+_indexed = set()
+_indexed_lock = threading.Lock()
+
+
+def _ensure_indexes(collection):
+    key = (collection.database.name, collection.name)
+    with _indexed_lock:
+        if key in _indexed:
+            return
+        collection.create_index([("sensor_id", ASCENDING), ("phone_num", ASCENDING), ("bucket", ASCENDING)], unique=True)
+        collection.create_index([("sensor_id", ASCENDING), ("min_time", ASCENDING), ("max_time", ASCENDING)])
+        _indexed.add(key)
+
+
+def write_buckets(collection, documents, bucket_seconds=None):
+    """
+    Upserts documents into the bucket collection with one unordered bulk_write.
+
+    Writes are idempotent: samples whose time is already in their bucket are
+    skipped. An upsert that hits the unique index (another worker created the
+    bucket first, or the bucket already holds some of the samples) is retried
+    with only the samples not stored yet.
+    """
+    _ensure_indexes(collection)
+    groups = list(_group_samples(documents, bucket_seconds).items())
+    for attempt in range(BUCKET_WRITE_ATTEMPTS):
+        if attempt:
+            groups = _missing_samples(collection, groups)
+        if not groups:
+            return
+        try:
+            collection.bulk_write([_bucket_update(key, samples) for key, samples in groups], ordered=False)
+            return
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY for error in write_errors) or attempt == BUCKET_WRITE_ATTEMPTS - 1:
+                raise
+            groups = [groups[error["index"]] for error in write_errors]
+
+
+def _missing_samples(collection, groups):
+    """Drops from each (key, samples) group the samples whose time its bucket already holds."""
+    missing = []
+    for key, samples in groups:
+        sensor_id, phone_num, bucket = key
+        stored = collection.find_one({"sensor_id": sensor_id, "phone_num": phone_num, "bucket": bucket},
+                                     {"samples.time": 1})
+        times = set(stored["samples"]["time"]) if stored else set()
+        samples = [sample for sample in samples if sample["time"] not in times]
+        if samples:
+            missing.append((key, samples))
+    return missing
+
+
+def expand_bucket(bucket):
+    """Expands one bucket document back into sample documents of the row schema."""
+    samples = bucket["samples"]
+    fields = list(samples)
+    head = {field: bucket[field] for field in KEY_FIELDS if bucket.get(field) is not None}
+    rows = []
+    for values in zip(*(samples[field] for field in fields)):
+        row = dict(head)
+        row.update(zip(fields, values))
+        rows.append(row)
+    return rows
+
+
+def find_samples(collection, sensor_id=None, start=None, end=None):
+    """
+    Reads samples from a bucket collection in the row schema, ordered by time.
+    start/end (ms, inclusive) filter on sample time.
+    """
+    query = {}
+    if sensor_id is not None:
+        query["sensor_id"] = sensor_id
+    if start is not None:
+        query["max_time"] = {"$gte": start}
+    if end is not None:
+        query["min_time"] = {"$lte": end}
+    rows = []
+    for bucket in collection.find(query, {"_id": 0}).sort([("sensor_id", ASCENDING), ("bucket", ASCENDING)]):
+        rows.extend(
+            row for row in expand_bucket(bucket)
+            if (start is None or row["time"] >= start) and (end is None or row["time"] <= end)
+        )
+    rows.sort(key=lambda row: (row.get("sensor_id") or "", row["time"]))
+    return rows
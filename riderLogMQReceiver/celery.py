@@ -1,10 +1,18 @@
 from celery import Celery
+from celery.signals import worker_process_init
 
+import logging
 import pymongo
 import sys
 import os
-from kafka import KafkaProducer
-import json
+import threading
+from datetime import datetime
+
+from .metrics import mongo_event_listeners
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
 print("Python Version:", sys.version)
 
 AMQPS_URI = os.environ.get('AMQPS_URI')
@@ -30,15 +38,90 @@ app.conf.update(
 
 app.conf.timezone = 'Asia/Seoul'
 
+if Config.BATCH_TASKS:
+    # 배치 태스크는 ack 전까지 메시지를 들고 있으므로, 한 배치를 채울 만큼 prefetch
+    app.conf.worker_prefetch_multiplier = max(app.conf.worker_prefetch_multiplier, Config.BATCH_MAX_MESSAGES)
+
 # aws_DocumentDB
-##Specify the database to be used
-client = pymongo.MongoClient(host=DOCDB_URI,tls=True,tlsCAFile=TLSCA_path) 
+# MongoClient는 fork-safe 하지 않으므로 모듈 import 시점이 아니라 각 워커 프로세스(fork 이후)에서 처음 사용할 때 생성
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the MongoClient of the current process, created on first use after fork."""
+    global _client, _client_pid
+    if _client_pid != os.getpid():
+        with _client_lock:
+            if _client_pid != os.getpid():
+                # 부모 프로세스의 클라이언트(소켓)는 닫지 않고 버림 (부모가 계속 사용할 수 있음)
+                _client = pymongo.MongoClient(
+                    host=DOCDB_URI,
+                    tls=True,
+                    tlsCAFile=TLSCA_path,
+                    maxPoolSize=Config.MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=Config.MONGODB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=Config.MONGODB_MAX_IDLE_MS,
+                    event_listeners=mongo_event_listeners(),
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+class Database:
+    """
+    Per-process handle of a MongoDB database (database[collection_name]).
+
+    The client is created lazily in the calling process, and collection handles
+    are cached so daily collections are not looked up again for every message.
+    """
+
+    def __init__(self, name, max_collections=64):
+        self.name = name
+        self.max_collections = max_collections
+        self._pid = None
+        self._collections = {}
+
+    def __getitem__(self, collection_name):
+        if self._pid != os.getpid():
+            self._collections = {}
+            self._pid = os.getpid()
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            if len(self._collections) >= self.max_collections:
+                # 지난 날짜의 컬렉션 핸들이 계속 쌓이지 않도록 비움
+                self._collections = {}
+            collection = get_client()[self.name][collection_name]
+            self._collections[collection_name] = collection
+        return collection
+
+
 # ble
-Doc_BLE = client["BLE"] #BLE 데이터 베이스 선택
+Doc_BLE = Database("BLE") #BLE 데이터 베이스 선택
 # lte
-Doc_LTE = client["LTE"] #LTE 데이터 베이스 선택
+Doc_LTE = Database("LTE") #LTE 데이터 베이스 선택
 # Nonesub
-Doc_Nonesub = client["Nonesub"] #LTE 데이터 베이스 선택
+Doc_Nonesub = Database("Nonesub") #LTE 데이터 베이스 선택
+
+
+def _warm_up():
+    try:
+        get_client().admin.command("ping")
+    except Exception as e:
+        logger.warning(f"MongoDB warm-up failed: {e}", exc_info=True)
+        return
+    today = datetime.today().strftime("%Y%m%d")
+    for database in (Doc_BLE, Doc_LTE, Doc_Nonesub):
+        database[today]
+
+
+@worker_process_init.connect
+def _warm_up_on_init(**kwargs):
+    # 첫 메시지가 연결 수립을 기다리지 않도록 워커 프로세스 시작 시 연결하고 오늘 컬렉션 핸들을 준비
+    # (프로세스 시작을 막지 않도록 백그라운드 스레드에서 실행)
+    if Config.MONGODB_WARMUP:
+        threading.Thread(target=_warm_up, name="mongo-warm-up", daemon=True).start()
 
 
 if __name__ == '__main__':
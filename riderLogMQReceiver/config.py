@@ -4,10 +4,70 @@ class Config:
     # MongoDB Configuration
     MONGODB_URI = os.environ.get('DOCDB_URI')
     MONGODB_TLS_PATH = os.environ.get('TLSCA_path')
+    # 워커 프로세스별 연결 풀 크기 (prefork 자식마다 풀이 따로 생기므로 concurrency x MAX가 서버 연결 수 상한)
+    MONGODB_MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE', 10))
+    MONGODB_MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE', 1))
+    MONGODB_MAX_IDLE_MS = int(os.environ.get('MONGODB_MAX_IDLE_MS', 300000))
+    # 워커 프로세스 시작 시 MongoDB에 미리 연결
+    MONGODB_WARMUP = os.environ.get('MONGODB_WARMUP', 'true').lower() == 'true'
     
     # RabbitMQ Configuration
     RABBITMQ_URI = os.environ.get('AMQPS_URI')
     
+    # Write-behind buffer Configuration (write_buffer.py)
+    WRITE_BUFFER_ENABLED = os.environ.get('WRITE_BUFFER_ENABLED', 'false').lower() == 'true'
+    WRITE_BUFFER_MAX_DOCS = int(os.environ.get('WRITE_BUFFER_MAX_DOCS', 5000))
+    WRITE_BUFFER_MAX_AGE = float(os.environ.get('WRITE_BUFFER_MAX_AGE', 1.0))  # seconds
+
+    # Bucket storage Configuration (bucket.py)
+    # IMU 샘플을 센서별 시간 버킷 문서로 묶어서 저장 ({date}{BUCKET_COLLECTION_SUFFIX} 컬렉션)
+    BUCKET_STORAGE_ENABLED = os.environ.get('BUCKET_STORAGE_ENABLED', 'false').lower() == 'true'
+    BUCKET_SECONDS = int(os.environ.get('BUCKET_SECONDS', 60))
+    BUCKET_COLLECTION_SUFFIX = os.environ.get('BUCKET_COLLECTION_SUFFIX', '_bucket')
+
+    # Raw payload archive Configuration (archive.py)
+    # 메시지마다 로그 파일을 열고 닫는 대신 프로세스별 버퍼에 모아 gzip 세그먼트로 저장
+    ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', 'false').lower() == 'true'
+    ARCHIVE_FLUSH_BYTES = int(os.environ.get('ARCHIVE_FLUSH_BYTES', 1024 * 1024))
+    ARCHIVE_FLUSH_SECONDS = float(os.environ.get('ARCHIVE_FLUSH_SECONDS', 5))
+    ARCHIVE_SEGMENT_BYTES = int(os.environ.get('ARCHIVE_SEGMENT_BYTES', 64 * 1024 * 1024))
+    ARCHIVE_SEGMENT_SECONDS = float(os.environ.get('ARCHIVE_SEGMENT_SECONDS', 3600))
+    ARCHIVE_COMPRESS_LEVEL = int(os.environ.get('ARCHIVE_COMPRESS_LEVEL', 6))
+
+    # Daily sample cache (sample_cache.py)
+    # 사고 분석용으로 일별 컬렉션을 센서별 컬럼 파일로 저장하는 위치
+    SAMPLE_CACHE_DIR = os.environ.get('SAMPLE_CACHE_DIR', '/home/ubuntu/cache')
+    # true이면 세그먼트를 압축 .npz로 저장 (읽을 때 필요한 컬럼만 압축 해제), false이면 메모리 매핑 가능한 .npy
+    SAMPLE_CACHE_COMPRESS = os.environ.get('SAMPLE_CACHE_COMPRESS', 'true').lower() == 'true'
+    # 증분 갱신 시 마지막으로 캐시한 _id보다 이 시간(초)만큼 앞부터 다시 읽음 (워커 간 시계 차이, 늦게 저장된 문서)
+    SAMPLE_CACHE_OVERLAP_S = int(os.environ.get('SAMPLE_CACHE_OVERLAP_S', 600))
+
+    # Duplicate sample suppression (dedup.py)
+    # 같은 (sensor_id, time) 샘플이 재전송되면 저장하지 않음 (워커 프로세스별 캐시)
+    DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'false').lower() == 'true'
+    DEDUP_WINDOW_MS = int(os.environ.get('DEDUP_WINDOW_MS', 10 * 60 * 1000))
+    DEDUP_IDLE_S = float(os.environ.get('DEDUP_IDLE_S', 600))
+    DEDUP_MAX_SENSORS = int(os.environ.get('DEDUP_MAX_SENSORS', 10000))
+
+    # Task retry Configuration (tasks.py)
+    # MongoDB 연결 오류 등 일시적 오류는 TASK_RETRY_BACKOFF초부터 2배씩 늘려 (최대 TASK_RETRY_BACKOFF_MAX초) 재시도
+    TASK_MAX_RETRIES = int(os.environ.get('TASK_MAX_RETRIES', 3))
+    TASK_RETRY_BACKOFF = float(os.environ.get('TASK_RETRY_BACKOFF', 2))  # seconds
+    TASK_RETRY_BACKOFF_MAX = float(os.environ.get('TASK_RETRY_BACKOFF_MAX', 60))  # seconds
+
+    # Batched task Configuration (batch.py, celery-batches 필요)
+    # 지정한 태스크(ltev2, nonesub)는 최대 BATCH_MAX_MESSAGES개 또는 BATCH_MAX_WAIT_MS 동안 모은 메시지를 한 번에 저장하고 메시지별로 ack
+    BATCH_TASKS = [kind.strip().lower() for kind in os.environ.get('BATCH_TASKS', '').split(',') if kind.strip()]
+    BATCH_MAX_MESSAGES = int(os.environ.get('BATCH_MAX_MESSAGES', 100))
+    BATCH_MAX_WAIT_MS = int(os.environ.get('BATCH_MAX_WAIT_MS', 200))
+
+    # Metrics Configuration (metrics.py)
+    # 태스크 처리 시간, MongoDB 명령 지연 시간을 Prometheus 텍스트 포맷으로 http://<host>:<port>/metrics 에 노출
+    # prefork 풀의 자식 프로세스는 METRICS_PORT + 프로세스 index 포트 사용
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 9200))
+    METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
     # Logging Configuration
     LOG_DIRS = {
         'ble': '/home/ubuntu/log/BLE',
@@ -0,0 +1,61 @@
+import os
+import time
+
+from rider_common.dedup import DedupCache as _DedupCache
+
+from .config import Config
+from .metrics import REGISTRY
+
+
+class DedupCache(_DedupCache):
+    """
+    Per-process cache dropping samples whose (sensor_id, time) was already stored
+    (see rider_common.dedup, shared with kafka_message_processor).
+
+    Each prefork child holds its own cache and Celery hands a resent payload to
+    any child, so only about 1/concurrency of the resends are caught here; the
+    rest are stored again. Drop them at read time, or run with a single child
+    where that matters.
+    """
+
+    def __init__(self, window_ms, idle_s, max_sensors, registry=REGISTRY):
+        self._registry = registry
+        self._reset(window_ms, idle_s, max_sensors)
+
+    def _reset(self, window_ms, idle_s, max_sensors):
+        # fork 이후 자식 프로세스에서는 부모의 캐시를 물려받지 않도록 새로 초기화
+        super().__init__(window_ms, idle_s, max_sensors, self._registry)
+        self._pid = os.getpid()
+        self._last_evict = time.monotonic()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset(self.window_ms, self.idle_s, self.max_sensors)
+
+    def filter(self, documents, key="sensor_id"):
+        """Returns documents without the samples whose (documents[key], time) was seen before."""
+        if not documents:
+            return documents
+        self._check_pid()
+        self._evict_idle()
+        new = self.check(documents[0][key], [document["time"] for document in documents])
+        self._size.set(self.size)
+        return [document for document, keep in zip(documents, new) if keep]
+
+    def forget(self, documents, key="sensor_id"):
+        """Forgets the samples of documents that were not stored after all (e.g. before a retry)."""
+        if not documents or self._pid != os.getpid():
+            return
+        self.discard(documents[0][key], [document["time"] for document in documents])
+        self._size.set(self.size)
+
+    def _evict_idle(self):
+        # 오래된 센서는 최대 1초에 한 번만 정리
+        now = time.monotonic()
+        if now - self._last_evict < 1:
+            return
+        self._last_evict = now
+        self.evict()
+
+
+dedup_cache = DedupCache(Config.DEDUP_WINDOW_MS, Config.DEDUP_IDLE_S, Config.DEDUP_MAX_SENSORS)
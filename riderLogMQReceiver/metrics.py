@@ -0,0 +1,76 @@
+import logging
+import os
+import time
+
+from billiard.process import current_process
+from celery.signals import task_prerun, task_postrun
+from pymongo import monitoring
+
+from prometheus_text import Registry, start_metrics_server
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = Registry(buckets=Config.METRICS_BUCKETS)
+
+
+# Task / MongoDB metrics
+TASK_SECONDS = REGISTRY.histogram('celery_task_seconds', 'Task run time', ('task',))
+TASKS = REGISTRY.counter('celery_tasks_total', 'Finished tasks', ('task', 'state'))
+MONGO_SECONDS = REGISTRY.histogram('mongo_command_seconds', 'MongoDB command latency', ('database', 'command'))
+MONGO_FAILURES = REGISTRY.counter('mongo_command_failures_total', 'Failed MongoDB commands', ('database', 'command'))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records the latency of every MongoDB command (insert_many, bulk_write, ...) of the client."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, database=event.database_name, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, database=event.database_name, command=event.command_name)
+        MONGO_FAILURES.inc(database=event.database_name, command=event.command_name)
+
+
+def mongo_event_listeners():
+    """event_listeners for MongoClient; empty when metrics are disabled."""
+    return [MongoCommandMetrics()] if Config.METRICS_ENABLED else []
+
+
+_server_pid = None
+_started = {}
+
+
+def _ensure_server():
+    # prefork 풀의 각 자식 프로세스가 METRICS_PORT + 프로세스 index 포트로 서비스
+    global _server_pid
+    if _server_pid == os.getpid():
+        return
+    _server_pid = os.getpid()
+    index = getattr(current_process(), 'index', None) or 0
+    try:
+        start_metrics_server(Config.METRICS_PORT + index, REGISTRY)
+    except OSError as e:
+        logger.warning(f"Metrics server not started on port {Config.METRICS_PORT + index}: {e}")
+
+
+def _task_prerun(task_id=None, task=None, **kwargs):
+    _ensure_server()
+    _started[task_id] = time.perf_counter()
+
+
+def _task_postrun(task_id=None, task=None, state=None, **kwargs):
+    started = _started.pop(task_id, None)
+    name = task.name.rsplit('.', 1)[-1]
+    if started is not None:
+        TASK_SECONDS.observe(time.perf_counter() - started, task=name)
+    TASKS.inc(task=name, state=state or 'UNKNOWN')
+
+
+if Config.METRICS_ENABLED:
+    task_prerun.connect(_task_prerun, weak=False)
+    task_postrun.connect(_task_postrun, weak=False)
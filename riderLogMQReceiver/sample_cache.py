@@ -0,0 +1,237 @@
+import json
+import os
+import sys
+from datetime import timedelta
+
+import numpy as np
+
+from .config import Config
+
+
+# accident_detect()가 사용하는 컬럼
+ACCIDENT_COLUMNS = ("sensor_id", "time", "VELOCITY", "ACCEL_X", "ACCEL_Y", "ACCEL_Z", "GYRO_Y")
+# 캐시에 저장하는 샘플 컬럼과 저장 dtype (정수 IMU 값은 int32로 저장하여 크기 절반)
+COLUMN_DTYPES = {
+    "time": np.int64,
+    "VELOCITY": np.float64,
+    "ACCEL_X": np.int32,
+    "ACCEL_Y": np.int32,
+    "ACCEL_Z": np.int32,
+    "GYRO_Y": np.int32,
+}
+# 한 세그먼트로 쓰는 최대 문서 수 (갱신 중 메모리 제한)
+SEGMENT_ROWS = 1000000
+# 누락 문서를 _id로 다시 조회할 때 한 번에 조회하는 수
+FETCH_IDS = 10000
+
+META_FILE = "_meta.json"
+
+
+def _day_directory(cache_dir, database, date):
+    return os.path.join(cache_dir, database, date)
+
+
+def _read_meta(directory):
+    path = os.path.join(directory, META_FILE)
+    if not os.path.exists(path):
+        return {"last_id": None, "rows": 0, "segments": 0, "sensors": []}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _write_meta(directory, meta):
+    path = os.path.join(directory, META_FILE)
+    with open(path + ".tmp", "w") as file:
+        json.dump(meta, file)
+    # 세그먼트 파일을 모두 쓴 뒤 메타데이터를 교체하여, 중단된 갱신은 다음 갱신에서 같은 세그먼트로 다시 씀
+    os.replace(path + ".tmp", path)
+
+
+def _column_array(values, dtype):
+    array = np.asarray(values, dtype=np.float64)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        if not (np.all(array == np.floor(array)) and array.min(initial=0) >= info.min and array.max(initial=0) <= info.max):
+            # 정수가 아닌 값이 섞인 컬럼은 그대로 float64로 저장
+            return array
+    return array.astype(dtype)
+
+
+def _write_segment(directory, segment, sensor_ids, columns, compress):
+    """
+    Writes one segment, rows of each sensor in source order: <sensor_id>/<segment>.npz
+    with every column when compress, else <sensor_id>/<segment>_<column>.npy files.
+    """
+    sensors, codes = np.unique(np.array([str(sensor_id) for sensor_id in sensor_ids]), return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    written = []
+    for rows in np.split(order, bounds):
+        sensor_id = str(sensors[codes[rows[0]]])
+        sensor_directory = os.path.join(directory, sensor_id)
+        os.makedirs(sensor_directory, exist_ok=True)
+        if compress:
+            np.savez_compressed(os.path.join(sensor_directory, f"{segment:05d}.npz"),
+                                **{name: values[rows] for name, values in columns.items()})
+        else:
+            for name, values in columns.items():
+                np.save(os.path.join(sensor_directory, f"{segment:05d}_{name}.npy"), values[rows])
+        written.append((int(rows[0]), sensor_id))
+    # 세그먼트 안에서 처음 나온 순서
+    return [sensor_id for _, sensor_id in sorted(written)]
+
+
+def _ids_path(directory, segment):
+    return os.path.join(directory, f"{segment:05d}_ids.npy")
+
+
+def _cached_ids(directory, meta):
+    """The _id (24 hex digits) of every cached document."""
+    parts = [np.load(_ids_path(directory, segment)) for segment in range(meta["segments"])]
+    return np.concatenate(parts) if parts else np.empty(0, dtype="S24")
+
+
+def refresh_daily_cache(collection, cache_dir=None, batch_size=SEGMENT_ROWS, overlap_s=None, compress=None):
+    """
+    Appends the documents of a daily row collection (e.g. Doc_LTE[date]) that are
+    not cached yet to <cache_dir>/<database>/<date>/.
+
+    Only the columns accident_detect() uses are cached, one compressed .npz file
+    per sensor and segment (or, without compress, one memory-mappable .npy file
+    per column). Documents are read in _id order from overlap_s seconds before
+    the newest cached _id, and the ones already cached are skipped by _id, so a
+    document whose ObjectId is older than the newest one (another worker's clock,
+    a replayed write) is still picked up. One inserted even later is found when
+    the collection holds more documents than the cache, at the cost of a scan of
+    the collection's _ids. Returns the number of new rows.
+    """
+    from bson import ObjectId
+
+    cache_dir = cache_dir or Config.SAMPLE_CACHE_DIR
+    overlap_s = Config.SAMPLE_CACHE_OVERLAP_S if overlap_s is None else overlap_s
+    compress = Config.SAMPLE_CACHE_COMPRESS if compress is None else compress
+    directory = _day_directory(cache_dir, collection.database.name, collection.name)
+    os.makedirs(directory, exist_ok=True)
+    meta = _read_meta(directory)
+    cached = _cached_ids(directory, meta)
+
+    query = {}
+    if meta["last_id"]:
+        since = ObjectId(meta["last_id"]).generation_time - timedelta(seconds=overlap_s)
+        query = {"_id": {"$gte": ObjectId.from_datetime(since)}}
+    projection = {name: 1 for name in ACCIDENT_COLUMNS}
+    added = _append_documents(directory, meta, cached, collection.find(query, projection).sort("_id", 1),
+                              batch_size, compress)
+
+    if meta["last_id"] and collection.estimated_document_count() > meta["rows"]:
+        # 겹침 구간보다 늦게 저장된 문서: _id만 전체 조회하여 캐시에 없는 문서를 찾음
+        cached = _cached_ids(directory, meta)
+        ids = np.array([str(document["_id"]) for document in collection.find({}, {"_id": 1})], dtype="S24")
+        missing = [ObjectId(value.decode()) for value in np.sort(ids[~np.isin(ids, cached)]).tolist()]
+        for start in range(0, len(missing), FETCH_IDS):
+            query = {"_id": {"$in": missing[start:start + FETCH_IDS]}}
+            added += _append_documents(directory, meta, cached, collection.find(query, projection).sort("_id", 1),
+                                       batch_size, compress)
+    return added
+
+
+def _append_documents(directory, meta, cached, cursor, batch_size, compress):
+    """Appends the documents of cursor not in cached as segments of at most batch_size rows."""
+    added = 0
+    documents = []
+    for document in cursor.batch_size(10000):
+        documents.append(document)
+        if len(documents) >= batch_size:
+            added += _append_segment(directory, meta, cached, documents, compress)
+            documents = []
+    if documents:
+        added += _append_segment(directory, meta, cached, documents, compress)
+    return added
+
+
+def _append_segment(directory, meta, cached, documents, compress):
+    ids = np.array([str(document["_id"]) for document in documents], dtype="S24")
+    new = ~np.isin(ids, cached)
+    if not new.all():
+        documents = [document for document, keep in zip(documents, new.tolist()) if keep]
+        ids = ids[new]
+        if not documents:
+            return 0
+    sensor_ids = [document.get("sensor_id") for document in documents]
+    columns = {
+        name: _column_array([document.get(name, np.nan) for document in documents], dtype)
+        for name, dtype in COLUMN_DTYPES.items()
+    }
+    sensors = _write_segment(directory, meta["segments"], sensor_ids, columns, compress)
+    np.save(_ids_path(directory, meta["segments"]), ids)
+    known = set(meta["sensors"])
+    meta["sensors"] += [sensor_id for sensor_id in sensors if sensor_id not in known]
+    meta["segments"] += 1
+    meta["rows"] += len(documents)
+    # 같은 자릿수의 16진수 문자열이므로 문자열 비교가 ObjectId 순서와 같음
+    newest = max(ids.tolist()).decode()
+    if meta["last_id"] is None or newest > meta["last_id"]:
+        meta["last_id"] = newest
+    _write_meta(directory, meta)
+    return len(documents)
+
+
+def load_daily_cache(database, date, sensor_ids=None, columns=ACCIDENT_COLUMNS, cache_dir=None):
+    """
+    Returns the cached rows of <database>/<date> as a DataFrame with columns
+    (accident_detect()'s by default), sensors in order of first appearance and
+    the rows of a sensor in collection order.
+
+    Only the sensors and columns asked for are read from disk: .npy column
+    files are memory mapped, and only those columns of a compressed .npz
+    segment are decompressed.
+    """
+    import pandas as pd
+
+    cache_dir = cache_dir or Config.SAMPLE_CACHE_DIR
+    directory = _day_directory(cache_dir, database, date)
+    meta = _read_meta(directory)
+    wanted = meta["sensors"] if sensor_ids is None else [s for s in meta["sensors"] if s in set(sensor_ids)]
+    numeric = [name for name in columns if name != "sensor_id"]
+
+    parts = {name: [] for name in columns}
+    for sensor_id in wanted:
+        sensor_directory = os.path.join(directory, sensor_id)
+        rows = 0
+        for segment in range(meta["segments"]):
+            archive = os.path.join(sensor_directory, f"{segment:05d}.npz")
+            prefix = os.path.join(sensor_directory, f"{segment:05d}_")
+            if os.path.exists(archive):
+                with np.load(archive) as segment_columns:
+                    rows += len(segment_columns["time"])
+                    for name in numeric:
+                        parts[name].append(segment_columns[name])
+            elif os.path.exists(prefix + "time.npy"):
+                rows += len(np.load(prefix + "time.npy", mmap_mode="r"))
+                for name in numeric:
+                    parts[name].append(np.load(prefix + name + ".npy", mmap_mode="r"))
+            # 둘 다 없으면 이 세그먼트에는 해당 센서의 문서가 없음
+        if "sensor_id" in parts:
+            parts["sensor_id"].append(np.full(rows, sensor_id, dtype=object))
+
+    data = {}
+    for name in columns:
+        if name == "sensor_id":
+            data[name] = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=object)
+            continue
+        # 디스크에는 int32로 두고 읽을 때 int64로 넓힘 (accident_detect의 ACCEL 제곱 합 오버플로 방지)
+        dtype = np.int64 if np.issubdtype(COLUMN_DTYPES[name], np.integer) else np.float64
+        if any(part.dtype.kind == "f" for part in parts[name]):
+            dtype = np.float64
+        data[name] = np.concatenate(parts[name], dtype=dtype) if parts[name] else np.empty(0, dtype=dtype)
+    return pd.DataFrame(data, columns=list(columns))
+
+
+if __name__ == '__main__':
+    # python -m riderLogMQReceiver.sample_cache LTE 20240101 [20240102 ...]
+    from .celery import get_client
+
+    database = sys.argv[1]
+    for date in sys.argv[2:]:
+        added = refresh_daily_cache(get_client()[database][date])
+        print(f"{database}.{date}: {added} rows cached")
@@ -1,17 +1,46 @@
 from __future__ import absolute_import
 from datetime import datetime
-import pandas as pd
 import os
 import json
 from celery import current_task
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, WTimeoutError
 
 from .celery import app, Doc_BLE, Doc_LTE, Doc_Nonesub
 from .config import Config
+from .write_buffer import write_buffer, split_by_date
+from .bucket import bucket_collection_name, write_buckets
+from .archive import get_archive, title_key
+from .dedup import dedup_cache
 
 # Initialize logging directories
 Config.ensure_log_dirs()
 
 
+# 재시도하면 성공할 수 있는 일시적 오류 (MongoDB 연결 끊김, 프라이머리 변경, 타임아웃)
+TRANSIENT_ERRORS = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+
+
+def write_error_log(log_dir_key, today, error, payload, attempts=1):
+    message = f"{type(error).__name__}: {error} (attempts: {attempts})"
+    if Config.ARCHIVE_ENABLED:
+        get_archive(log_dir_key).write(payload, title_key(payload), error=message)
+        return
+    error_log_path = os.path.join(Config.LOG_DIRS[log_dir_key], f"error_{today}.txt")
+    with open(error_log_path, "a") as file:
+        file.write(f"{datetime.today()}\nError: {message}\nPayload: {json.dumps(payload)}\n")
+
+
+def retry_or_log(log_dir_key, today, error, payload):
+    # 일시적 오류는 지수 백오프로 태스크를 다시 큐에 넣고 (워커는 바로 다음 메시지 처리),
+    # 잘못된 페이로드나 재시도 소진 시에는 에러 로그(아카이브)에 남김
+    task = current_task
+    retries = task.request.retries
+    if isinstance(error, TRANSIENT_ERRORS) and retries < Config.TASK_MAX_RETRIES:
+        countdown = min(Config.TASK_RETRY_BACKOFF * 2 ** retries, Config.TASK_RETRY_BACKOFF_MAX)
+        raise task.retry(exc=error, countdown=countdown, max_retries=Config.TASK_MAX_RETRIES)
+    write_error_log(log_dir_key, today, error, payload, attempts=retries + 1)
+
+
 @app.task
 def receiveBLE_Data(payload):
     today = datetime.today().strftime("%Y%m%d")
@@ -27,9 +56,12 @@ def receiveBLE_Data(payload):
             raise ValueError("Invalid TITLE format")
             
         # Log incoming data
-        log_path = os.path.join(Config.LOG_DIRS['ble'], f"{today}_{sensor_id}_{phone_num}.txt")
-        with open(log_path, "a") as file:
-            file.write(f"{datetime.today()}\n{json.dumps(payload)}\n")
+        if Config.ARCHIVE_ENABLED:
+            get_archive('ble').write(payload, sensor_id)
+        else:
+            log_path = os.path.join(Config.LOG_DIRS['ble'], f"{today}_{sensor_id}_{phone_num}.txt")
+            with open(log_path, "a") as file:
+                file.write(f"{datetime.today()}\n{json.dumps(payload)}\n")
             
         imu_data_list = payload["IMU"]
         gnss_data = payload["GNSS"]
@@ -55,12 +87,18 @@ def receiveBLE_Data(payload):
                     "BEARING": gnss_data["BEARING"],
                 }
                 bulk_insert_data.append(data)
-        col = Doc_BLE[date]
-        col.insert_many(bulk_insert_data)
+        if Config.BUCKET_STORAGE_ENABLED:
+            if Config.WRITE_BUFFER_ENABLED:
+                write_buffer.add(Doc_BLE, bucket_collection_name(date), bulk_insert_data, 'ble_error', bucketed=True)
+            else:
+                write_buckets(Doc_BLE[bucket_collection_name(date)], bulk_insert_data)
+        elif Config.WRITE_BUFFER_ENABLED:
+            write_buffer.add(Doc_BLE, date, bulk_insert_data, 'ble_error')
+        else:
+            col = Doc_BLE[date]
+            col.insert_many(bulk_insert_data)
     except Exception as e:
-        error_log_path = os.path.join(Config.LOG_DIRS['ble_error'], f"error_{today}.txt")
-        with open(error_log_path, "a") as file:
-            file.write(f"{datetime.today()}\nError: {str(e)}\nPayload: {json.dumps(payload)}\n")
+        retry_or_log('ble_error', today, e, payload)
         raise  # Re-raise the exception for Celery to handle
 
 
@@ -121,8 +159,21 @@ def receiveLTE_Data(payload):
                         "DISTANCE": travel_data["DISTANCE"],
                     }
                     bulk_insert_data.append(data)
+        if Config.DEDUP_ENABLED:
+            # 재전송된 페이로드의 이미 저장한 샘플 제외
+            bulk_insert_data = dedup_cache.filter(bulk_insert_data)
         if len(bulk_insert_data) == 0 :
             pass
+        elif Config.BUCKET_STORAGE_ENABLED:
+            for date, documents in split_by_date(bulk_insert_data).items():
+                if Config.WRITE_BUFFER_ENABLED:
+                    write_buffer.add(Doc_LTE, bucket_collection_name(date), documents, 'lte_error', bucketed=True)
+                else:
+                    write_buckets(Doc_LTE[bucket_collection_name(date)], documents)
+        elif Config.WRITE_BUFFER_ENABLED:
+            # 자정을 넘는 페이로드는 샘플 시간 기준으로 일별 컬렉션을 나눔
+            for date, documents in split_by_date(bulk_insert_data).items():
+                write_buffer.add(Doc_LTE, date, documents, 'lte_error')
         else :
             col = Doc_LTE[date]
             # col.insert_many(bulk_insert_data)
@@ -146,14 +197,14 @@ def receiveLTE_Data(payload):
             # except :
             #     pass
     except Exception as e:
-        error_log_path = os.path.join(Config.LOG_DIRS['lte_error'], f"error_{today}.txt")
-        with open(error_log_path, "a") as file:
-            file.write(f"{datetime.today()}\nError: {str(e)}\nPayload: {json.dumps(payload)}\n")
+        if Config.DEDUP_ENABLED and isinstance(e, TRANSIENT_ERRORS):
+            # 재시도한 페이로드의 샘플이 중복으로 걸러지지 않도록 캐시에서 제거
+            dedup_cache.forget(bulk_insert_data)
+        retry_or_log('lte_error', today, e, payload)
         raise  # Re-raise the exception for Celery to handle
 
 
-@app.task
-def receiveLTE_V2_Data(payload):
+def lte_v2_documents(payload):
     """
     LTE payload 예시 
     {
@@ -162,60 +213,80 @@ def receiveLTE_V2_Data(payload):
         "GNSS":{"POSITION":[37.60815,126.896439],"VELOCITY":0,"ALTITUDE":0,"BEARING":0}
         "TRAVEL":{"TIME":0, "DISTANCE":0}
     }
-    """  
+
+    Returns the sample documents of the payload and the date of its last IMU block.
+    """
+    TITLE = payload["TITLE"]
+    sensor_id, phone_num = TITLE.split("_") 
+    imu_data_list = payload["IMU"]
+    gnss_data = payload["GNSS"]
+    travel_data = payload["TRAVEL"]
+    bulk_insert_data = []
+    date = None
+    # LTE 주기 시간에 따라 time_interval 설정
+    time_interval = 10000
+    for imu_data in imu_data_list:
+        for time, imu_values in imu_data.items():
+            date=datetime.fromtimestamp(float(time) / 1000).strftime('%Y%m%d')
+            k = len(imu_values['ACCEL'])//3
+            lat = gnss_data["POSITION"][0]
+            lon = gnss_data["POSITION"][1]
+            velocity = gnss_data["VELOCITY"]
+            altitude = gnss_data["ALTITUDE"]      
+            for i in range(k): 
+                index = i * 3
+                location_index = i * 4
+                if "LOCATION" in payload:
+                    location_list = payload["LOCATION"]
+                    lat = location_list[location_index]
+                    lon = location_list[location_index + 1]
+                    altitude = location_list[location_index + 2]
+                    velocity = location_list[location_index + 3]            
+                data = {
+                    "sensor_id": sensor_id,
+                    "phone_num": phone_num,  # fixed phone_num: 01012345678
+                    "time": int(int(time) + i*(time_interval/k)),
+                    "ACCEL_X": imu_values["ACCEL"][index],
+                    "ACCEL_Y": imu_values["ACCEL"][index + 1],
+                    "ACCEL_Z": imu_values["ACCEL"][index + 2],
+                    "GYRO_X": imu_values["GYRO"][index],
+                    "GYRO_Y": imu_values["GYRO"][index + 1],
+                    "GYRO_Z": imu_values["GYRO"][index + 2],
+                    "PITCH": imu_values["ATTITUDE"][index],
+                    "ROLL": imu_values["ATTITUDE"][index + 1],
+                    "LAT": lat,
+                    "LON": lon,
+                    "VELOCITY": velocity,
+                    "ALTITUDE": altitude,
+                    "BEARING": gnss_data["BEARING"],
+                    "TIME": travel_data["TIME"],
+                    "DISTANCE": travel_data["DISTANCE"],
+                }
+                bulk_insert_data.append(data)
+    return bulk_insert_data, date
+
+
+def receiveLTE_V2_Data(payload):
     today = datetime.today().strftime("%Y%m%d")
     exchange = current_task.request.delivery_info.get('exchange')
 
     try :
-        TITLE = payload["TITLE"]
-        sensor_id, phone_num = TITLE.split("_") 
-        imu_data_list = payload["IMU"]
-        gnss_data = payload["GNSS"]
-        travel_data = payload["TRAVEL"]
-        bulk_insert_data = []
-        # LTE 주기 시간에 따라 time_interval 설정
-        time_interval = 10000
-        for imu_data in imu_data_list:
-            for time, imu_values in imu_data.items():
-                date=datetime.fromtimestamp(float(time) / 1000).strftime('%Y%m%d')
-                k = len(imu_values['ACCEL'])//3
-                lat = gnss_data["POSITION"][0]
-                lon = gnss_data["POSITION"][1]
-                velocity = gnss_data["VELOCITY"]
-                altitude = gnss_data["ALTITUDE"]      
-                for i in range(k): 
-                    index = i * 3
-                    location_index = i * 4
-                    if "LOCATION" in payload:
-                        location_list = payload["LOCATION"]
-                        lat = location_list[location_index]
-                        lon = location_list[location_index + 1]
-                        altitude = location_list[location_index + 2]
-                        velocity = location_list[location_index + 3]            
-                    data = {
-                        "sensor_id": sensor_id,
-                        "phone_num": phone_num,  # fixed phone_num: 01012345678
-                        "time": int(int(time) + i*(time_interval/k)),
-                        "ACCEL_X": imu_values["ACCEL"][index],
-                        "ACCEL_Y": imu_values["ACCEL"][index + 1],
-                        "ACCEL_Z": imu_values["ACCEL"][index + 2],
-                        "GYRO_X": imu_values["GYRO"][index],
-                        "GYRO_Y": imu_values["GYRO"][index + 1],
-                        "GYRO_Z": imu_values["GYRO"][index + 2],
-                        "PITCH": imu_values["ATTITUDE"][index],
-                        "ROLL": imu_values["ATTITUDE"][index + 1],
-                        "LAT": lat,
-                        "LON": lon,
-                        "VELOCITY": velocity,
-                        "ALTITUDE": altitude,
-                        "BEARING": gnss_data["BEARING"],
-                        "TIME": travel_data["TIME"],
-                        "DISTANCE": travel_data["DISTANCE"],
-                    }
-                    bulk_insert_data.append(data)      
-
+        bulk_insert_data, date = lte_v2_documents(payload)
+        if Config.DEDUP_ENABLED:
+            # 재전송된 페이로드의 이미 저장한 샘플 제외
+            bulk_insert_data = dedup_cache.filter(bulk_insert_data)
         if len(bulk_insert_data) == 0 :
             pass
+        elif Config.BUCKET_STORAGE_ENABLED:
+            for date, documents in split_by_date(bulk_insert_data).items():
+                if Config.WRITE_BUFFER_ENABLED:
+                    write_buffer.add(Doc_LTE, bucket_collection_name(date), documents, 'lte_error', bucketed=True)
+                else:
+                    write_buckets(Doc_LTE[bucket_collection_name(date)], documents)
+        elif Config.WRITE_BUFFER_ENABLED:
+            # 자정을 넘는 페이로드는 샘플 시간 기준으로 일별 컬렉션을 나눔
+            for date, documents in split_by_date(bulk_insert_data).items():
+                write_buffer.add(Doc_LTE, date, documents, 'lte_error')
         else :
             col = Doc_LTE[date]
             # col.insert_many(bulk_insert_data)
@@ -232,14 +303,46 @@ def receiveLTE_V2_Data(payload):
 
                  
     except Exception as e:
-        error_log_path = os.path.join(Config.LOG_DIRS['lte_error'], f"error_{today}.txt")
-        with open(error_log_path, "a") as file:
-            file.write(f"{datetime.today()}\nError: {str(e)}\nPayload: {json.dumps(payload)}\n")
+        if Config.DEDUP_ENABLED and isinstance(e, TRANSIENT_ERRORS):
+            # 재시도한 페이로드의 샘플이 중복으로 걸러지지 않도록 캐시에서 제거
+            dedup_cache.forget(bulk_insert_data)
+        retry_or_log('lte_error', today, e, payload)
         raise  # Re-raise the exception for Celery to handle
 
 
 
-@app.task
+def log_nonesub_payloads(payloads, today):
+    """Logs incoming Nonesub payloads (to the archive, or the daily text log opened once)."""
+    if Config.ARCHIVE_ENABLED:
+        for payload in payloads:
+            get_archive('nonesub').write(payload, title_key(payload))
+        return
+    log_path = os.path.join(Config.LOG_DIRS['nonesub'], f"Nonesub_{today}.txt")
+    with open(log_path, "a") as file:
+        for payload in payloads:
+            file.write(f"{datetime.today()}\n{json.dumps(payload)}\n")
+
+
+def nonesub_document(payload):
+    TITLE = payload["TITLE"]
+    try:
+        phone_num, date = TITLE.split("_")  # TITLE = {phone_num}_{date}
+    except ValueError:
+        raise ValueError("Invalid TITLE format")
+
+    gnss_data = payload["GNSS"]
+    time = payload["TIME"] 
+    return {
+        "phone_num": phone_num,
+        "time": int(time),
+        "LAT": gnss_data["POSITION"][0],
+        "LON": gnss_data["POSITION"][1],
+        "VELOCITY": gnss_data["VELOCITY"],
+        "ALTITUDE": gnss_data["ALTITUDE"],
+        "BEARING": gnss_data["BEARING"],
+    }
+
+
 def receiveNonesub_Data(payload):
     today = datetime.today().strftime("%Y%m%d")
     try:
@@ -248,31 +351,154 @@ def receiveNonesub_Data(payload):
             raise ValueError("Missing required fields in payload")
 
         # Log incoming data
-        log_path = os.path.join(Config.LOG_DIRS['nonesub'], f"Nonesub_{today}.txt")
-        with open(log_path, "a") as file:
-            file.write(f"{datetime.today()}\n{json.dumps(payload)}\n")
-
-        TITLE = payload["TITLE"]
-        try:
-            phone_num, date = TITLE.split("_")  # TITLE = {phone_num}_{date}
-        except ValueError:
-            raise ValueError("Invalid TITLE format")
+        log_nonesub_payloads([payload], today)
 
-        gnss_data = payload["GNSS"]
-        time = payload["TIME"] 
-        data = {
-            "phone_num": phone_num,
-            "time": int(time),
-            "LAT": gnss_data["POSITION"][0],
-            "LON": gnss_data["POSITION"][1],
-            "VELOCITY": gnss_data["VELOCITY"],
-            "ALTITUDE": gnss_data["ALTITUDE"],
-            "BEARING": gnss_data["BEARING"],
-        }
-        col = Doc_Nonesub[today]
-        col.insert_one(data)
+        data = nonesub_document(payload)
+        if Config.WRITE_BUFFER_ENABLED:
+            write_buffer.add(Doc_Nonesub, today, [data], 'nonesub_error')
+        else:
+            col = Doc_Nonesub[today]
+            col.insert_one(data)
     except Exception as e:
-        error_log_path = os.path.join(Config.LOG_DIRS['nonesub_error'], f"error_{today}.txt")
-        with open(error_log_path, "a") as file:
-            file.write(f"{datetime.today()}\nError: {str(e)}\nPayload: {json.dumps(payload)}\n")
+        retry_or_log('nonesub_error', today, e, payload)
         raise  # Re-raise the exception for Celery to handle
+
+
+def request_payload(request):
+    """Returns the payload argument of a batched task request (None when it has none)."""
+    return request.args[0] if request.args else request.kwargs.get("payload")
+
+
+def check_fields(payload, fields):
+    """Raises ValueError unless payload is a dict with every key of fields."""
+    if not isinstance(payload, dict) or not all(key in payload for key in fields):
+        raise ValueError("Missing required fields in payload")
+
+
+def write_batch(write, documents, owners, outcome, per_document=True):
+    """
+    Runs write(documents) for a batch task, where owners[i] is the request id
+    documents[i] came from, and records the requests whose documents were not
+    stored: outcome["requeued"] for transient errors, outcome["rejected"] (with
+    the error) otherwise. With per_document, the write errors of an unordered
+    insert_many are mapped back to their requests and duplicate key errors
+    count as stored; otherwise any error fails all the requests.
+    """
+    try:
+        write(documents)
+    except BulkWriteError as e:
+        if not per_document:
+            for owner in owners:
+                outcome["rejected"].setdefault(owner, e)
+            return
+        errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        for error in errors:
+            outcome["rejected"].setdefault(owners[error["index"]], e)
+    except TRANSIENT_ERRORS:
+        outcome["requeued"].update(owners)
+    except Exception as e:
+        for owner in owners:
+            outcome["rejected"].setdefault(owner, e)
+
+
+def settle_batch(requests, outcome, log_dir_key, today, documents=None):
+    """Logs the errors of rejected requests and returns the result PerMessageAckBatches expects."""
+    payloads = {request.id: request_payload(request) for request in requests}
+    requeued = outcome["requeued"]
+    rejected = {id: error for id, error in outcome["rejected"].items() if id not in requeued}
+    for id, error in rejected.items():
+        write_error_log(log_dir_key, today, error, payloads[id])
+    if Config.DEDUP_ENABLED and documents:
+        # 저장하지 못한 페이로드의 샘플은 재전송되면 다시 저장하도록 캐시에서 제거
+        for id in set(rejected) | requeued:
+            dedup_cache.forget(documents.get(id))
+    return {"rejected": list(rejected), "requeued": list(requeued)}
+
+
+def receiveNonesub_Batch(requests):
+    """Batch version of receiveNonesub_Data: one log write and one insert_many for all requests."""
+    today = datetime.today().strftime("%Y%m%d")
+    outcome = {"rejected": {}, "requeued": set()}
+    valid, documents, owners = [], [], []
+    for request in requests:
+        # 요청별로 검증하여 잘못된 요청(null 페이로드 등)만 reject
+        try:
+            payload = request_payload(request)
+            check_fields(payload, ["TITLE", "GNSS", "TIME"])
+        except Exception as e:
+            outcome["rejected"][request.id] = e
+            continue
+        valid.append(payload)
+        try:
+            documents.append(nonesub_document(payload))
+            owners.append(request.id)
+        except Exception as e:
+            outcome["rejected"][request.id] = e
+    log_nonesub_payloads(valid, today)
+
+    if documents:
+        write_batch(lambda batch: Doc_Nonesub[today].insert_many(batch, ordered=False), documents, owners, outcome)
+    return settle_batch(requests, outcome, 'nonesub_error', today)
+
+
+def receiveLTE_V2_Batch(requests):
+    """
+    Batch version of receiveLTE_V2_Data: the samples of all requests are
+    written with one unordered insert_many (or bucket bulk_write) per daily
+    collection, bypassing the write-behind buffer.
+    """
+    from pymongo import WriteConcern
+
+    today = datetime.today().strftime("%Y%m%d")
+    outcome = {"rejected": {}, "requeued": set()}
+    documents = {}
+    groups = {}
+    for request in requests:
+        try:
+            payload = request_payload(request)
+            bulk_insert_data, _ = lte_v2_documents(payload)
+        except Exception as e:
+            outcome["rejected"][request.id] = e
+            continue
+        if Config.DEDUP_ENABLED:
+            # 재전송된 페이로드의 이미 저장한 샘플 제외
+            bulk_insert_data = dedup_cache.filter(bulk_insert_data)
+        if not bulk_insert_data:
+            continue
+        documents[request.id] = bulk_insert_data
+        for date, day_documents in split_by_date(bulk_insert_data).items():
+            group = groups.setdefault(date, ([], []))
+            group[0].extend(day_documents)
+            group[1].extend([request.id] * len(day_documents))
+
+    for date, (day_documents, owners) in groups.items():
+        if Config.BUCKET_STORAGE_ENABLED:
+            # 버킷 upsert는 샘플 단위로 나눌 수 없으므로 컬렉션 단위로 성공/실패 처리
+            collection = Doc_LTE[bucket_collection_name(date)]
+            write_batch(lambda batch: write_buckets(collection, batch), day_documents, owners, outcome, per_document=False)
+        else:
+            collection = Doc_LTE[date].with_options(write_concern=WriteConcern(w=1, j=False))
+            write_batch(lambda batch: collection.insert_many(batch, ordered=False), day_documents, owners, outcome)
+    return settle_batch(requests, outcome, 'lte_error', today, documents)
+
+
+def register_task(name, task, batch_task):
+    """
+    Registers task under its original name, or batch_task when its kind is in
+    Config.BATCH_TASKS (same message name, so producers are unchanged).
+    """
+    full_name = f"{__name__}.{name}"
+    kind = name[len("receive"):-len("_Data")].replace("_", "").lower()
+    if kind not in Config.BATCH_TASKS:
+        return app.task(name=full_name)(task)
+    from .batch import PerMessageAckBatches
+    return app.task(
+        name=full_name,
+        base=PerMessageAckBatches,
+        flush_every=Config.BATCH_MAX_MESSAGES,
+        flush_interval=Config.BATCH_MAX_WAIT_MS / 1000,
+    )(batch_task)
+
+
+receiveLTE_V2_Data = register_task("receiveLTE_V2_Data", receiveLTE_V2_Data, receiveLTE_V2_Batch)
+receiveNonesub_Data = register_task("receiveNonesub_Data", receiveNonesub_Data, receiveNonesub_Batch)
@@ -0,0 +1,206 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId, json_util
+from celery.signals import worker_process_shutdown
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+
+from .bucket import write_buckets
+from .config import Config
+
+# 중복 키 오류는 이미 저장된 문서이므로 실패로 보지 않음
+DUPLICATE_KEY = 11000
+
+
+class WriteBehindBuffer:
+    """
+    Per-process write-behind buffer for MongoDB inserts.
+
+    Documents from many task invocations are grouped by (database, collection)
+    and written with large unordered insert_many calls once max_docs documents
+    are buffered or the oldest document is max_age seconds old. Bucketed
+    collections are written as bucket upserts (see bucket.py) instead of inserts.
+
+    Tasks are acknowledged once their documents are buffered, so the documents
+    of a failed write are appended to failed_writes_<date>.jsonl in the log
+    directory of the data type, to be written again with replay_failed_writes().
+    """
+
+    def __init__(self, max_docs, max_age):
+        self.max_docs = max_docs
+        self.max_age = max_age
+        self._reset()
+
+    def _reset(self):
+        # fork 이후 자식 프로세스에서는 부모의 버퍼/스레드를 물려받지 않도록 새로 초기화
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._databases = {}
+        self._collections = {}
+        self._count = 0
+        self._oldest = None
+        self._flusher = None
+
+    def add(self, database, collection_name, documents, error_log_key, bucketed=False):
+        """Buffers documents for database[collection_name]."""
+        if not documents:
+            return
+        if self._pid != os.getpid():
+            self._reset()
+        with self._lock:
+            key = (database.name, collection_name, error_log_key, bucketed)
+            self._databases[database.name] = database
+            self._groups.setdefault(key, []).extend(documents)
+            self._count += len(documents)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = self._count >= self.max_docs
+        self._ensure_flusher()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes every buffered document. Safe to call from any thread."""
+        if self._pid != os.getpid():
+            self._reset()
+            return
+        with self._lock:
+            groups, self._groups = self._groups, {}
+            self._count = 0
+            self._oldest = None
+        for (database_name, collection_name, error_log_key, bucketed), documents in groups.items():
+            try:
+                collection = self._collection(database_name, collection_name)
+                if bucketed:
+                    write_buckets(collection, documents)
+                else:
+                    collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                write_errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+                if not write_errors:
+                    continue
+                # 버킷 upsert의 index는 문서가 아닌 update 기준이므로 전체를 다시 씀 (이미 저장된 샘플은 건너뜀)
+                failed = documents if bucketed else [documents[error["index"]] for error in write_errors]
+                self._log_failed(error_log_key, database_name, collection_name, bucketed, failed,
+                                 f"{len(write_errors)} of {len(documents)} documents failed: {write_errors[0].get('errmsg')}")
+            except Exception as e:
+                self._log_failed(error_log_key, database_name, collection_name, bucketed, documents,
+                                 f"{len(documents)} documents failed: {e}")
+
+    def _collection(self, database_name, collection_name):
+        # with_options 는 매번 새 객체를 만들기 때문에 컬렉션 핸들을 캐시
+        key = (database_name, collection_name)
+        collection = self._collections.get(key)
+        if collection is None:
+            collection = self._databases[database_name][collection_name].with_options(
+                write_concern=WriteConcern(w=1, j=False))
+            self._collections[key] = collection
+        return collection
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="write-behind-flusher", daemon=True)
+                self._flusher.start()
+
+    def _run_flusher(self):
+        # 새 문서가 들어오지 않아도 max_age 가 지나면 버퍼를 비움
+        while True:
+            time.sleep(self.max_age / 2)
+            oldest = self._oldest
+            if oldest is not None and time.monotonic() - oldest >= self.max_age:
+                self.flush()
+
+    @staticmethod
+    def _log_failed(error_log_key, database_name, collection_name, bucketed, documents, message):
+        today = datetime.today().strftime("%Y%m%d")
+        log_dir = Config.LOG_DIRS[error_log_key]
+        failed_path = os.path.join(log_dir, f"failed_writes_{today}.jsonl")
+        if not bucketed:
+            # insert_many 전에 실패한 문서도 _id를 정해 두어 재실행이 멱등이 되도록 함
+            for document in documents:
+                document.setdefault("_id", ObjectId())
+        record = {
+            "database": database_name,
+            "collection": collection_name,
+            "bucketed": bucketed,
+            "error": message,
+            "documents": documents,
+        }
+        # _id 등 BSON 타입을 보존하여 재실행 시 같은 문서로 저장 (이미 저장된 문서는 중복 키로 건너뜀)
+        with open(failed_path, "a") as file:
+            file.write(json_util.dumps(record) + "\n")
+        error_log_path = os.path.join(log_dir, f"error_{today}.txt")
+        with open(error_log_path, "a") as file:
+            file.write(f"{datetime.today()}\nWrite-behind error: {database_name}.{collection_name}: {message} "
+                       f"(saved to {failed_path})\n")
+
+
+def replay_failed_writes(client, path):
+    """
+    Writes the documents of a failed_writes_<date>.jsonl file again.
+    Returns (written, failed) document counts; documents already stored count as written.
+    """
+    written = failed = 0
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json_util.loads(line)
+            documents = record["documents"]
+            collection = client[record["database"]][record["collection"]]
+            try:
+                if record["bucketed"]:
+                    write_buckets(collection, documents)
+                else:
+                    collection.insert_many(documents, ordered=False)
+                written += len(documents)
+            except BulkWriteError as e:
+                errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+                if record["bucketed"] and errors:
+                    errors = documents
+                written += len(documents) - len(errors)
+                failed += len(errors)
+    return written, failed
+
+
+def split_by_date(documents):
+    """Groups documents into daily collections (YYYYMMDD) by their sample time."""
+    times = [document["time"] for document in documents]
+    first = datetime.fromtimestamp(min(times) / 1000).strftime('%Y%m%d')
+    if first == datetime.fromtimestamp(max(times) / 1000).strftime('%Y%m%d'):
+        return {first: documents}
+    # 자정을 넘는 페이로드만 샘플별로 나눔
+    groups = {}
+    for document in documents:
+        date = datetime.fromtimestamp(document["time"] / 1000).strftime('%Y%m%d')
+        groups.setdefault(date, []).append(document)
+    return groups
+
+
+write_buffer = WriteBehindBuffer(Config.WRITE_BUFFER_MAX_DOCS, Config.WRITE_BUFFER_MAX_AGE)
+
+
+@worker_process_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    write_buffer.flush()
+
+
+atexit.register(write_buffer.flush)
+
+
+if __name__ == '__main__':
+    # python -m riderLogMQReceiver.write_buffer /home/ubuntu/log/LTE_ERROR/failed_writes_20240101.jsonl [...]
+    from .celery import get_client
+
+    for path in sys.argv[1:]:
+        written, failed = replay_failed_writes(get_client(), path)
+        print(f"{path}: {written} documents written, {failed} failed")